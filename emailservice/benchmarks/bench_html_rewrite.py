@@ -0,0 +1,100 @@
+"""
+Benchmarks the CID image embedding of `convert_eml_to_html` against the previous BeautifulSoup implementation.
+
+Usage (from the emailservice directory):
+    python benchmarks/bench_html_rewrite.py [--repeat 5] [--dump-corpus DIR]
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+from email import policy
+from email.parser import BytesParser
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bs4 import BeautifulSoup
+from html_rewriter import embed_cid_images
+from corpus import generate_corpus
+
+def extract_parts(eml_data: bytes):
+    """Returns the HTML body and the data URI of every inline image, like `convert_eml_to_html` does."""
+    msg = BytesParser(policy=policy.default).parsebytes(eml_data)
+    html_content = ""
+    image_cid_map = {}
+    for part in msg.walk():
+        if part.get_content_type() == 'text/html':
+            html_content = part.get_payload(decode=True).decode('utf-8')
+        elif part.get('Content-ID'):
+            image_type = part.get_content_type().split('/')[1]
+            base64_image = base64.b64encode(part.get_payload(decode=True)).decode('ascii')
+            image_cid_map[part['Content-ID'][1:-1]] = f"data:image/{image_type};base64,{base64_image}"
+    return html_content, image_cid_map
+
+def legacy_rewrite(html_content: str, image_cid_map: dict) -> str:
+    """The previous implementation: full BeautifulSoup parse, then prettify."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    for img in soup.find_all('img'):
+        src = img.get('src')
+        if src and src.startswith('cid:'):
+            cid = src[4:]
+            if cid in image_cid_map:
+                img['src'] = image_cid_map[cid]
+    return soup.prettify()
+
+def fast_rewrite(html_content: str, image_cid_map: dict) -> str:
+    return embed_cid_images(html_content, image_cid_map.get)
+
+def measure(rewrite, html_content: str, image_cid_map: dict, repeat: int) -> float:
+    """Returns the best wall time of `repeat` runs, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rewrite(html_content, image_cid_map)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per message, the best run is reported.')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the generated corpus.')
+    parser.add_argument('--dump-corpus', metavar='DIR', help='Also write the generated EML files to DIR.')
+    args = parser.parse_args()
+
+    corpus = generate_corpus(seed=args.seed)
+    if args.dump_corpus:
+        os.makedirs(args.dump_corpus, exist_ok=True)
+        for name, messages in corpus.items():
+            for index, eml_data in enumerate(messages):
+                with open(os.path.join(args.dump_corpus, f'{name}_{index}.eml'), 'wb') as f:
+                    f.write(eml_data)
+
+    print(f"{'shape':<14}{'html MB':>10}{'images':>8}{'legacy MB/s':>14}{'fast MB/s':>12}{'speedup':>10}")
+    total_bytes = total_legacy = total_fast = 0.0
+    for name, messages in corpus.items():
+        for eml_data in messages:
+            html_content, image_cid_map = extract_parts(eml_data)
+            size_mb = len(html_content.encode('utf-8')) / 1_000_000
+
+            # Both implementations must embed the same images
+            legacy_html = legacy_rewrite(html_content, image_cid_map)
+            fast_html = fast_rewrite(html_content, image_cid_map)
+            for data_uri in image_cid_map.values():
+                assert (data_uri in legacy_html) == (data_uri in fast_html), f"{name}: implementations disagree"
+
+            legacy_time = measure(legacy_rewrite, html_content, image_cid_map, args.repeat)
+            fast_time = measure(fast_rewrite, html_content, image_cid_map, args.repeat)
+            total_bytes += size_mb
+            total_legacy += legacy_time
+            total_fast += fast_time
+            print(f"{name:<14}{size_mb:>10.3f}{len(image_cid_map):>8}{size_mb / legacy_time:>14.1f}"
+                  f"{size_mb / fast_time:>12.1f}{legacy_time / fast_time:>9.1f}x")
+
+    print(f"{'total':<14}{total_bytes:>10.3f}{'':>8}{total_bytes / total_legacy:>14.1f}"
+          f"{total_bytes / total_fast:>12.1f}{total_legacy / total_fast:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Benchmarks the end to end ingestion of `TaskProcessor.process_incoming_emails`, fully offline.
+
+Gmail is replaced by an in-memory fake serving a synthetic corpus, while the webservice and the ftpservice run
+in-process with uvicorn on a temporary database and upload directory. Reports the emails per second, the p50/p99
+latency of every ingestion stage, and the Gmail and webservice API calls.
+Needs the requirements of the webservice and the ftpservice installed next to the emailservice ones.
+
+Usage (from the emailservice directory):
+    python benchmarks/bench_ingestion.py [--emails 200] [--threads 50] [--latency 0.02] [--batch-size 5]
+"""
+import argparse
+import functools
+import importlib.util
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+base_dir = os.path.dirname(benchmarks_dir)
+repo_dir = os.path.dirname(base_dir)
+sys.path.append(base_dir)
+sys.path.append(benchmarks_dir)
+
+BENCH_USER_NAME = 'bench'
+BENCH_PASSWORD = 'bench'
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def load_app(name: str, path: str):
+    """
+    Imports the FastAPI app of a service, under its own module name as every service has a `main` module.
+    Top-level modules of the service named like an emailservice module (e.g. `metrics`) are dropped afterwards,
+    so the emailservice imports its own.
+    """
+    service_dir = os.path.dirname(path)
+    sys.path.insert(0, service_dir)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    sys.path.remove(service_dir)
+    for module_name, loaded in list(sys.modules.items()):
+        if os.path.dirname(getattr(loaded, '__file__', None) or '') == service_dir and os.path.exists(os.path.join(base_dir, f'{module_name}.py')):
+            del sys.modules[module_name]
+    return module.app
+
+def serve(app, port: int):
+    """Runs an app with uvicorn in a background thread, returns once it accepts connections."""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', lifespan='off'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[round(fraction * (len(ordered) - 1))]
+
+def timed(durations: list, function):
+    """Wraps a function to record the duration of every call."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            durations.append(time.perf_counter() - start)
+    return wrapper
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=200, help='Unread emails in the fake mailbox.')
+    parser.add_argument('--threads', type=int, default=50, help='Threads the emails are spread over.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Mean latency of a Gmail call, in seconds.')
+    parser.add_argument('--jitter', type=float, default=0.005, help='Maximum deviation from the mean Gmail latency, in seconds.')
+    parser.add_argument('--batch-size', type=int, default=5, help='The max_results of every process_incoming_emails call.')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the generated corpus.')
+    args = parser.parse_args()
+
+    # Everything the services write goes to a temporary directory
+    work_dir = tempfile.mkdtemp(prefix='bench_ingestion_')
+    os.chdir(work_dir)
+    ws_port, ftp_port = free_port(), free_port()
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{os.path.join(work_dir, "tasks.db")}',
+        'FTP_SERVER': f'http://127.0.0.1:{ftp_port}',
+        'UPLOAD_DIRECTORY': os.path.join(work_dir, 'uploads'),
+        'ALLOW_ORIGIN': 'http://localhost:3000',
+        'API_BASE_URL': f'http://127.0.0.1:{ws_port}',
+        'UI_BASE_URL': 'http://localhost:3000',
+        'USER_NAME': BENCH_USER_NAME,
+        'PASSWORD': BENCH_PASSWORD,
+        'BOT_EMAIL': 'bot@gmail.com',
+        'INGESTION_JOURNAL_FILE': os.path.join(work_dir, 'journal', 'ingestion.db'),
+    })
+
+    webservice_app = load_app('webservice_main', os.path.join(repo_dir, 'webservice', 'main.py'))
+    ftpservice_app = load_app('ftpservice_main', os.path.join(repo_dir, 'ftpservice', 'main.py'))
+    logging.getLogger().setLevel(logging.WARNING)  # the webservice logs every request to the console
+
+    # Count the webservice calls per route
+    api_calls = Counter()
+    @webservice_app.middleware('http')
+    async def count_api_calls(request, call_next):
+        response = await call_next(request)
+        route = request.scope.get('route')
+        api_calls[f"{request.method} {route.path if route else request.url.path}"] += 1
+        return response
+
+    serve(webservice_app, ws_port)
+    serve(ftpservice_app, ftp_port)
+
+    import requests
+    from email_helper import EmailHelper
+    from fake_gmail import FakeGmail
+    from task_processor import TaskProcessor
+    os.chdir(work_dir)  # email_helper switches to the emailservice directory on import
+
+    requests.post(f'http://127.0.0.1:{ws_port}/api/users/signup', json={'username': BENCH_USER_NAME, 'password': BENCH_PASSWORD}).raise_for_status()
+    api_calls.clear()
+
+    print(f"Generating {args.emails} emails over {args.threads} threads...")
+    gmail = FakeGmail.from_corpus(args.emails, args.threads, seed=args.seed, latency=args.latency, jitter=args.jitter)
+    email_helper = EmailHelper(bot_email=os.environ['BOT_EMAIL'], gmail_service_factory=gmail.service)
+    task_processor = TaskProcessor(email_helper=email_helper)
+
+    # Time every stage of the ingestion journal
+    stages = defaultdict(list)
+    email_helper.get_email_details = timed(stages['fetch'], email_helper.get_email_details)
+    email_helper.download_eml = timed(stages['download'], email_helper.download_eml)
+    email_helper.convert_eml_to_html = timed(stages['convert'], email_helper.convert_eml_to_html)
+    task_processor.upload_email = timed(stages['upload'], task_processor.upload_email)
+    task_processor.commit_email = timed(stages['commit'], task_processor.commit_email)
+    polls = []
+    process_incoming_emails = timed(polls, task_processor.process_incoming_emails)
+
+    start = time.perf_counter()
+    while gmail.unread_count():
+        process_incoming_emails(max_results=args.batch_size, download_email=True)
+        if len(polls) > 10 * args.emails:
+            print("Emails are not being committed, giving up.")
+            break
+    elapsed = time.perf_counter() - start
+
+    ingested = len(stages['upload'])
+    print(f"\nIngested {ingested} emails, marked {args.emails - gmail.unread_count()} as read in {elapsed:.2f}s "
+          f"with {len(polls)} polls: {ingested / elapsed:.1f} emails/s, {args.emails / elapsed:.1f} messages/s\n")
+
+    print(f"{'stage':<10}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}{'total s':>10}")
+    for name in ('fetch', 'download', 'convert', 'upload', 'commit'):
+        durations = stages[name]
+        if durations:
+            print(f"{name:<10}{len(durations):>8}{percentile(durations, 0.5) * 1000:>10.1f}"
+                  f"{percentile(durations, 0.99) * 1000:>10.1f}{sum(durations):>10.2f}")
+
+    print(f"\n{'gmail call':<40}{'calls':>8}")
+    for method, count in sorted(gmail.calls.items()):
+        print(f"{method:<40}{count:>8}")
+    print(f"{'quota units':<40}{gmail.quota_units():>8}")
+
+    print(f"\n{'webservice call':<40}{'calls':>8}")
+    for route, count in sorted(api_calls.items()):
+        print(f"{route:<40}{count:>8}")
+    print(f"\nDatabase, uploads and logs kept in {work_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Synthetic, real-world-shaped emails for the emailservice benchmarks. Generation is deterministic for a given seed."""
+import random
+from email.message import EmailMessage
+from email.utils import make_msgid, formatdate
+from typing import Dict, List
+
+WORDS = ("task issue build release deploy failing test please check update review regression server client "
+         "customer report attached screenshot logs error crash timeout fixed verify environment staging").split()
+
+def _sentence(rng: random.Random, length: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+def _image(rng: random.Random, size: int) -> bytes:
+    # PNG signature followed by random payload, the content does not matter for conversion
+    return b"\x89PNG\r\n\x1a\n" + rng.randbytes(size)
+
+def _message(subject: str, html: str, images: Dict[str, bytes], sender: str = "tester@gmail.com",
+             to: str = "developer@gmail.com") -> bytes:
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Date"] = formatdate(0)
+    msg["Message-ID"] = make_msgid(domain="gmail.com")
+    msg.set_content("This email requires an HTML capable client.")
+    msg.add_alternative(html, subtype="html")
+    html_part = msg.get_payload()[1]
+    for cid, data in images.items():
+        html_part.add_related(data, maintype="image", subtype="png", cid=f"<{cid}>")
+    return msg.as_bytes()
+
+def short_reply(rng: random.Random) -> bytes:
+    """A one paragraph reply with an inline signature logo."""
+    html = (f"<html><body><div dir=\"ltr\"><p>{_sentence(rng)}</p><p>{_sentence(rng)}</p>"
+            f"<div class=\"gmail_signature\"><img src=\"cid:logo@sig\" width=\"80\" alt=\"logo\"></div></div></body></html>")
+    return _message("Re: Build failing", html, {"logo@sig": _image(rng, 4_000)})
+
+def long_thread(rng: random.Random, depth: int = 30) -> bytes:
+    """A long reply chain, every previous message quoted in a nested blockquote, a few screenshots."""
+    html = ""
+    images = {}
+    for index in range(depth):
+        screenshot = ""
+        if index % 10 == 0:
+            cid = f"screenshot{index}@thread"
+            images[cid] = _image(rng, 60_000)
+            screenshot = f"<img src=\"cid:{cid}\" alt=\"screenshot {index}\" style=\"max-width:100%\">"
+        paragraphs = "".join(f"<p>{_sentence(rng, 20)}</p>" for _ in range(4))
+        html = (f"<div>{paragraphs}{screenshot}<div class=\"gmail_quote\"><div class=\"gmail_attr\">On Mon, "
+                f"{_sentence(rng, 5)} wrote:</div><blockquote class=\"gmail_quote\" style=\"margin:0 0 0 .8ex;"
+                f"border-left:1px #ccc solid;padding-left:1ex\">{html}</blockquote></div></div>")
+    return _message("Re: Regression in staging", f"<html><body>{html}</body></html>", images)
+
+def newsletter(rng: random.Random, rows: int = 60) -> bytes:
+    """A table based newsletter layout with many inline images, remote images and inline styles."""
+    images = {}
+    cells = []
+    for index in range(rows):
+        cid = f"banner{index}@news"
+        images[cid] = _image(rng, 15_000)
+        cells.append(
+            f"<tr><td style=\"padding:12px;font-family:Arial,sans-serif;font-size:14px;color:#333\">"
+            f"<img src=\"cid:{cid}\" width=\"560\" height=\"120\" alt=\"Banner &amp; {index}\" style=\"display:block\">"
+            f"<h2 style=\"margin:8px 0\">{_sentence(rng, 6)}</h2><p>{_sentence(rng, 40)}</p>"
+            f"<img src='https://cdn.example.com/icons/{index}.png' width=16 height=16 alt=''>"
+            f"<a href=\"https://example.com/article/{index}?utm_source=newsletter&amp;utm_medium=email\">Read more &gt;</a>"
+            f"</td></tr>")
+    html = (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><style>td {{ border: 0; }} .x > .y {{ color: red; }}"
+            f"</style></head><body><table width=\"600\" cellpadding=\"0\" cellspacing=\"0\" align=\"center\">"
+            f"{''.join(cells)}</table></body></html>")
+    return _message("Weekly release notes", html, images)
+
+def marketing(rng: random.Random, pixels: int = 400) -> bytes:
+    """A large marketing email full of tracking pixels and remote images, with a single inline logo."""
+    blocks = []
+    for index in range(pixels):
+        blocks.append(
+            f"<div class=\"block\"><img src=\"https://track.example.com/p/{rng.getrandbits(64):x}.gif\" width=\"1\" "
+            f"height=\"1\" alt=\"\"><p>{_sentence(rng, 25)}</p><!-- <img src=\"cid:unused{index}\"> --></div>")
+    html = (f"<html><body><img src=\"cid:logo@brand\" alt=\"brand\"><center>{''.join(blocks)}</center></body></html>")
+    return _message("Don't miss out", html, {"logo@brand": _image(rng, 8_000)})
+
+SHAPES = {
+    "short_reply": short_reply,
+    "long_thread": long_thread,
+    "newsletter": newsletter,
+    "marketing": marketing,
+}
+
+def generate_corpus(seed: int = 42, copies: int = 1) -> Dict[str, List[bytes]]:
+    """Generates `copies` EML messages of every shape."""
+    rng = random.Random(seed)
+    return {name: [shape(rng) for _ in range(copies)] for name, shape in SHAPES.items()}
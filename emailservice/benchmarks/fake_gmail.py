@@ -0,0 +1,174 @@
+"""
+An in-memory stand-in for the Gmail API, serving a synthetic mailbox to `EmailHelper`.
+
+Only the calls made by `EmailHelper` are implemented. Every call sleeps for the configured latency and is counted,
+so benchmarks can report the Gmail calls and quota an ingestion run would cost.
+"""
+import base64
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+from email import policy
+from email.parser import BytesParser
+from typing import Any, Callable, Dict, List, Optional
+
+from corpus import SHAPES
+
+# Gmail quota units per call, see https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.modify': 5,
+    'messages.send': 100,
+    'threads.get': 10,
+}
+
+class FakeRequest:
+    """A prepared call, run by `execute` like a googleapiclient HttpRequest."""
+
+    def __init__(self, gmail: 'FakeGmail', method: str, handler: Callable[[], Any]) -> None:
+        self.gmail = gmail
+        self.method = method
+        self.handler = handler
+
+    def execute(self) -> Any:
+        self.gmail.record_call(self.method)
+        return self.handler()
+
+class FakeMessages:
+    def __init__(self, gmail: 'FakeGmail') -> None:
+        self.gmail = gmail
+
+    def list(self, userId: str, q: str = '', maxResults: int = 100) -> FakeRequest:
+        return FakeRequest(self.gmail, 'messages.list', lambda: self.gmail.list_unread(maxResults))
+
+    def get(self, userId: str, id: str, format: str = 'full', metadataHeaders: Optional[List[str]] = None) -> FakeRequest:
+        return FakeRequest(self.gmail, 'messages.get', lambda: self.gmail.get_message(id, format, metadataHeaders))
+
+    def modify(self, userId: str, id: str, body: dict) -> FakeRequest:
+        return FakeRequest(self.gmail, 'messages.modify', lambda: self.gmail.modify_labels(id, body.get('removeLabelIds', [])))
+
+    def send(self, userId: str, body: dict) -> FakeRequest:
+        return FakeRequest(self.gmail, 'messages.send', lambda: {'id': f"sent{next(self.gmail.sent_ids)}", 'threadId': body.get('threadId')})
+
+class FakeThreads:
+    def __init__(self, gmail: 'FakeGmail') -> None:
+        self.gmail = gmail
+
+    def get(self, userId: str, id: str, format: str = 'full', metadataHeaders: Optional[List[str]] = None) -> FakeRequest:
+        return FakeRequest(self.gmail, 'threads.get', lambda: self.gmail.get_thread(id, format, metadataHeaders))
+
+class FakeUsers:
+    def __init__(self, gmail: 'FakeGmail') -> None:
+        self.gmail = gmail
+
+    def messages(self) -> FakeMessages:
+        return FakeMessages(self.gmail)
+
+    def threads(self) -> FakeThreads:
+        return FakeThreads(self.gmail)
+
+class FakeGmailService:
+    """What `googleapiclient.discovery.build('gmail', 'v1')` returns, backed by a `FakeGmail` mailbox."""
+
+    def __init__(self, gmail: 'FakeGmail') -> None:
+        self.gmail = gmail
+
+    def users(self) -> FakeUsers:
+        return FakeUsers(self.gmail)
+
+class FakeGmail:
+    """
+    A mailbox of synthetic emails spread over threads, shared by all the services it builds.
+
+    Pass `FakeGmail.service` as the `gmail_service_factory` of an `EmailHelper`.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: int = 42) -> None:
+        """
+        Creates an empty mailbox.
+
+        Args:
+            latency (float): The mean time in seconds every call takes.
+            jitter (float): The maximum random deviation in seconds from the mean latency.
+            seed (int): The seed of the latency jitter.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.messages: Dict[str, dict] = {}  # message ID -> message, in arrival order
+        self.calls = Counter()
+        self.sent_ids = itertools.count()
+
+    @classmethod
+    def from_corpus(cls, emails: int, threads: int, seed: int = 42, **kwargs) -> 'FakeGmail':
+        """Creates a mailbox of `emails` unread emails of every corpus shape in turn, spread over `threads` threads."""
+        gmail = cls(seed=seed, **kwargs)
+        rng = random.Random(seed)
+        shapes = list(SHAPES.values())
+        for index in range(emails):
+            gmail.add_message(f"msg{index:06d}", f"thread{index % threads:06d}", shapes[index % len(shapes)](rng))
+        return gmail
+
+    def service(self) -> FakeGmailService:
+        """Builds a Gmail service on this mailbox."""
+        return FakeGmailService(self)
+
+    def add_message(self, message_id: str, thread_id: str, eml_data: bytes) -> None:
+        """Adds an unread email to the mailbox."""
+        headers = BytesParser(policy=policy.default).parsebytes(eml_data, headersonly=True)
+        with self.lock:
+            self.messages[message_id] = {
+                'id': message_id,
+                'threadId': thread_id,
+                'labelIds': ['INBOX', 'UNREAD'],
+                'headers': [{'name': name, 'value': str(value)} for name, value in headers.items()],
+                'raw': eml_data,
+            }
+
+    def record_call(self, method: str) -> None:
+        with self.lock:
+            self.calls[method] += 1
+            delay = self.latency + self.rng.uniform(-self.jitter, self.jitter) if self.latency else 0
+        if delay > 0:
+            time.sleep(delay)
+
+    def unread_count(self) -> int:
+        with self.lock:
+            return sum('UNREAD' in message['labelIds'] for message in self.messages.values())
+
+    def quota_units(self) -> int:
+        """Returns the Gmail quota units the calls so far would have cost."""
+        with self.lock:
+            return sum(QUOTA_UNITS.get(method, 0) * count for method, count in self.calls.items())
+
+    def list_unread(self, max_results: int) -> dict:
+        with self.lock:
+            unread = [message for message in self.messages.values() if 'UNREAD' in message['labelIds']]
+        listed = [{'id': message['id'], 'threadId': message['threadId']} for message in unread[:max_results]]
+        return {'messages': listed, 'resultSizeEstimate': len(unread)} if listed else {'resultSizeEstimate': 0}
+
+    def get_message(self, message_id: str, format: str = 'full', metadata_headers: Optional[List[str]] = None) -> dict:
+        with self.lock:
+            message = self.messages[message_id]
+        if format == 'raw':
+            return {'id': message_id, 'threadId': message['threadId'], 'raw': base64.urlsafe_b64encode(message['raw']).decode('ascii')}
+        headers = message['headers']
+        if metadata_headers:
+            headers = [header for header in headers if header['name'] in metadata_headers]
+        return {'id': message_id, 'threadId': message['threadId'], 'labelIds': list(message['labelIds']),
+                'snippet': '', 'payload': {'headers': headers}}
+
+    def get_thread(self, thread_id: str, format: str = 'full', metadata_headers: Optional[List[str]] = None) -> dict:
+        with self.lock:
+            message_ids = [message['id'] for message in self.messages.values() if message['threadId'] == thread_id]
+        return {'id': thread_id, 'messages': [self.get_message(message_id, 'metadata', metadata_headers) for message_id in message_ids]}
+
+    def modify_labels(self, message_id: str, remove_label_ids: List[str]) -> dict:
+        with self.lock:
+            message = self.messages[message_id]
+            message['labelIds'] = [label for label in message['labelIds'] if label not in remove_label_ids]
+            return {'id': message_id, 'labelIds': list(message['labelIds'])}
@@ -5,16 +5,18 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 import os.path
 import base64
+import threading
 from email.mime.text import MIMEText
 import re
 
 # convert *.eml to *.html
 from email import policy
 from email.parser import BytesParser
-from bs4 import BeautifulSoup
+from html_rewriter import embed_cid_images
 
 # type hinting
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable
+from googleapiclient.errors import HttpError
 
 import logging
 
@@ -37,17 +39,59 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.addons.current.message.readonly', # Read the current message
 ]
 
+# Headers read from the thread when replying to it
+REPLY_HEADERS = ['From', 'To', 'Cc', 'Subject', 'Message-ID']
+# Headers read from an incoming email
+DETAIL_HEADERS = ['From', 'To', 'Cc', 'Subject']
+
+# Reasons Gmail gives when a request is rejected for exceeding the quota
+QUOTA_ERROR_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded'}
+# Wait time when a quota error has no Retry-After header
+DEFAULT_RETRY_AFTER = 60
+
+# Emails larger than this (in bytes) are not converted, the message exists as several full copies while converting
+MAX_EMAIL_SIZE = int(os.getenv('MAX_EMAIL_SIZE', 25 * 1024 * 1024))
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Returns the seconds to wait before calling Gmail again if the error is a quota error, None otherwise."""
+    if not isinstance(error, HttpError):
+        return None
+    reasons = {detail.get('reason') for detail in error.error_details if isinstance(detail, dict)} if isinstance(error.error_details, list) else set()
+    if error.resp.status != 429 and not (error.resp.status == 403 and reasons & QUOTA_ERROR_REASONS):
+        return None
+    try:
+        return float(error.resp.get('retry-after', DEFAULT_RETRY_AFTER))
+    except ValueError:
+        return DEFAULT_RETRY_AFTER  # an HTTP date, not worth parsing
+
 class EmailHelper():
     """A helper class for interacting with Gmail using the Gmail API."""
     
-    def __init__(self, bot_email: str) -> None:
-        """Initializes the Gmail service and allowed email domains."""
+    def __init__(self, bot_email: str, gmail_service_factory: Optional[Callable[[], Any]] = None) -> None:
+        """
+        Initializes the Gmail service and allowed email domains.
+
+        Args:
+            bot_email (str): The email address of the bot.
+            gmail_service_factory (Callable): Builds a Gmail service, e.g. a fake one for benchmarks.
+                Defaults to the Gmail API, authenticated with OAuth2.0.
+        """
         self.log = logging.getLogger('app')
-        self.creds = self.authenticate_gmail()
-        self.gmail_service = build('gmail', 'v1', credentials=self.creds)
+        if gmail_service_factory is None:
+            self.creds = self.authenticate_gmail()
+            gmail_service_factory = lambda: build('gmail', 'v1', credentials=self.creds)
+        self.gmail_service_factory = gmail_service_factory
+        self.thread_local = threading.local()
         self.bot_email = bot_email
         self.allowed_domains = ['gmail.com']
     
+    @property
+    def gmail_service(self):
+        """The Gmail service of the calling thread, as the underlying http client is not thread safe."""
+        if not hasattr(self.thread_local, 'gmail_service'):
+            self.thread_local.gmail_service = self.gmail_service_factory()
+        return self.thread_local.gmail_service
+    
     def authenticate_gmail(self) -> Credentials:
         """Authenticates the Gmail service using OAuth2.0."""
         self.log.info('Authenticating Gmail...')
@@ -93,114 +137,83 @@ class EmailHelper():
         messages = results.get('messages', [])
         if not messages:
             self.log.info("No unread messages found.")
-            return {}
+            return []
         self.log.info(f"Found {len(messages)} unread messages.")
         return messages
 
-    def download_email_as_html(self, message_id: str) -> str:
-        """Method to download an email as an EML file and convert it to HTML."""
-        if not os.path.exists('downloads'):
-            os.makedirs('downloads')
-        eml_file = f'downloads/temp.eml'
-        self.download_eml(message_id, eml_file) # download email as eml file
-        
-        html_file = f'downloads/{message_id}.html'
-        self.convert_eml_to_html(eml_file=eml_file, output_file=html_file) # convert eml to html
-        
-        return html_file
-
-    def fetch_unread_emails(self, download_email: bool = False, max_results: int = 5) -> List[Dict[str, Any]]:
+    def download_email_as_html(self, message_id: str, size_estimate: int = 0) -> bytes:
+        """
+        Method to download an email and convert it to HTML, entirely in memory.
+        Emails larger than MAX_EMAIL_SIZE are not downloaded, a page linking to the email in Gmail is returned instead.
+        """
+        if size_estimate > MAX_EMAIL_SIZE:
+            self.log.warning(f"Email {message_id} has {size_estimate} bytes, more than MAX_EMAIL_SIZE. Linking to it instead.")
+            return (
+                f'<html><body><p>This email ({size_estimate / 1024 / 1024:.1f} MB) is too large to be shown here.</p>'
+                f'<p><a href="https://mail.google.com/mail/u/0/#all/{message_id}">Open it in Gmail</a></p></body></html>'
+            ).encode('utf-8')
+        eml_data = self.download_eml(message_id) # download email as raw eml bytes
+        return self.convert_eml_to_html(eml_data) # convert eml to html
+
+    def get_email_details(self, message_id: str) -> Dict[str, Any]:
         """
-        Fetches unread emails from Gmail.
+        Fetches the headers and snippet of an email, without its body.
 
         Args:
-            download_email: Whether to download the email as an EML file and convert it to HTML.
-            max_results: The maximum number of results to fetch.
+            message_id: The ID of the email.
 
         Returns:
-            A dictionary containing the details of the fetched email.
+            A dictionary containing the details of the email.
         """
-        # TODO: Break down the function into smaller functions for better readability and maintainability
-        messages = self.get_unread_emails(max_results)
-        
-        filtered_messages = []
-        checked_threads = []
-        
-        for message in messages:
-            try:
-                msg = self.gmail_service.users().messages().get(userId='me', id=message['id']).execute()
-                # self.log.info(f"Message snippet: {msg['snippet']}")
-
-                message_id = msg['id']
-                thread_id = msg['threadId']
-                content = msg['snippet']
-                
-                # Code to handle mutliple messages in the same thread, skip if already checked.
-                # We always get the latest message in the first iteration and we need only that.
-                if thread_id in checked_threads:
-                    self.log.info(f"Thread {thread_id} already checked. Skipping and marking this message as read...")
-                    self.mark_as_read(message_id)
-                    continue
-                checked_threads.append(thread_id)
-                
-                headers = msg['payload']['headers']
-                subject = next((header['value'] for header in headers if header['name'] == 'Subject'), "")
-                from_address = self.extract_emails(next((header['value'] for header in headers if header['name'] == 'From'), ""))[0]
-                to_address = self.extract_emails(next((header['value'] for header in headers if header['name'] == 'To'), ""))
-                cc_address = self.extract_emails(next((header['value'] for header in headers if header['name'] == 'Cc'), ""))
-                self.log.info(f'Subject: {subject}\nFrom: {from_address}\nTo: {to_address}\nCC: {cc_address}\nMessage ID: {message_id}\nThread ID: {thread_id}')
-
-                # Mark the message as read
-                self.mark_as_read(message_id)
-
-                if from_address.split('@')[1] not in self.allowed_domains:
-                    self.log.info(f"Sender email domain {from_address.split('@')[1]} not allowed.")
-                    continue
-
-                if download_email:
-                    html_file = self.download_email_as_html(message_id)
-
-                filtered_messages.append({
-                    "message_id": message_id,
-                    "thread_id": thread_id,
-                    "subject": subject,
-                    "from": {
-                        "name": "",
-                        "email": from_address
-                    },
-                    "to": to_address,
-                    "cc": cc_address,
-                    "content": content,
-                    "html_file": html_file if download_email else ""
-                })
-                self.log.info('')
-            except ValueError as error:
-                self.log.exception(f"An error occurred while fetching email: {error}")
-            
-        return filtered_messages
+        msg = self.gmail_service.users().messages().get(
+            userId='me', id=message_id, format='metadata', metadataHeaders=DETAIL_HEADERS
+        ).execute()
+
+        thread_id = msg['threadId']
+        headers = msg['payload']['headers']
+        subject = next((header['value'] for header in headers if header['name'] == 'Subject'), "")
+        from_address = self.extract_emails(next((header['value'] for header in headers if header['name'] == 'From'), ""))[0]
+        to_address = self.extract_emails(next((header['value'] for header in headers if header['name'] == 'To'), ""))
+        cc_address = self.extract_emails(next((header['value'] for header in headers if header['name'] == 'Cc'), ""))
+        self.log.info(f'Subject: {subject}\nFrom: {from_address}\nTo: {to_address}\nCC: {cc_address}\nMessage ID: {message_id}\nThread ID: {thread_id}')
+
+        return {
+            "message_id": message_id,
+            "thread_id": thread_id,
+            "subject": subject,
+            "from": {
+                "name": "",
+                "email": from_address
+            },
+            "to": to_address,
+            "cc": cc_address,
+            "content": msg['snippet'],
+            "size": msg.get('sizeEstimate', 0),
+        }
+
+    def is_allowed_sender(self, email_address: str) -> bool:
+        """Checks if the sender's email domain is allowed to create tasks."""
+        domain = email_address.split('@')[1]
+        if domain not in self.allowed_domains:
+            self.log.info(f"Sender email domain {domain} not allowed.")
+            return False
+        return True
             
-    def download_eml(self, message_id: str, output_file: str) -> str:
-        """Downloads an email as an EML file."""
+    def download_eml(self, message_id: str) -> bytes:
+        """Downloads an email in the raw EML format."""
         self.log.info(f"Downloading email with ID: {message_id}...")
         msg = self.gmail_service.users().messages().get(userId='me', id=message_id, format='raw').execute()
-        raw_data = msg['raw']
-        byte_data = base64.urlsafe_b64decode(raw_data.encode('UTF-8'))
-        
-        with open(output_file, 'wb') as f:
-            f.write(byte_data)
-            
-        self.log.info(f"Downloaded email as {output_file}")
+        eml_data = base64.urlsafe_b64decode(msg.pop('raw'))
+        self.log.info(f"Downloaded email {message_id} ({len(eml_data)} bytes)")
         
-        return output_file
+        return eml_data
         
-    def convert_eml_to_html(self, eml_file: str, output_file: str) -> str:
-        """Convert an EML file to HTML."""
-        self.log.info(f"Converting {eml_file} to HTML...")
-        with open(eml_file, 'rb') as f:
-            msg = BytesParser(policy=policy.default).parse(f)
+    def convert_eml_to_html(self, eml_data: bytes) -> bytes:
+        """Convert raw EML bytes to UTF-8 encoded HTML."""
+        msg = BytesParser(policy=policy.default).parsebytes(eml_data)
 
         html_content = ""
-        image_cid_map = {}
+        image_parts = {}
 
         # Iterate through email parts
         for part in msg.walk():
@@ -209,27 +222,27 @@ class EmailHelper():
                 html_content = part.get_payload(decode=True).decode('utf-8')
             elif part.get('Content-ID'):
                 cid = part['Content-ID'][1:-1]  # Remove <> around CID
-                image_data = part.get_payload(decode=True)
+                image_parts[cid] = part
+
+        image_cid_map = {}
+        def resolve_cid(cid: str) -> str:
+            """Encodes an inline image as a data URI, only once and only if the HTML references it."""
+            if cid not in image_cid_map and cid in image_parts:
+                part = image_parts[cid]
                 image_type = part.get_content_type().split('/')[1]
-                base64_image = base64.b64encode(image_data).decode('utf-8')
+                base64_image = base64.b64encode(part.get_payload(decode=True)).decode('ascii')
                 image_cid_map[cid] = f"data:image/{image_type};base64,{base64_image}"
-
-        # Embed images in HTML
-        soup = BeautifulSoup(html_content, 'html.parser')
-        for img in soup.find_all('img'):
-            src = img.get('src')
-            if src and src.startswith('cid:'):
-                cid = src[4:]
-                if cid in image_cid_map:
-                    img['src'] = image_cid_map[cid]
-
-        # Write the modified HTML content to a file
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(soup.prettify())
-            
-        self.log.info(f"Converted {eml_file} to HTML as {output_file}")
+            return image_cid_map.get(cid)
+
+        # Embed images in HTML, the rest of the markup is kept as is
+        html_content = embed_cid_images(html_content, resolve_cid)
+        # The parsed message and the data URIs are released before the HTML is encoded, one copy less at the peak
+        del msg, part, image_parts, image_cid_map
+        html_data = html_content.encode('utf-8')
+        del html_content
+        self.log.info(f"Converted email to HTML ({len(html_data)} bytes)")
         
-        return output_file
+        return html_data
 
     def __create_reply_message(self, messages, reply_text):
         """Creates a reply message based on the original message and reply text."""
@@ -346,7 +359,10 @@ class EmailHelper():
 
     def send_reply(self, thread_id, reply_text):
         """Sends a reply to the latest message in a thread."""
-        messages = self.gmail_service.users().threads().get(userId='me', id=thread_id).execute().get('messages', [])
+        # Only the headers are needed to build the reply, so skip downloading the message bodies
+        messages = self.gmail_service.users().threads().get(
+            userId='me', id=thread_id, format='metadata', metadataHeaders=REPLY_HEADERS
+        ).execute().get('messages', [])
         if not messages:
             self.log.info("No messages found in the thread.")
             return None
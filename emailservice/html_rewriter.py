@@ -0,0 +1,48 @@
+import html
+import re
+from typing import Callable, Optional
+
+# An <img> start tag. Quoted attribute values may contain '>'.
+IMG_TAG_PATTERN = re.compile(r'''<img\b(?:[^>"']|"[^"]*"|'[^']*')*>''', re.IGNORECASE)
+IMG_START_PATTERN = re.compile(r'<img\b', re.IGNORECASE)
+
+# One attribute of a start tag: its name, then an optional double quoted, single quoted or unquoted value.
+# Tags are walked attribute by attribute, so that `src=` inside the value of another attribute is never matched
+ATTRIBUTE_PATTERN = re.compile(
+    r'''[\s/]*(?P<name>[^\s/>=]+)(?:\s*=\s*(?P<value>"(?P<double>[^"]*)"|'(?P<single>[^']*)'|(?P<unquoted>[^\s>]+)))?'''
+)
+
+def embed_cid_images(html_content: str, resolve_cid: Callable[[str], Optional[str]]) -> str:
+    """
+    Replaces `cid:` image sources with the data URI returned by `resolve_cid`.
+
+    Only the src attribute of matching <img> tags is rewritten, the rest of the markup is kept byte-for-byte.
+    Sources for which `resolve_cid` returns None are left untouched.
+
+    Args:
+        html_content (str): The HTML content of the email.
+        resolve_cid (Callable): Maps a content ID (without the `cid:` prefix) to a data URI, or None if unknown.
+
+    Returns:
+        str: The HTML content with the inline images embedded.
+    """
+    if IMG_START_PATTERN.search(html_content) is None:
+        return html_content
+
+    def rewrite_img(match: re.Match) -> str:
+        tag = match.group(0)
+        position = len('<img')
+        while (attribute := ATTRIBUTE_PATTERN.match(tag, position)) is not None:
+            position = attribute.end()
+            if attribute.group('name').lower() != 'src':
+                continue
+            # Only the first src counts, like in browsers
+            value = next((attribute.group(kind) for kind in ('double', 'single', 'unquoted') if attribute.group(kind) is not None), '')
+            src = html.unescape(value)
+            data_uri = resolve_cid(src[4:]) if src[:4].lower() == 'cid:' else None
+            if data_uri is None or attribute.group('value') is None:
+                return tag
+            return f'{tag[:attribute.start("value")]}"{data_uri}"{tag[attribute.end("value"):]}'
+        return tag
+
+    return IMG_TAG_PATTERN.sub(rewrite_img, html_content)
@@ -0,0 +1,144 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+JOURNAL_FILE = os.getenv('INGESTION_JOURNAL_FILE', 'journal/ingestion.db')
+# Committed messages are forgotten after this many days
+JOURNAL_RETENTION_DAYS = float(os.getenv('INGESTION_JOURNAL_RETENTION_DAYS', 30))
+# Failed attempts after which an email is given up on and moved to the failed stage
+MAX_ATTEMPTS = int(os.getenv('INGESTION_MAX_ATTEMPTS', 5))
+
+class Stage(str, Enum):
+    """The stages an incoming email goes through, in order."""
+    FETCHED = "fetched"      # details of the email are known
+    CONVERTED = "converted"  # the email has been converted to HTML
+    UPLOADED = "uploaded"    # the task has been created or updated
+    COMMITTED = "committed"  # the email has been marked as read, nothing left to do
+    FAILED = "failed"        # the email failed MAX_ATTEMPTS times, it is kept for inspection and not retried
+
+# Stages of the emails that are not resumed anymore
+FINAL_STAGES = (Stage.COMMITTED.value, Stage.FAILED.value)
+
+class IngestionJournal:
+    """
+    A local SQLite journal of the incoming emails and the last stage each one completed.
+
+    An email is marked as read only once its task is uploaded, so a crash never loses an email,
+    and a restart resumes every email from its last completed stage instead of starting over.
+    Emails that keep failing are moved to the failed stage after MAX_ATTEMPTS, instead of being retried forever.
+    """
+
+    def __init__(self, path: str = JOURNAL_FILE) -> None:
+        """Opens (and creates if needed) the journal, and drops expired committed entries."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    message_id TEXT PRIMARY KEY,
+                    thread_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    details TEXT,
+                    html BLOB,
+                    updated_time TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            # Journals created before the attempts were counted
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(messages)")}
+            if 'attempts' not in columns:
+                self.connection.execute("ALTER TABLE messages ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS ix_messages_stage_updated_time ON messages (stage, updated_time)")
+        self.prune(older_than=timedelta(days=JOURNAL_RETENTION_DAYS))
+
+    def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the journal entry of an email without its HTML, or None if the email has not been seen yet."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT message_id, thread_id, stage, details, attempts FROM messages WHERE message_id = ?", (message_id,)
+            ).fetchone()
+        return self._to_entry(row) if row else None
+
+    def get_html(self, message_id: str) -> Optional[bytes]:
+        """Returns the converted HTML of an email, only kept while its task is not uploaded."""
+        with self.lock:
+            row = self.connection.execute("SELECT html FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_pending(self, limit: int) -> List[Dict[str, Any]]:
+        """Returns up to `limit` entries of the emails that are neither committed nor failed, oldest first, without their HTML."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT message_id, thread_id, stage, details, attempts FROM messages WHERE stage NOT IN (?, ?) "
+                "ORDER BY updated_time LIMIT ?",
+                (*FINAL_STAGES, limit)
+            ).fetchall()
+        return [self._to_entry(row) for row in rows]
+
+    def record(self, message_id: str, thread_id: str, stage: Stage, details: Optional[Dict[str, Any]] = None,
+               html: Optional[bytes] = None) -> None:
+        """
+        Records that an email completed a stage.
+
+        Args:
+            message_id (str): The ID of the email.
+            thread_id (str): The thread ID of the email.
+            stage (Stage): The stage the email completed.
+            details (dict): The details of the email, kept from earlier stages if not given.
+            html (bytes): The converted HTML, only kept until the task is uploaded.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("""
+                INSERT INTO messages (message_id, thread_id, stage, details, html, updated_time) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (message_id) DO UPDATE SET
+                    stage = excluded.stage,
+                    details = COALESCE(excluded.details, messages.details),
+                    html = CASE WHEN excluded.stage = ? THEN excluded.html ELSE NULL END,
+                    updated_time = excluded.updated_time
+            """, (message_id, thread_id, stage.value, json.dumps(details) if details is not None else None, html,
+                  datetime.now().isoformat(), Stage.CONVERTED.value))
+
+    def record_failed_attempt(self, message_id: str, max_attempts: int = MAX_ATTEMPTS) -> bool:
+        """
+        Counts a failed attempt of a journaled email, and moves it to the failed stage after `max_attempts`.
+        Emails that failed before their first stage are not journaled, Gmail lists them again while they are unread.
+
+        Returns:
+            bool: True if the email has just been moved to the failed stage.
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute("""
+                UPDATE messages SET
+                    attempts = attempts + 1,
+                    stage = CASE WHEN attempts + 1 >= ? THEN ? ELSE stage END,
+                    updated_time = ?
+                WHERE message_id = ? AND stage NOT IN (?, ?)
+                RETURNING stage
+            """, (max_attempts, Stage.FAILED.value, datetime.now().isoformat(), message_id, *FINAL_STAGES)).fetchone()
+        return row is not None and row[0] == Stage.FAILED.value
+
+    def prune(self, older_than: timedelta) -> int:
+        """Deletes committed and failed entries older than the given age. Returns the number of deleted entries."""
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM messages WHERE stage IN (?, ?) AND updated_time < ?",
+                (*FINAL_STAGES, (datetime.now() - older_than).isoformat())
+            )
+        return cursor.rowcount
+
+    @staticmethod
+    def _to_entry(row: tuple) -> Dict[str, Any]:
+        message_id, thread_id, stage, details, attempts = row
+        return {
+            "message_id": message_id,
+            "thread_id": thread_id,
+            "stage": Stage(stage),
+            "details": json.loads(details) if details else None,
+            "attempts": attempts,
+        }
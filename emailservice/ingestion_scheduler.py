@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+import metrics
+from email_helper import get_retry_after
+from task_processor import TaskProcessor
+
+poll_interval_gauge = metrics.Gauge('emailservice_poll_interval_seconds', 'The current delay between two inbox polls.')
+backlog_gauge = metrics.Gauge('emailservice_backlog_messages', 'Unread emails of this worker left after the last poll, a lower bound.')
+
+class IngestionScheduler:
+    """
+    Polls the inbox at an adaptive cadence.
+
+    While emails keep arriving the backlog is drained in consecutive ticks `min_interval` apart. Once the inbox
+    is empty the delay doubles after every empty poll, up to `max_interval`. When Gmail rejects a request for
+    exceeding the quota, the next poll waits for the Retry-After delay.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, batch_size: int = 5,
+                 task_processor_factory: Callable[[], TaskProcessor] = TaskProcessor) -> None:
+        """
+        Initializes the scheduler.
+
+        Args:
+            min_interval (float): The delay in seconds between two polls while draining a backlog.
+            max_interval (float): The maximum delay in seconds between two polls of an empty inbox.
+            batch_size (int): The maximum number of emails handled per poll.
+            task_processor_factory (Callable): Creates the task processor used for the polls.
+        """
+        self.log = logging.getLogger('app')
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.batch_size = batch_size
+        self.task_processor_factory = task_processor_factory
+        self.task_processor: Optional[TaskProcessor] = None
+        self.interval = min_interval
+
+    def poll(self) -> float:
+        """Handles one batch of emails. Returns the delay in seconds until the next poll."""
+        # A draining streak reuses its processor, an idle poll starts with a fresh one so the API token never expires
+        if self.task_processor is None:
+            self.task_processor = self.task_processor_factory()
+        try:
+            emails = self.task_processor.process_incoming_emails(max_results=self.batch_size, download_email=True)
+        except Exception as error:
+            self.task_processor = None
+            retry_after = get_retry_after(error)
+            if retry_after is None:
+                raise
+            self.log.warning(f"Gmail quota exceeded. Next poll in {retry_after} seconds.")
+            self.interval = self.min_interval  # the backlog is still there
+            return max(retry_after, self.min_interval)
+
+        backlog = self.task_processor.backlog
+        backlog_gauge.set(backlog)
+        if backlog or emails:
+            self.interval = self.min_interval
+        else:
+            self.task_processor = None
+            self.interval = min(self.interval * 2, self.max_interval)
+        return self.interval
+
+    async def run(self) -> None:
+        """Runs the polling loop forever."""
+        while True:
+            try:
+                # The Gmail and API calls block, the poll runs in a thread so reminders and signals are handled meanwhile
+                delay = await asyncio.to_thread(self.poll)
+            except Exception:
+                self.log.exception("Failed to process incoming emails. Backing off.")
+                self.interval = min(self.interval * 2, self.max_interval)
+                delay = self.interval
+            poll_interval_gauge.set(delay)
+            self.log.debug(f"Next inbox poll in {delay} seconds.")
+            await asyncio.sleep(delay)
@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# The port to expose the metrics on, the metrics are only kept in memory if not set
+METRICS_PORT = os.getenv('METRICS_PORT')
+
+# Latency buckets in seconds, from a cached lookup to a slow upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry: Dict[str, "Metric"] = {}
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    """A metric with optional labels, rendered in the Prometheus text format. Thread safe."""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], object] = {}
+        registry[name] = self
+
+    def labels(self, *values: str) -> "_Child":
+        """Returns the child metric for the given label values, in the order of the label names."""
+        return _Child(self, tuple(str(value) for value in values))
+
+    def _initial(self):
+        return 0.0
+
+    def _update(self, key: Tuple[str, ...], function) -> None:
+        with self.lock:
+            self.values[key] = function(self.values.get(key, self._initial()))
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Returns the (suffix, labels, value) samples of the metric."""
+        with self.lock:
+            return [("", _format_labels(self.labelnames, key), value) for key, value in self.values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{suffix}{labels} {value}" for suffix, labels, value in self.samples()]
+        return "\n".join(lines)
+
+class _Child:
+    """A metric bound to label values, see `Metric.labels`."""
+
+    def __init__(self, metric: Metric, key: Tuple[str, ...]) -> None:
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount: float = 1) -> None:
+        self.metric.inc(amount, key=self.key)
+
+    def observe(self, amount: float) -> None:
+        self.metric.observe(amount, key=self.key)
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of requests."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, key: Tuple[str, ...] = ()) -> None:
+        self._update(key, lambda value: value + amount)
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. the delay between two polls."""
+    kind = "gauge"
+
+    def set(self, amount: float, key: Tuple[str, ...] = ()) -> None:
+        self._update(key, lambda value: float(amount))
+
+class Histogram(Metric):
+    """Counts observations, e.g. request durations, in cumulative buckets."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _initial(self):
+        return ([0] * (len(self.buckets) + 1), 0.0)  # per bucket counts (the last one is +Inf), sum
+
+    def observe(self, amount: float, key: Tuple[str, ...] = ()) -> None:
+        def add(value):
+            counts, total = value
+            counts[bisect_left(self.buckets, amount)] += 1
+            return counts, total + amount
+        self._update(key, add)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+                cumulative += count
+                samples.append(("_bucket", _format_labels((*self.labelnames, "le"), (*key, bound)), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+def render() -> str:
+    """Renders all registered metrics in the Prometheus text format."""
+    return "\n".join(metric.render() for metric in registry.values()) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registered metrics on GET /metrics."""
+
+    def do_GET(self) -> None:
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # scrapes would flood the app log
+
+def start_http_server(port: Optional[str] = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Starts serving the metrics in a background thread if a port is configured."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('0.0.0.0', int(port)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.getLogger('app').info(f"Serving metrics on port {port}")
+    return server
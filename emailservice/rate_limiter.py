@@ -0,0 +1,32 @@
+import threading
+import time
+
+class RateLimiter:
+    """A thread safe token bucket, allowing `rate` calls per second on average and bursts of up to `burst` calls."""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        """
+        Initializes the limiter with a full bucket.
+
+        Args:
+            rate (float): The number of calls allowed per second.
+            burst (int): The number of calls that may be made back to back.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a call is allowed."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,123 @@
+import asyncio
+import datetime
+import heapq
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from task_processor import TaskProcessor
+
+class ReminderScheduler:
+    """
+    Keeps a min-heap of upcoming reminders and sleeps exactly until the next one is due.
+
+    The heap only holds reminders due within the next resync interval. It is rebuilt from the web service
+    on every resync, so changes made elsewhere (e.g. a criticality change from the UI) are picked up within
+    one interval. Tasks created or reminded by this process are pushed directly through `schedule`.
+    """
+
+    # Seconds before a failed resync or send is retried, doubled on every failure up to the resync interval
+    RETRY_DELAY = 5
+
+    def __init__(self, resync_interval: float, task_processor_factory: Callable[[], TaskProcessor] = TaskProcessor) -> None:
+        """
+        Initializes the scheduler.
+
+        Args:
+            resync_interval (float): The interval in minutes to reload upcoming reminders from the web service.
+            task_processor_factory (Callable): Creates the task processor used for one resync interval.
+        """
+        self.log = logging.getLogger('app')
+        self.resync_interval = datetime.timedelta(minutes=resync_interval)
+        self.task_processor_factory = task_processor_factory
+        self.task_processor = None
+        self.heap = []  # (due time, task id)
+        self.next_resync = None
+        self.retry_at = None
+        self.retry_delay = self.RETRY_DELAY
+        # `schedule` is called from the threads the blocking API calls run in, the lock guards the heap
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup_event = asyncio.Event()
+
+    def schedule(self, task: Dict[str, Any]) -> None:
+        """Adds the next reminder of a task to the heap, if it is due before the next resync. Safe to call from any thread."""
+        if task.get('status') != 'OPEN' or not task.get('next_reminder_at'):
+            return
+        due_time = datetime.datetime.fromisoformat(task['next_reminder_at'])
+        with self.lock:
+            if self.next_resync is not None and due_time > self.next_resync:
+                return
+            earlier = not self.heap or due_time < self.heap[0][0]
+            heapq.heappush(self.heap, (due_time, task['id']))
+        if earlier and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup_event.set)  # the loop may be sleeping past this reminder
+
+    def resync(self) -> None:
+        """Reloads the reminders due before the next resync from the web service. The heap is kept if it fails."""
+        next_resync = datetime.datetime.now() + self.resync_interval
+        # A fresh processor per interval keeps the API token from expiring
+        task_processor = self.task_processor_factory()
+
+        upcoming_tasks = task_processor.get_due_reminders(until=next_resync)
+        heap = [(datetime.datetime.fromisoformat(task['next_reminder_at']), task['id']) for task in upcoming_tasks]
+        heapq.heapify(heap)
+        with self.lock:
+            self.task_processor = task_processor
+            self.heap = heap
+            self.next_resync = next_resync
+        self.log.info(f"Reminder queue resynced with {len(heap)} reminders due before {next_resync}.")
+
+    def is_reminder_due(self) -> bool:
+        """Checks if the first reminder of the heap is due."""
+        with self.lock:
+            return bool(self.heap) and self.heap[0][0] <= datetime.datetime.now()
+
+    def send_due_reminders(self) -> None:
+        """Sends the due reminders, then pops them and schedules the next reminder of each task."""
+        now = datetime.datetime.now()
+        # The web service decides what is still due, so tasks closed in the meantime are not reminded
+        sent_tasks = self.task_processor.send_reminders()
+
+        # Popped only once sent, a failed send is retried with the reminders still queued
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                heapq.heappop(self.heap)
+        for task in sent_tasks:
+            self.schedule(task)
+
+    def seconds_until_next_wakeup(self) -> float:
+        """Returns the number of seconds until the next reminder is due or the next resync, whichever comes first."""
+        if self.retry_at is not None:
+            wakeup = self.retry_at
+        else:
+            with self.lock:
+                wakeup = self.next_resync
+                if self.heap:
+                    wakeup = min(wakeup, self.heap[0][0])
+        return max((wakeup - datetime.datetime.now()).total_seconds(), 0)
+
+    async def run(self) -> None:
+        """Runs the scheduler loop forever."""
+        self.loop = asyncio.get_running_loop()
+        while True:
+            if self.retry_at is None or datetime.datetime.now() >= self.retry_at:
+                try:
+                    # The API and Gmail calls block, they run in a thread so the inbox polls are not held up
+                    if self.next_resync is None or datetime.datetime.now() >= self.next_resync:
+                        await asyncio.to_thread(self.resync)
+                    if self.is_reminder_due():
+                        self.log.info("Sending reminders...")
+                        await asyncio.to_thread(self.send_due_reminders)
+                    self.retry_at = None
+                    self.retry_delay = self.RETRY_DELAY
+                except Exception:
+                    self.log.exception(f"Failed to send reminders. Retrying in {self.retry_delay} seconds.")
+                    self.retry_at = datetime.datetime.now() + datetime.timedelta(seconds=self.retry_delay)
+                    self.retry_delay = min(self.retry_delay * 2, self.resync_interval.total_seconds())
+
+            try:
+                await asyncio.wait_for(self.wakeup_event.wait(), timeout=self.seconds_until_next_wakeup())
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup_event.clear()
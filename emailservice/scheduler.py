@@ -4,10 +4,12 @@ import sys, os
 base_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(base_dir)
 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 import asyncio
-from task_processor import TaskProcessor
+import signal
+import metrics
+from task_processor import TaskProcessor, WORKER_LEASE_TTL
+from reminder_scheduler import ReminderScheduler
+from ingestion_scheduler import IngestionScheduler
 
 import logging
 from logging.config import dictConfig
@@ -24,28 +26,29 @@ load_dotenv()
 help_str = """
 Required Environment Variables:
 
-- EMAIL_PARSE_INTERVAL: The interval in minutes to parse incoming emails.
-- SEND_REMINDER_INTERVAL: The interval in minutes to send reminders.
-- REMINDER_INTERVAL_FOR_CRITICAL: The interval in hours to send reminders for critical tasks.
-- REMINDER_INTERVAL_FOR_HIGH: The interval in hours to send reminders for high priority tasks.
-- REMINDER_INTERVAL_FOR_MEDIUM: The interval in hours to send reminders for medium priority tasks.
-- REMINDER_INTERVAL_FOR_LOW: The interval in hours to send reminders for low priority tasks.
+- EMAIL_PARSE_INTERVAL: The maximum interval in minutes to parse incoming emails. Polling backs off up to it while the inbox is empty.
+- SEND_REMINDER_INTERVAL: The interval in minutes to reload upcoming reminders from the web service. Reminders are sent as soon as they are due.
 - BOT_EMAIL: The email address of the bot.
 
 - UI_BASE_URL: The base URL of the UI. This is used to generate the links in the email.
 - API_BASE_URL: The base URL of the API. This is used to communicate with the backend application.
 - USER_NAME: The username to communicate with the backend application to upload files and create tasks.
 - PASSWORD: The password to communicate with the backend application to upload files and create tasks.
+
+Optional Environment Variables:
+- WORKER_ID: The unique ID of this worker when several emailservice instances run. (Default: <hostname>-<pid>)
+- WORKER_LEASE_TTL: The time in seconds after which the email threads of a dead worker are reassigned. Must exceed EMAIL_PARSE_INTERVAL. (Default: 600)
+- EMAIL_DRAIN_INTERVAL: The interval in seconds to parse incoming emails while a backlog is drained. (Default: 2)
+- EMAIL_BATCH_SIZE: The maximum number of emails parsed per poll. (Default: 5)
+- METRICS_PORT: The port to expose the metrics on, e.g. the polling interval and backlog. (Default: not exposed)
+- TRACE_DIR: The directory the spans of every ingested email are written to, read them with `python tools/traces.py <dir>`. Tracing is off if not set.
 """
 
 # read environment variables
 EMAIL_PARSE_INTERVAL = os.getenv("EMAIL_PARSE_INTERVAL")
 SEND_REMINDER_INTERVAL = os.getenv("SEND_REMINDER_INTERVAL")
-
-REMINDER_INTERVAL_FOR_CRITICAL = os.getenv("REMINDER_INTERVAL_FOR_CRITICAL")
-REMINDER_INTERVAL_FOR_HIGH = os.getenv("REMINDER_INTERVAL_FOR_HIGH")
-REMINDER_INTERVAL_FOR_MEDIUM = os.getenv("REMINDER_INTERVAL_FOR_MEDIUM")
-REMINDER_INTERVAL_FOR_LOW = os.getenv("REMINDER_INTERVAL_FOR_LOW")
+EMAIL_DRAIN_INTERVAL = float(os.getenv("EMAIL_DRAIN_INTERVAL", 2))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", 5))
 
 BOT_EMAIL = os.getenv("BOT_EMAIL")
 
@@ -54,8 +57,7 @@ API_BASE_URL = os.getenv("API_BASE_URL")
 USER_NAME = os.getenv("USER_NAME")
 PASSWORD = os.getenv("PASSWORD")
 
-if not all([EMAIL_PARSE_INTERVAL, SEND_REMINDER_INTERVAL, REMINDER_INTERVAL_FOR_CRITICAL, REMINDER_INTERVAL_FOR_HIGH, 
-            REMINDER_INTERVAL_FOR_MEDIUM, REMINDER_INTERVAL_FOR_LOW, BOT_EMAIL, UI_BASE_URL, API_BASE_URL, USER_NAME, PASSWORD]):
+if not all([EMAIL_PARSE_INTERVAL, SEND_REMINDER_INTERVAL, BOT_EMAIL, UI_BASE_URL, API_BASE_URL, USER_NAME, PASSWORD]):
     logger.error(help_str)
     print(help_str)
     raise ValueError("Please set the required environment variables.")
@@ -63,7 +65,9 @@ if not all([EMAIL_PARSE_INTERVAL, SEND_REMINDER_INTERVAL, REMINDER_INTERVAL_FOR_
 ## Load environment variables - END ##
 
 logger.info(f"Email parse interval: {EMAIL_PARSE_INTERVAL} minutes")
-logger.info(f"Send reminder interval: {SEND_REMINDER_INTERVAL} minutes")
+logger.info(f"Reminder resync interval: {SEND_REMINDER_INTERVAL} minutes")
+if WORKER_LEASE_TTL <= float(EMAIL_PARSE_INTERVAL) * 60:
+    logger.warning("WORKER_LEASE_TTL is shorter than EMAIL_PARSE_INTERVAL, the shards of this worker will expire while it is idle.")
 
 # check if webservice is running first and retry after 5 seconds till it is up
 import requests, time
@@ -80,29 +84,40 @@ while True:
         logger.exception("Web service is not running. Retrying in 5 seconds...")
     time.sleep(5)
 
-async def read_incoming_messages():
-    logger.info("Reading incoming messages...")
-    task_processor = TaskProcessor()
-    task_processor.process_incoming_emails(max_results=5, download_email=True)
+reminder_scheduler = ReminderScheduler(resync_interval=float(SEND_REMINDER_INTERVAL))
 
-async def send_reminders():
-    logger.info("Sending reminders...")
-    task_processor = TaskProcessor()
-    task_processor.send_reminders()
+ingestion_scheduler = IngestionScheduler(
+    min_interval=EMAIL_DRAIN_INTERVAL,
+    max_interval=float(EMAIL_PARSE_INTERVAL) * 60,
+    batch_size=EMAIL_BATCH_SIZE,
+    task_processor_factory=lambda: TaskProcessor(task_listener=reminder_scheduler.schedule),
+)
 
 async def main():
-    scheduler = AsyncIOScheduler()
-
-    logger.info("Adding jobs to scheduler...")
-    scheduler.add_job(read_incoming_messages, IntervalTrigger(minutes=int(EMAIL_PARSE_INTERVAL)))
-    scheduler.add_job(send_reminders, IntervalTrigger(minutes=int(SEND_REMINDER_INTERVAL)))
-
-    logger.info("Starting scheduler...")
-    scheduler.start()
-
-    # Keep the script running to allow the scheduler to execute the tasks
-    while True:
-        await asyncio.sleep(1)
+    metrics.start_http_server()
+
+    # Incoming emails are polled at an adaptive cadence, fast while a backlog is drained and backing off when idle
+    logger.info("Starting inbox polling...")
+    asyncio.create_task(ingestion_scheduler.run())
+
+    # Reminders are timer driven, the loop sleeps until the next reminder is due
+    asyncio.create_task(reminder_scheduler.run())
+
+    # Keep the script running to allow the scheduler to execute the tasks, until docker stop or Ctrl-C
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    await stopping.wait()
+
+    # The shards of this worker are handed to the other workers now, not when its lease expires
+    logger.info("Stopping, releasing the shards of this worker...")
+    if TaskProcessor.lease:
+        try:
+            task_processor = ingestion_scheduler.task_processor or TaskProcessor(task_listener=reminder_scheduler.schedule)
+            task_processor.release_lease()
+        except Exception:
+            logger.exception("Failed to release the shards of this worker.")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,15 +1,78 @@
 import requests
-from email_helper import EmailHelper
+import uuid
+from cachetools import LRUCache
+from email_helper import EmailHelper, get_retry_after
+from rate_limiter import RateLimiter
+import metrics
+import tracing
+from ingestion_journal import IngestionJournal, Stage, MAX_ATTEMPTS as MAX_INGESTION_ATTEMPTS
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import os
+import socket
+import zlib
 from enum import Enum
 import traceback
 import datetime
+import time
+from typing import Callable, Optional
+from urllib.parse import quote
 
 load_dotenv()
 
 import logging
 
+# Maximum number of thread_id -> task_id entries kept in memory
+THREAD_CACHE_SIZE = int(os.getenv('THREAD_CACHE_SIZE', 1024))
+
+# Reminders are sent by a pool of workers, in batches whose sent markers are recorded with one API call.
+# Gmail allows 250 quota units per user per second, a reminder costs 110 (threads.get 10 + messages.send 100).
+REMINDER_WORKERS = int(os.getenv('REMINDER_WORKERS', 4))
+REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', 50))
+REMINDER_RATE_LIMIT = float(os.getenv('REMINDER_RATE_LIMIT', 2))  # reminders per second
+
+reminder_rate_limiter = RateLimiter(rate=REMINDER_RATE_LIMIT)
+
+# Gmail threads are sharded across the running workers, each worker only handles the threads of the shards it leases
+WORKER_ID = os.getenv('WORKER_ID', f'{socket.gethostname()}-{os.getpid()}')
+WORKER_LEASE_TTL = int(os.getenv('WORKER_LEASE_TTL', 600))  # seconds, a dead worker's shards are reassigned after this
+GMAIL_MAX_RESULTS = 500
+
+stage_duration = metrics.Histogram('emailservice_stage_duration_seconds', 'Time spent per ingestion stage of an email.', ('stage',))
+emails_processed = metrics.Counter('emailservice_emails_total', 'Incoming emails marked as read, by outcome.', ('outcome',))
+upload_bytes = metrics.Counter('emailservice_upload_bytes_total', 'Bytes of converted HTML uploaded with tasks.')
+reminders_sent = metrics.Counter('emailservice_reminders_sent_total', 'Reminder emails sent.')
+
+class MultipartBody:
+    """
+    A multipart/form-data body with one file, streamed in chunks. `requests` builds the whole body of `files` in memory,
+    another full copy of the file, this sends the file from its bytes with a Content-Length.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fields: dict, file_field: str, file_name: str, content: bytes, content_type: str = 'text/html') -> None:
+        boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n' for name, value in fields.items()]
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{file_name}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n')
+        self.head = ''.join(parts).encode('utf-8')
+        self.content = memoryview(content)
+        self.tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+    def __len__(self) -> int:
+        return len(self.head) + len(self.content) + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        for start in range(0, len(self.content), self.CHUNK_SIZE):
+            yield self.content[start:start + self.CHUNK_SIZE]
+        yield self.tail
+
+def get_thread_shard(thread_id: str, shard_count: int) -> int:
+    """Returns the shard of a Gmail thread."""
+    return zlib.crc32(thread_id.encode()) % shard_count
+
 class TaskStatus(str, Enum):
     OPEN = "OPEN"
     FIXED = "FIXED"
@@ -24,8 +87,20 @@ class TaskCriticality(str, Enum):
 class TaskProcessor:
     """Class to handle task creation and updating using the API."""
     
-    def __init__(self):
-        """Initializes the class with the necessary attributes."""
+    # The scheduler creates a new processor per run, so the thread_id -> task_id cache lives on the class
+    thread_task_cache = LRUCache(maxsize=THREAD_CACHE_SIZE)
+    thread_cache_warmed = False
+    # The last lease granted to this worker, shared by the ingestion and reminder processors
+    lease = None
+    
+    def __init__(self, task_listener: Optional[Callable[[dict], None]] = None, email_helper: Optional[EmailHelper] = None):
+        """
+        Initializes the class with the necessary attributes.
+
+        Args:
+            task_listener (Callable): Called with every task created by this processor, e.g. to schedule its reminders.
+            email_helper (EmailHelper): The Gmail helper to use, a new one connected to Gmail if not given.
+        """
         self.API_BASE_URL   = os.getenv('API_BASE_URL')
         self.UI_BASE_URL    = os.getenv('UI_BASE_URL')
         self.USER_NAME      = os.getenv('USER_NAME')
@@ -34,24 +109,22 @@ class TaskProcessor:
         self.TASK_EDIT_URL  = f'{self.UI_BASE_URL}/tasks/%s/edit'
         
         self.log = logging.getLogger("app") # initialize logger
+        self.task_listener = task_listener
+        self.backlog = 0
         
-        # Reminder intervals in hours
-        self.REMINDER_INTERVALS = {
-            TaskCriticality.LOW.value: os.getenv('REMINDER_INTERVAL_FOR_LOW', 48),
-            TaskCriticality.MEDIUM.value: os.getenv('REMINDER_INTERVAL_FOR_MEDIUM', 24),
-            TaskCriticality.HIGH.value: os.getenv('REMINDER_INTERVAL_FOR_HIGH', 10),
-            TaskCriticality.CRITICAL.value: os.getenv('REMINDER_INTERVAL_FOR_CRITICAL', 5),
-        }
-        
-        self.email_helper = EmailHelper(bot_email=self.BOT_EMAIL)
+        self.email_helper = email_helper or EmailHelper(bot_email=self.BOT_EMAIL)
+        self.journal = IngestionJournal()
         
         self.endpoints = {
             'login'         : f'{self.API_BASE_URL}/token/',
             'create_task'   : f'{self.API_BASE_URL}/api/tasks/',
             'update_task'   : f'{self.API_BASE_URL}/api/tasks/%s',
-            'thread_exists' : f'{self.API_BASE_URL}/api/tasks/?thread_id=%s',
-            'open_tasks'    : f'{self.API_BASE_URL}/api/tasks/?status=OPEN',
-            'reminder_sent' : f'{self.API_BASE_URL}/api/tasks/%s/remindersent',
+            'lookup_tasks'  : f'{self.API_BASE_URL}/api/tasks/lookup',
+            'due_reminders' : f'{self.API_BASE_URL}/api/tasks/due-reminders',
+            'recent_open_tasks': f'{self.API_BASE_URL}/api/tasks/?status=OPEN&sort=-created_time&fields=id,thread_id&limit={THREAD_CACHE_SIZE}',
+            'reminders_sent': f'{self.API_BASE_URL}/api/tasks/remindersent',
+            'worker_leases' : f'{self.API_BASE_URL}/api/workers/leases',
+            'release_leases': f'{self.API_BASE_URL}/api/workers/%s/leases',
         }
         
         self.headers = {
@@ -60,6 +133,9 @@ class TaskProcessor:
         }
         self.login()
         
+        if not TaskProcessor.thread_cache_warmed:
+            self.warm_thread_cache()
+        
     def login(self):
         """Logs in to the API and returns the access token."""
         response = requests.post(self.endpoints['login'], data={'username': self.USER_NAME, 'password': self.PASSWORD})
@@ -75,7 +151,7 @@ class TaskProcessor:
     
     def create_task(self, creator_name: str, assigner_name: str, subject: str, 
                         criticality: str, status: str, 
-                        thread_id: str, html_file_path: str) -> requests.Response:
+                        thread_id: str, html_content: bytes, html_file_name: str) -> requests.Response:
         """
         Creates a task using the API.
 
@@ -86,58 +162,55 @@ class TaskProcessor:
             criticality (TaskCriticality): The criticality level of the task.
             status (TaskStatus): The status of the task.
             thread_id (str): The thread ID associated with the task.
-            html_file_path (str): The file path of the HTML file to be attached to the task.
+            html_content (bytes): The HTML content to be attached to the task.
+            html_file_name (str): The file name the HTML content is uploaded as.
 
         Returns:
             requests.Response: The response from the API.
-
-        Raises:
-            FileNotFoundError: If the HTML file does not exist.
         """
-        with open(html_file_path, 'rb') as html_file:
-            files = {'html_file': html_file}
-            data = {
-                'creator_name': creator_name,
-                'assigner_name': assigner_name,
-                'subject': subject,
-                'criticality': criticality,
-                'status': status,
-                'thread_id': thread_id,
-            }
-            self.log.info(data)
-            
-            create_task_headers = self.headers.copy()
-            create_task_headers.pop('Content-Type', None)
-            # create_task_headers['Content-Type'] = 'multipart/form-data'
-            response = requests.post(self.endpoints['create_task'], headers=create_task_headers, data=data, files=files)
-            response.raise_for_status()  # Raise an exception for HTTP errors
+        data = {
+            'creator_name': creator_name,
+            'assigner_name': assigner_name,
+            'subject': subject,
+            'criticality': criticality,
+            'status': status,
+            'thread_id': thread_id,
+        }
+        self.log.info(data)
+        body = MultipartBody(data, 'html_file', html_file_name, html_content)
+        
+        create_task_headers = self.headers.copy()
+        create_task_headers['Content-Type'] = body.content_type
+        with tracing.start_span('create task', thread_id=thread_id):
+            response = requests.post(self.endpoints['create_task'], headers=tracing.inject(create_task_headers), data=body)
+        response.raise_for_status()  # Raise an exception for HTTP errors
             
         self.log.info('Task created successfully!')
         self.log.info(response.json())
+        self.thread_task_cache[thread_id] = response.json()['id']
+        if self.task_listener:
+            self.task_listener(response.json())
         return response
 
-    def update_task(self, task_id: int, html_file_path: str) -> requests.Response:
+    def update_task(self, task_id: int, html_content: bytes, html_file_name: str) -> requests.Response:
         """
         Updates a task using the API.
 
         Args:
             task_id (int): The ID of the task to be updated.
-            html_file_path (str): The file path of the HTML file to be attached to the task.
+            html_content (bytes): The HTML content to be attached to the task.
+            html_file_name (str): The file name the HTML content is uploaded as.
 
         Returns:
             requests.Response: The response from the API.
-
-        Raises:
-            FileNotFoundError: If the HTML file does not exist.
         """
-        with open(html_file_path, 'rb') as html_file:
-            files = {'html_file': html_file}
+        body = MultipartBody({}, 'html_file', html_file_name, html_content)
 
-            update_task_headers = self.headers.copy()
-            update_task_headers.pop('Content-Type', None)
-            # update_task_headers['Content-Type'] = 'multipart/form-data'
-            response = requests.put(self.endpoints['update_task'] % task_id, headers=update_task_headers, files=files)
-            response.raise_for_status()  # Raise an exception for HTTP errors
+        update_task_headers = self.headers.copy()
+        update_task_headers['Content-Type'] = body.content_type
+        with tracing.start_span('update task', task_id=task_id):
+            response = requests.put(self.endpoints['update_task'] % task_id, headers=tracing.inject(update_task_headers), data=body)
+        response.raise_for_status()  # Raise an exception for HTTP errors
 
         self.log.info('Task updated successfully!')
         self.log.info(response.json())
@@ -145,7 +218,7 @@ class TaskProcessor:
 
     def create_task_with_retries(self, creator_name: str, assigner_name: str, subject: str, 
                             criticality: str, status: str, 
-                            thread_id: str, html_file_path: str) -> None:
+                            thread_id: str, html_content: bytes, html_file_name: str) -> bool:
         """
         Handles task creation using the API.
 
@@ -156,27 +229,64 @@ class TaskProcessor:
             criticality (TaskCriticality): The criticality level of the task.
             status (TaskStatus): The status of the task.
             thread_id (str): The thread ID associated with the task.
-            html_file_path (str): The file path of the HTML file to be attached to the task.
+            html_content (bytes): The HTML content to be attached to the task.
+            html_file_name (str): The file name the HTML content is uploaded as.
 
         Returns:
-            None
-
-        Raises:
-            requests.RequestException: If an error occurs during the API request.
+            bool: True if the task was created, False if all attempts failed.
         """
         retries = 3
         for _ in range(retries):
             try:
-                self.create_task(creator_name, assigner_name, subject, criticality, status, thread_id, html_file_path)
-                break
+                self.create_task(creator_name, assigner_name, subject, criticality, status, thread_id, html_content, html_file_name)
+                return True
             except requests.RequestException as e:
-                self.log.info("An error occurred:", e)
+                self.log.info(f"An error occurred: {e}")
                 self.log.exception("Failed to create task. Retrying...")
                 traceback.print_exc()
                 self.login()
-        else:
-            self.log.info("Failed to create task after", retries, "attempts.")
+        self.log.info(f"Failed to create task after {retries} attempts.")
+        return False
             
+    def warm_thread_cache(self) -> None:
+        """Fills the thread_id -> task_id cache with the newest open tasks, so the first emails don't need a lookup."""
+        try:
+            response = requests.get(self.endpoints['recent_open_tasks'], headers=self.headers)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.log.exception("Failed to warm the thread cache. Continuing with an empty cache.")
+            return
+        
+        # Oldest first, so that the newest tasks are the last evicted from the LRU cache
+        for task in reversed(response.json()):
+            self.thread_task_cache[task['thread_id']] = task['id']
+        TaskProcessor.thread_cache_warmed = True
+        self.log.info(f"Thread cache warmed with {len(self.thread_task_cache)} tasks.")
+    
+    def lookup_tasks(self, thread_ids: list) -> dict:
+        """
+        Maps thread IDs to task IDs, asking the API only for the thread IDs that are not cached.
+
+        Args:
+            thread_ids (list): The thread IDs to look up.
+
+        Returns:
+            dict: The task ID for every thread ID that has a task.
+        """
+        task_ids = {thread_id: self.thread_task_cache[thread_id] for thread_id in thread_ids if thread_id in self.thread_task_cache}
+        missing = [thread_id for thread_id in dict.fromkeys(thread_ids) if thread_id not in task_ids]
+        if not missing:
+            return task_ids
+        
+        with tracing.start_span('lookup tasks', threads=len(missing)):
+            response = requests.post(self.endpoints['lookup_tasks'], headers=tracing.inject(self.headers), json={'thread_ids': missing})
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        
+        for thread_id, task_id in response.json().items():
+            self.thread_task_cache[thread_id] = task_id
+            task_ids[thread_id] = task_id
+        return task_ids
+    
     def check_if_task_exists(self, thread_id: str) -> int:
         """
         Checks if a task with the given thread ID already exists.
@@ -187,10 +297,59 @@ class TaskProcessor:
         Returns:
             int: The ID of the task if it exists, 0 otherwise
         """
-        response = requests.get(self.endpoints['thread_exists'] % thread_id, headers=self.headers)
-        response.raise_for_status()  # Raise an exception for HTTP errors
+        return self.lookup_tasks([thread_id]).get(thread_id, 0)
+    
+    def acquire_lease(self) -> Optional[dict]:
+        """
+        Renews the shard lease of this worker, asking the API only when half of the lease TTL has passed.
+
+        Returns:
+            dict: The lease with the shard count and the owned shards, or None if no lease could be acquired.
+        """
+        lease = TaskProcessor.lease
+        now = datetime.datetime.now()
+        if lease and now < lease['renew_at']:
+            return lease
         
-        return response.json()[0]['id'] if response.json() else 0
+        try:
+            response = requests.post(self.endpoints['worker_leases'], headers=self.headers,
+                                     json={'worker_id': WORKER_ID, 'ttl_seconds': WORKER_LEASE_TTL})
+            response.raise_for_status()
+        except requests.RequestException:
+            self.log.exception("Failed to renew the worker lease.")
+            # Keep using the current lease while it is valid, the shards are not reassigned before it expires
+            if lease and now < lease['expires_at']:
+                return lease
+            TaskProcessor.lease = None
+            return None
+        
+        grant = response.json()
+        TaskProcessor.lease = {
+            'shard_count': grant['shard_count'],
+            'shards': set(grant['shards']),
+            'expires_at': datetime.datetime.fromisoformat(grant['expires_at']),
+            'renew_at': now + datetime.timedelta(seconds=WORKER_LEASE_TTL / 2),
+        }
+        self.log.info(f"Worker {WORKER_ID} owns {len(grant['shards'])} of {grant['shard_count']} shards.")
+        return TaskProcessor.lease
+    
+    def release_lease(self) -> None:
+        """Releases the shards of this worker, so that the other workers take them over without waiting for the lease to expire."""
+        if TaskProcessor.lease is None:
+            return
+        try:
+            response = requests.delete(self.endpoints['release_leases'] % quote(WORKER_ID, safe=''), headers=self.headers)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.log.exception("Failed to release the worker lease.")
+            return
+        TaskProcessor.lease = None
+        self.log.info(f"Worker {WORKER_ID} released its shards.")
+    
+    @staticmethod
+    def owns_thread(lease: Optional[dict], thread_id: str) -> bool:
+        """Checks if a thread belongs to the shards of the given lease."""
+        return bool(lease) and get_thread_shard(thread_id, lease['shard_count']) in lease['shards']
     
     ## Email Related Functions ##
     
@@ -198,6 +357,12 @@ class TaskProcessor:
         """
         Fetches and processes incoming emails.
 
+        Every email goes through the stages of the ingestion journal (fetched, converted, uploaded, committed),
+        and is only marked as read once its task is uploaded. Up to `max_results` emails left unfinished by earlier
+        runs are resumed from their last completed stage, committed and failed emails are skipped without any Gmail
+        or API calls. An email that fails INGESTION_MAX_ATTEMPTS times is moved to the failed stage and marked as read.
+        The number of unread emails left for later runs is kept in `backlog`.
+
         Args:
             max_results (int): The maximum number of emails to read.
             download_email (bool): Whether to download the email content.
@@ -206,80 +371,258 @@ class TaskProcessor:
             list: A list of email data.
         """
         self.log.info("Processing incoming emails...")
-        emails = self.email_helper.fetch_unread_emails(max_results=max_results, download_email=download_email)
+        pending = self.journal.get_pending(limit=max_results)
+        lease = self.acquire_lease()
+        if lease and lease['shards']:
+            # The unread list holds the threads of every worker, list enough of them to find max_results of ours,
+            # and as many again to tell if a backlog is building up
+            list_size = min(2 * max_results * lease['shard_count'] // len(lease['shards']), GMAIL_MAX_RESULTS)
+            messages = self.email_helper.get_unread_emails(list_size)
+            messages = [message for message in messages if self.owns_thread(lease, message['threadId'])]
+        else:
+            # Without shards only the unfinished emails of earlier runs are resumed
+            messages = []
+        # Unread messages of this worker left for the next runs, a lower bound if the list was capped
+        self.backlog = max(len(messages) - max_results, 0)
+        messages = messages[:max_results]
         
-        for email in emails:
-            self.log.info(email)
+        # Unfinished emails of earlier runs go first, they may not be unread anymore
+        entries = {entry['message_id']: entry for entry in pending}
+        message_ids = list(entries)
+        for message in messages:
+            if message['id'] not in entries:
+                entries[message['id']] = self.journal.get(message['id'])
+                message_ids.append(message['id'])
+        thread_ids = {message['id']: message['threadId'] for message in messages}
+        thread_ids.update({entry['message_id']: entry['thread_id'] for entry in pending})
+        
+        # Resolve all threads of this batch with a single lookup, the loop below is then served from the cache
+        try:
+            self.lookup_tasks(list(set(thread_ids.values())))
+        except requests.RequestException:
+            self.log.exception("Batch thread lookup failed. Falling back to per email lookups.")
+        
+        emails = []
+        checked_threads = set()
+        for message_id in message_ids:
+            entry = entries[message_id]
+            if entry and entry['stage'] in (Stage.COMMITTED, Stage.FAILED):
+                self.log.info(f"Message {message_id} already {entry['stage'].value}. Skipping...")
+                continue
             try:
-                task_id = self.check_if_task_exists(email['thread_id'])
-            
-                if task_id:
-                    self.log.info("Task already exists. Updating task...")
-                    self.update_task(task_id=task_id, html_file_path=email['html_file'])
-                else:
-                    self.log.info("Task does not exist. Creating task...")
-                    to_address = email['to']
-                    if self.BOT_EMAIL in to_address:
-                        to_address.remove(self.BOT_EMAIL)
-                        
-                    if not to_address:
-                        self.email_helper.send_reply(thread_id=email['thread_id'], reply_text="No assignee found. Skipping task creation.")
-                        self.log.info("No assignee found. Skipping task creation. Email:", email['to'])
-                        continue
-                    self.create_task_with_retries(creator_name=email['from']['email'], assigner_name=to_address[0], 
-                                                subject=email['subject'], criticality=TaskCriticality.MEDIUM.value, status=TaskStatus.OPEN.value, 
-                                                thread_id=email['thread_id'], html_file_path=email['html_file'])
-                    
-                os.remove(email['html_file'])
+                # Every email is a trace of its own, joined by the spans of the webservice and ftpservice requests it makes
+                with tracing.start_span('ingest email', message_id=message_id, thread_id=thread_ids[message_id]):
+                    email = self.ingest_email(message_id, thread_ids[message_id], entry, checked_threads, download_email)
+                if email:
+                    emails.append(email)
             except Exception as e:
-                self.log.error("An error occurred:", e)
-                self.log.exception("Failed to process email.")
+                if get_retry_after(e) is not None:
+                    raise  # out of Gmail quota, the remaining emails would fail too
+                self.log.error(f"An error occurred: {e}")
+                self.log.exception("Failed to process email. It will be resumed in the next run.")
                 traceback.print_exc()
+                self.fail_email(message_id)
 
         return emails
 
-    def send_reminders(self):
-        """Sends reminders for tasks that are overdue or due soon."""
-        # Fetch tasks that are open => check criticality => last reminder sent => if last reminder time > x interval (wrt critcality) => send reminder
-        response = requests.get(self.endpoints['open_tasks'], headers=self.headers)
-        response.raise_for_status()
+    def ingest_email(self, message_id: str, thread_id: str, entry: Optional[dict], checked_threads: set, download_email: bool) -> Optional[dict]:
+        """
+        Runs the remaining stages of an email, recording each completed stage in the journal.
+
+        Args:
+            message_id (str): The ID of the email.
+            thread_id (str): The thread ID of the email.
+            entry (dict): The journal entry of the email, None if it has not been seen yet.
+            checked_threads (set): The threads already handled in this run.
+            download_email (bool): Whether to download the email content.
+
+        Returns:
+            dict: The email data, or None if the email was skipped.
+        """
+        stage = entry['stage'] if entry else None
+        email = entry['details'] if entry else None
+        # The HTML is only loaded for the email being resumed, it may be large
+        html_content = self.journal.get_html(message_id) if stage == Stage.CONVERTED else None
         
-        for task in response.json():
-            task_id = task['id']
-            critcality = task['criticality']
-            status = task['status']
-            thread_id = task['thread_id']
-            created_time = task['created_time']
-            
-            # 2024-07-05 19:53:40.826519
-            last_reminder_sent = task['last_reminder_sent_time'] # None if not sent
-            self.log.info(f'{task_id}, {critcality}, {status}, {thread_id}, {last_reminder_sent}, {created_time}')
-            
-            # Check if reminder should be sent
-            current_time = datetime.datetime.now()
-            temp_time_str : str = last_reminder_sent if last_reminder_sent else created_time
-            last_reminder_time = datetime.datetime.strptime(temp_time_str.split('.')[0], "%Y-%m-%dT%H:%M:%S")
-            time_diff = current_time - last_reminder_time
-            
-            if time_diff.total_seconds() < (float(self.REMINDER_INTERVALS[critcality]) * 60 * 60):
-                self.log.debug(f'Skipping reminder for task {task_id}. Last reminder sent {time_diff.total_seconds()} seconds ago.')
-                continue
-            
-            # Send reminder
-            reply_text = f"""
-            <p>This is a reminder for the task. Please check this at your earliest convenience.</p>
+        if stage is None:
+            # Code to handle mutliple messages in the same thread, skip if already checked.
+            # We always get the latest message in the first iteration and we need only that.
+            if thread_id in checked_threads:
+                self.log.info(f"Thread {thread_id} already checked. Skipping and marking this message as read...")
+                self.commit_email(message_id, thread_id, outcome='skipped')
+                return None
+            checked_threads.add(thread_id)
             
-            <p>Task Criticality: {critcality}</p>
-            <p>Task Status: {status}</p>
-            
-            <p>If the task is completed, please mark it as 'FIXED' or 'CLOSED'.</p>
-            <p>Here: <a href="{self.TASK_EDIT_URL % task_id}">{self.TASK_EDIT_URL % task_id}</a></p>
-            """
-            self.email_helper.send_reply(thread_id=thread_id, reply_text=reply_text.strip())
+            start = time.perf_counter()
+            with tracing.start_span('fetch'):
+                email = self.email_helper.get_email_details(message_id)
+            stage_duration.labels('fetch').observe(time.perf_counter() - start)
+            if not self.email_helper.is_allowed_sender(email['from']['email']):
+                self.commit_email(message_id, thread_id, outcome='rejected')
+                return None
+            self.journal.record(message_id, thread_id, Stage.FETCHED, details=email)
+            stage = Stage.FETCHED
+        
+        if stage == Stage.FETCHED:
+            start = time.perf_counter()
+            with tracing.start_span('convert'):
+                html_content = self.email_helper.download_email_as_html(message_id, email.get('size', 0)) if download_email else b""
+            stage_duration.labels('convert').observe(time.perf_counter() - start)
+            self.journal.record(message_id, thread_id, Stage.CONVERTED, html=html_content)
+            stage = Stage.CONVERTED
+        
+        if stage == Stage.CONVERTED:
+            self.log.info(email)
+            start = time.perf_counter()
+            with tracing.start_span('upload'):
+                uploaded = self.upload_email(email, html_content or b"")
+            if not uploaded:
+                self.fail_email(message_id)
+                return None
+            stage_duration.labels('upload').observe(time.perf_counter() - start)
+            upload_bytes.inc(len(html_content or b""))
+            self.journal.record(message_id, thread_id, Stage.UPLOADED)
+            stage = Stage.UPLOADED
+        
+        self.commit_email(message_id, thread_id, outcome='ingested')
+        return email
+
+    def commit_email(self, message_id: str, thread_id: str, outcome: str = 'ingested') -> None:
+        """Marks an email as read and records it as committed. Stays at the current stage if marking fails."""
+        start = time.perf_counter()
+        with tracing.start_span('commit', outcome=outcome):
+            marked = self.email_helper.mark_as_read(message_id)
+        if marked:
+            stage_duration.labels('commit').observe(time.perf_counter() - start)
+            emails_processed.labels(outcome).inc()
+            self.journal.record(message_id, thread_id, Stage.COMMITTED)
+
+    def fail_email(self, message_id: str) -> None:
+        """Counts a failed attempt of an email. An email that keeps failing is given up on and marked as read."""
+        if not self.journal.record_failed_attempt(message_id):
+            return
+        self.log.error(f"Message {message_id} failed {MAX_INGESTION_ATTEMPTS} times. Giving up, it is kept in the journal as failed.")
+        emails_processed.labels('failed').inc()
+        try:
+            self.email_helper.mark_as_read(message_id)
+        except Exception:
+            self.log.exception(f"Failed to mark the failed message {message_id} as read.")
+
+    def upload_email(self, email: dict, html_content: bytes) -> bool:
+        """
+        Creates the task of an email, or updates it if the thread already has one.
+
+        Args:
+            email (dict): The email data.
+            html_content (bytes): The email converted to HTML.
+
+        Returns:
+            bool: True if the email is handled, False if it should be retried later.
+        """
+        html_file_name = f"{email['message_id']}.html"
+        task_id = self.check_if_task_exists(email['thread_id'])
+    
+        if task_id:
+            self.log.info("Task already exists. Updating task...")
+            try:
+                self.update_task(task_id=task_id, html_content=html_content, html_file_name=html_file_name)
+            except requests.HTTPError as error:
+                if error.response is not None and error.response.status_code == 404:
+                    # The task was deleted, drop the stale cache entry so the next attempt creates a new task
+                    self.thread_task_cache.pop(email['thread_id'], None)
+                raise
+            return True
+        
+        self.log.info("Task does not exist. Creating task...")
+        to_address = email['to']
+        if self.BOT_EMAIL in to_address:
+            to_address.remove(self.BOT_EMAIL)
             
-            response = requests.post(self.endpoints['reminder_sent'] % task_id, headers=self.headers)
-            response.raise_for_status()
-            self.log.info("Reminder sent successfully!")
+        if not to_address:
+            self.email_helper.send_reply(thread_id=email['thread_id'], reply_text="No assignee found. Skipping task creation.")
+            self.log.info(f"No assignee found. Skipping task creation. Email: {email['to']}")
+            return True
+        return self.create_task_with_retries(creator_name=email['from']['email'], assigner_name=to_address[0], 
+                                    subject=email['subject'], criticality=TaskCriticality.MEDIUM.value, status=TaskStatus.OPEN.value, 
+                                    thread_id=email['thread_id'], html_content=html_content,
+                                    html_file_name=html_file_name)
+
+    def get_due_reminders(self, until: datetime.datetime) -> list:
+        """
+        Fetches the open tasks of the shards of this worker whose next reminder is due before the given time.
+
+        Args:
+            until (datetime.datetime): The time up to which reminders are due.
+
+        Returns:
+            list: The due tasks, ordered by their next reminder time.
+        """
+        response = requests.get(self.endpoints['due_reminders'], headers=self.headers, params={'now': until.isoformat()})
+        response.raise_for_status()
+        # Every worker reminds the tasks of its own shards only
+        lease = self.acquire_lease()
+        return [task for task in response.json() if self.owns_thread(lease, task['thread_id'])]
+
+    def send_reminder(self, task: dict) -> None:
+        """
+        Sends the reminder email of a task, waiting for the rate limiter first.
+
+        Args:
+            task (dict): The task to send the reminder for.
+        """
+        task_id = task['id']
+        critcality = task['criticality']
+        status = task['status']
+        thread_id = task['thread_id']
+        self.log.info(f'{task_id}, {critcality}, {status}, {thread_id}, {task["last_reminder_sent_time"]}, {task["next_reminder_at"]}')
+        
+        reply_text = f"""
+        <p>This is a reminder for the task. Please check this at your earliest convenience.</p>
+        
+        <p>Task Criticality: {critcality}</p>
+        <p>Task Status: {status}</p>
+        
+        <p>If the task is completed, please mark it as 'FIXED' or 'CLOSED'.</p>
+        <p>Here: <a href="{self.TASK_EDIT_URL % task_id}">{self.TASK_EDIT_URL % task_id}</a></p>
+        """
+        reminder_rate_limiter.acquire()
+        self.email_helper.send_reply(thread_id=thread_id, reply_text=reply_text.strip())
+        reminders_sent.inc()
+
+    def send_reminders(self) -> list:
+        """
+        Sends reminders for tasks that are overdue or due soon.
+
+        Returns:
+            list: The reminded tasks, with their next reminder time.
+        """
+        # The web service tracks when the next reminder of each task is due (based on its criticality), so only due tasks are returned
+        due_tasks = self.get_due_reminders(until=datetime.datetime.now())
+        reminded_tasks = []
+        
+        with ThreadPoolExecutor(max_workers=REMINDER_WORKERS) as executor:
+            for start in range(0, len(due_tasks), REMINDER_BATCH_SIZE):
+                batch = due_tasks[start:start + REMINDER_BATCH_SIZE]
+                futures = {executor.submit(self.send_reminder, task): task['id'] for task in batch}
+                
+                sent_task_ids = []
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                        sent_task_ids.append(futures[future])
+                    except Exception:
+                        self.log.exception(f"Failed to send reminder for task {futures[future]}.")
+                
+                if not sent_task_ids:
+                    continue
+                
+                # Record the sent markers of the whole batch with one call
+                response = requests.post(self.endpoints['reminders_sent'], headers=self.headers, json={'task_ids': sent_task_ids})
+                response.raise_for_status()
+                reminded_tasks.extend(response.json())
+                self.log.info(f"Reminders sent successfully for {len(sent_task_ids)} tasks!")
+        
+        return reminded_tasks
 
 # task_processor = TaskProcessor()
 # task_processor.process_incoming_emails(max_results=10, download_email=True)
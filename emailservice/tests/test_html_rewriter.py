@@ -0,0 +1,36 @@
+from html_rewriter import embed_cid_images
+
+IMAGES = {"a": "data:image/png;base64,QQ==", "b": "data:image/png;base64,Qg=="}
+
+def embed(html_content: str) -> str:
+    return embed_cid_images(html_content, IMAGES.get)
+
+def test_quoted_src_is_replaced():
+    assert embed('<p><img src="cid:a" width=10></p>') == f'<p><img src="{IMAGES["a"]}" width=10></p>'
+    assert embed("<img src='cid:a'>") == f'<img src="{IMAGES["a"]}">'
+
+def test_quoted_greater_than_sign_does_not_end_the_tag():
+    assert embed('<img title="a > b" src="cid:a">') == f'<img title="a > b" src="{IMAGES["a"]}">'
+
+def test_src_inside_another_attribute_value_is_not_rewritten():
+    assert embed('<img alt="see src=cid:a" src="cid:b">') == f'<img alt="see src=cid:a" src="{IMAGES["b"]}">'
+    assert embed("<img alt='src=\"cid:a\"'>") == "<img alt='src=\"cid:a\"'>"
+
+def test_unquoted_value():
+    assert embed("<img src=cid:a alt=x>") == f'<img src="{IMAGES["a"]}" alt=x>'
+    assert embed("<img src=cid:a>") == f'<img src="{IMAGES["a"]}">'
+
+def test_entity_encoded_value():
+    assert embed('<img src="&#99;id:a">') == f'<img src="{IMAGES["a"]}">'
+    assert embed('<img src="cid&colon;b">') == f'<img src="{IMAGES["b"]}">'
+
+def test_upper_case_tags_and_attributes():
+    assert embed('<IMG SRC="cid:a">') == f'<IMG SRC="{IMAGES["a"]}">'
+
+def test_unknown_cid_and_other_sources_are_left_untouched():
+    for html_content in ('<img src="cid:unknown">', '<img src="https://example.com/cid:a.png">', '<p>cid:a</p>',
+                         '<img data-src="cid:a">', '<imgx src="cid:a">'):
+        assert embed(html_content) == html_content
+
+def test_only_the_first_src_counts():
+    assert embed('<img src="cid:a" src="cid:b">') == f'<img src="{IMAGES["a"]}" src="cid:b">'
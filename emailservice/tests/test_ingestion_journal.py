@@ -0,0 +1,47 @@
+import sqlite3
+
+from ingestion_journal import IngestionJournal, Stage
+
+def test_pending_entries_are_limited_and_leave_out_the_html(tmp_path):
+    journal = IngestionJournal(str(tmp_path / "journal.db"))
+    for number in range(3):
+        journal.record(f"m{number}", f"t{number}", Stage.FETCHED, details={"subject": "s"})
+        journal.record(f"m{number}", f"t{number}", Stage.CONVERTED, html=b"<p>large</p>")
+
+    pending = journal.get_pending(limit=2)
+
+    assert [entry["message_id"] for entry in pending] == ["m0", "m1"]
+    assert all("html" not in entry for entry in pending)
+    assert journal.get_html("m0") == b"<p>large</p>"
+
+def test_email_is_failed_after_max_attempts(tmp_path):
+    journal = IngestionJournal(str(tmp_path / "journal.db"))
+    journal.record("m1", "t1", Stage.FETCHED, details={"subject": "s"})
+
+    assert not journal.record_failed_attempt("m1", max_attempts=3)
+    assert not journal.record_failed_attempt("m1", max_attempts=3)
+    assert journal.get_pending(limit=10)[0]["attempts"] == 2
+    assert journal.record_failed_attempt("m1", max_attempts=3)
+
+    assert journal.get("m1")["stage"] == Stage.FAILED
+    assert journal.get_pending(limit=10) == []
+    assert not journal.record_failed_attempt("m1", max_attempts=3)
+
+def test_unjournaled_email_has_no_attempts_to_count(tmp_path):
+    journal = IngestionJournal(str(tmp_path / "journal.db"))
+
+    assert not journal.record_failed_attempt("unknown")
+
+def test_journal_of_an_earlier_version_gets_the_attempts_column(tmp_path):
+    path = str(tmp_path / "journal.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute("""
+            CREATE TABLE messages (message_id TEXT PRIMARY KEY, thread_id TEXT NOT NULL, stage TEXT NOT NULL,
+                                   details TEXT, html BLOB, updated_time TEXT NOT NULL)
+        """)
+        connection.execute("INSERT INTO messages VALUES ('m1', 't1', 'fetched', NULL, NULL, '2024-01-01')")
+    connection.close()
+
+    journal = IngestionJournal(path)
+
+    assert journal.get_pending(limit=10)[0]["attempts"] == 0
@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+from ingestion_scheduler import IngestionScheduler
+
+class SlowTaskProcessor:
+    backlog = 0
+
+    def process_incoming_emails(self, max_results, download_email):
+        time.sleep(0.2)  # a blocking Gmail call
+        return []
+
+def test_poll_does_not_block_the_event_loop():
+    scheduler = IngestionScheduler(min_interval=1, max_interval=1, task_processor_factory=SlowTaskProcessor)
+    ticks = []
+
+    async def main():
+        ticks.append(time.perf_counter())
+        poller = asyncio.create_task(scheduler.run())
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+            ticks.append(time.perf_counter())
+        poller.cancel()
+
+    asyncio.run(main())
+
+    assert ticks[-1] - ticks[0] < 0.15
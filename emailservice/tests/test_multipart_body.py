@@ -0,0 +1,25 @@
+from email import policy
+from email.parser import BytesParser
+
+import requests
+
+from task_processor import MultipartBody
+
+def test_body_is_streamed_with_a_content_length():
+    content = b"<p>" + b"x" * (3 * MultipartBody.CHUNK_SIZE) + b"</p>"
+    body = MultipartBody({"subject": "Grüße", "status": "OPEN"}, "html_file", "m1.html", content)
+
+    request = requests.Request("POST", "http://webservice/api/tasks/", data=body,
+                               headers={"Content-Type": body.content_type}).prepare()
+
+    assert request.headers["Content-Length"] == str(len(body))
+    assert "Transfer-Encoding" not in request.headers
+    raw = b"".join(bytes(chunk) for chunk in request.body)
+    assert len(raw) == len(body)
+
+    message = BytesParser(policy=policy.default).parsebytes(f"Content-Type: {body.content_type}\r\n\r\n".encode() + raw)
+    parts = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+    assert parts["subject"].get_payload(decode=True).decode("utf-8") == "Grüße"
+    assert parts["status"].get_content() == "OPEN"
+    assert parts["html_file"].get_filename() == "m1.html"
+    assert parts["html_file"].get_payload(decode=True) == content
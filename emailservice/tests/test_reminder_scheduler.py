@@ -0,0 +1,76 @@
+import asyncio
+import datetime
+
+from reminder_scheduler import ReminderScheduler
+
+class FakeTaskProcessor:
+    def __init__(self, tasks, fail=False):
+        self.tasks = tasks
+        self.fail = fail
+        self.sent = 0
+
+    def get_due_reminders(self, until):
+        if self.fail:
+            raise ConnectionError("webservice is down")
+        return self.tasks
+
+    def send_reminders(self):
+        self.sent += 1
+        return []
+
+def due_in(seconds: float) -> str:
+    return (datetime.datetime.now() + datetime.timedelta(seconds=seconds)).isoformat()
+
+def test_failed_resync_keeps_the_queued_reminders():
+    processors = [FakeTaskProcessor([{'id': 1, 'next_reminder_at': due_in(3600)}]), FakeTaskProcessor([], fail=True)]
+    scheduler = ReminderScheduler(resync_interval=10, task_processor_factory=lambda: processors.pop(0))
+    scheduler.resync()
+    try:
+        scheduler.resync()
+    except ConnectionError:
+        pass
+
+    assert [task_id for _, task_id in scheduler.heap] == [1]
+
+def test_resync_failure_is_retried_after_a_backoff():
+    processor = FakeTaskProcessor([{'id': 1, 'next_reminder_at': due_in(0.05)}])
+    attempts = []
+
+    def factory():
+        attempts.append(datetime.datetime.now())
+        if len(attempts) == 1:
+            return FakeTaskProcessor([], fail=True)
+        return processor
+
+    scheduler = ReminderScheduler(resync_interval=10, task_processor_factory=factory)
+    scheduler.retry_delay = 0.1
+
+    async def run_briefly():
+        try:
+            await asyncio.wait_for(scheduler.run(), timeout=0.5)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(run_briefly())
+
+    assert len(attempts) == 2
+    assert (attempts[1] - attempts[0]).total_seconds() >= 0.1
+    assert processor.sent == 1
+
+def test_schedule_wakes_the_loop_for_an_earlier_reminder():
+    scheduler = ReminderScheduler(resync_interval=10, task_processor_factory=lambda: FakeTaskProcessor([]))
+    sent = []
+
+    async def main():
+        runner = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.05)
+        scheduler.task_processor.send_reminders = lambda: sent.append(1) or []
+        # Scheduled from another thread, like the ingestion polls do
+        await asyncio.to_thread(scheduler.schedule, {'id': 2, 'status': 'OPEN', 'next_reminder_at': due_in(0.05)})
+        await asyncio.sleep(0.3)
+        runner.cancel()
+
+    asyncio.run(main())
+
+    assert sent == [1]
+    assert scheduler.heap == []
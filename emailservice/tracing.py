@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+SERVICE_NAME = "emailservice"
+# Finished spans are appended to <TRACE_DIR>/<service>-<pid>.jsonl, spans are only propagated if not set
+TRACE_DIR = os.getenv('TRACE_DIR')
+
+class Span:
+    """A timed operation of a trace, continued by the webservice through the traceparent header of the API calls."""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None, **attributes) -> None:
+        self.name = name
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self) -> None:
+        _export({
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "service": SERVICE_NAME, "name": self.name, "start": self.start, "duration": time.time() - self.start,
+            "attributes": self.attributes, "error": self.error,
+        })
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('trace_span', default=None)
+
+_export_lock = threading.Lock()
+_export_file = None
+
+def _export(record: dict) -> None:
+    global _export_file
+    if not TRACE_DIR:
+        return
+    line = json.dumps(record, default=str) + "\n"
+    with _export_lock:
+        if _export_file is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            # One file per process, merged with the files of the other services by tools/traces.py
+            _export_file = open(os.path.join(TRACE_DIR, f"{SERVICE_NAME}-{os.getpid()}.jsonl"), "a", buffering=1)
+        _export_file.write(line)
+
+@contextmanager
+def start_span(name: str, **attributes) -> Iterator[Span]:
+    """Runs the block in a new span, a child of the current span if any, or else the root span of a new trace."""
+    parent = _current_span.get()
+    span = Span(name, parent and parent.trace_id, parent and parent.span_id, **attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+def inject(headers: Optional[dict] = None) -> dict:
+    """Returns a copy of the given request headers with the traceparent of the current span, if any."""
+    headers = dict(headers or {})
+    span = _current_span.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    return headers
@@ -1,8 +1,12 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
+import shutil
+import time
 import os
+import metrics
+import tracing
 
 #### Load Environment Variables - START ####
 from dotenv import load_dotenv
@@ -12,6 +16,9 @@ help_str = """
 Required Environment Variables:
 - UPLOAD_DIRECTORY: The directory where the uploaded files will be stored. (Usage: C:\\uploads)
 - ALLOW_ORIGIN: The URL of the frontend app that will be using this service. (Usage: http://localhost:3000,http://localhost:3001)
+
+Optional Environment Variables:
+- TRACE_DIR: The directory the spans of every request are written to. Tracing is off if not set.
 """
 
 UPLOAD_DIRECTORY = os.getenv('UPLOAD_DIRECTORY')
@@ -36,6 +43,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Ensure the upload directory exists
 os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
@@ -44,8 +53,11 @@ os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 async def upload_file(file: UploadFile = File(...)) -> dict:
     """Upload a file to the server"""
     file_location = Path(UPLOAD_DIRECTORY) / file.filename
-    with open(file_location, "wb") as buffer:
-        buffer.write(file.file.read())
+    start = time.perf_counter()
+    with tracing.start_span("write file", file=file.filename), open(file_location, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)  # copy in chunks, large files are never fully held in memory
+        metrics.upload_bytes.inc(buffer.tell())
+    metrics.upload_write_duration.observe(time.perf_counter() - start)
     return {"file_url": f"/files/{file.filename}"}
 
 # This is just a helper endpoint to see the uploaded files in the browser
@@ -63,3 +75,8 @@ async def get_file(filename: str) -> FileResponse:
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
     return FileResponse(file_path)
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics() -> PlainTextResponse:
+    """Request and upload metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
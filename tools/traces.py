@@ -0,0 +1,102 @@
+"""
+Prints the critical path of the slowest traces written by the services to their TRACE_DIR.
+
+An incoming email is traced from the emailservice (Gmail calls and API calls) through the webservice request and its
+SQL statements to the ftpservice upload. The critical path of a trace is the chain of spans that determined its end:
+starting from the root, the child that finished last, then the child that finished before that one started, and so on.
+Self time is the time a span on the path spent outside its critical children, e.g. waiting on the network.
+
+Usage:
+    python tools/traces.py traces/ [--limit 5] [--root "ingest email"] [--min-ms 0]
+"""
+import argparse
+import glob
+import json
+import os
+from collections import defaultdict
+from typing import Dict, List
+
+# Spans of different processes are timed with their own clocks, children may overshoot their parent slightly
+CLOCK_TOLERANCE = 0.001
+
+def load_spans(paths: List[str]) -> Dict[str, List[dict]]:
+    """Reads the spans of the given files and directories. Returns the spans per trace ID."""
+    traces = defaultdict(list)
+    for path in paths:
+        files = glob.glob(os.path.join(path, '*.jsonl')) if os.path.isdir(path) else [path]
+        for file in files:
+            with open(file) as f:
+                for line in f:
+                    try:
+                        span = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crashed process
+                    span['end'] = span['start'] + span['duration']
+                    traces[span['trace_id']].append(span)
+    return traces
+
+def find_root(spans: List[dict]) -> dict:
+    """The span without a parent in the trace, the longest one if the root span is missing."""
+    span_ids = {span['span_id'] for span in spans}
+    roots = [span for span in spans if span['parent_id'] not in span_ids]
+    return max(roots, key=lambda span: span['duration'])
+
+def critical_path(span: dict, children: Dict[str, List[dict]], depth: int = 0) -> List[tuple]:
+    """Returns the (depth, span, self time) entries of the critical path below a span, in start order."""
+    critical_children = []
+    cursor = None
+    for child in sorted(children[span['span_id']], key=lambda child: child['end'], reverse=True):
+        if cursor is None or child['end'] <= cursor + CLOCK_TOLERANCE:
+            critical_children.append(child)
+            cursor = child['start']
+    self_time = span['duration'] - sum(child['duration'] for child in critical_children)
+    path = [(depth, span, max(self_time, 0.0))]
+    for child in reversed(critical_children):
+        path += critical_path(child, children, depth + 1)
+    return path
+
+def print_trace(trace_id: str, spans: List[dict]) -> None:
+    children = defaultdict(list)
+    for span in spans:
+        children[span['parent_id']].append(span)
+    root = find_root(spans)
+    path = critical_path(root, children)
+
+    services = defaultdict(float)
+    for _, span, self_time in path:
+        services[span['service']] += self_time
+    breakdown = ', '.join(f"{service} {seconds * 1000:.1f}ms" for service, seconds in sorted(services.items(), key=lambda item: -item[1]))
+    print(f"trace {trace_id}  {root['duration'] * 1000:.1f}ms  {len(spans)} spans  ({breakdown})")
+
+    for depth, span, self_time in path:
+        details = ' '.join(f"{key}={value}" for key, value in span['attributes'].items() if key != 'statement')
+        if span.get('error'):
+            details += f" error={span['error']}"
+        label = f"{'  ' * depth}{span['service']}: {span['name']}"
+        print(f"  {span['duration'] * 1000:>9.1f}ms {self_time * 1000:>9.1f}ms self  {label}  {details}".rstrip())
+        if 'statement' in span['attributes']:
+            print(f"  {'':>27}{'  ' * depth}  {span['attributes']['statement']}")
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='TRACE_DIR directories, or span files, of the services.')
+    parser.add_argument('--limit', type=int, default=5, help='Number of traces to print, slowest first.')
+    parser.add_argument('--root', help='Only consider traces whose root span has this name, e.g. "ingest email".')
+    parser.add_argument('--min-ms', type=float, default=0, help='Only consider traces at least this long.')
+    args = parser.parse_args()
+
+    traces = load_spans(args.paths)
+    candidates = []
+    for trace_id, spans in traces.items():
+        root = find_root(spans)
+        if args.root and root['name'] != args.root:
+            continue
+        if root['duration'] * 1000 >= args.min_ms:
+            candidates.append((root['duration'], trace_id))
+    print(f"{len(candidates)} of {len(traces)} traces match, the {min(args.limit, len(candidates))} slowest:\n")
+    for _, trace_id in sorted(candidates, reverse=True)[:args.limit]:
+        print_trace(trace_id, traces[trace_id])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Runs a scripted, mixed workload against the webservice ASGI app in-process and reports, per endpoint, the throughput,
+the latency percentiles and the number of SQL statements per request.
+
+The workload is drawn from a seeded random generator, so two runs on the same database issue the same requests.
+Results can be saved as JSON and compared with a run of another commit.
+
+Usage (from the webservice directory):
+    python benchmarks/seed.py bench.db --tasks 1000000
+    python benchmarks/bench_api.py bench.db [--requests 2000] [--output results.json] [--compare baseline.json]
+
+The FTP upload of created and updated tasks is replaced by a stub, only the webservice itself is measured.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+base_dir = os.path.dirname(benchmarks_dir)
+sys.path.append(base_dir)
+sys.path.append(benchmarks_dir)
+
+from seed import BENCH_PASSWORD, WORDS, seed_database, thread_id, username
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[round(fraction * (len(ordered) - 1))]
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=base_dir).stdout.strip()
+    except OSError:
+        return 'unknown'
+
+def build_workload(tasks: int, users: int) -> List[Tuple[str, float, Callable]]:
+    """The endpoints of the workload, as (name, weight, request) where request(client, rng, headers) sends one request."""
+    def login(client, rng, headers):
+        return client.post('/token', data={'username': username(0), 'password': BENCH_PASSWORD})
+
+    def list_tasks(client, rng, headers):
+        return client.get('/api/tasks/', params={'skip': rng.randrange(max(tasks - 100, 1)), 'limit': 100}, headers=headers)
+
+    def list_large_page(client, rng, headers):
+        return client.get('/api/tasks/', params={'skip': rng.randrange(max(tasks - 1000, 1)), 'limit': 1000}, headers=headers)
+
+    def filter_tasks(client, rng, headers):
+        return client.get('/api/tasks/', params={'status': 'OPEN', 'criticality': rng.choice(['HIGH', 'CRITICAL']), 'limit': 50}, headers=headers)
+
+    def search_tasks(client, rng, headers):
+        return client.get('/api/tasks/', params={'subject_contains': rng.choice(WORDS), 'limit': 50}, headers=headers)
+
+    def tasks_by_assigner(client, rng, headers):
+        return client.get('/api/tasks/', params={'assigner_name': username(rng.randrange(users)), 'limit': 50}, headers=headers)
+
+    def get_task(client, rng, headers):
+        return client.get(f'/api/tasks/{rng.randrange(tasks) + 1}', headers=headers)
+
+    def create_task(client, rng, headers):
+        data = {
+            'creator_name': username(rng.randrange(users)),
+            'assigner_name': username(rng.randrange(users)),
+            'subject': ' '.join(rng.choice(WORDS) for _ in range(5)),
+            'criticality': 'MEDIUM',
+            'status': 'OPEN',
+            'thread_id': f'bench{rng.getrandbits(64):016x}',
+        }
+        return client.post('/api/tasks/', data=data, files={'html_file': ('task.html', b'<html></html>', 'text/html')}, headers=headers)
+
+    def update_task(client, rng, headers):
+        data = {'criticality': rng.choice(['LOW', 'MEDIUM', 'HIGH', 'CRITICAL'])}
+        return client.put(f'/api/tasks/{rng.randrange(tasks) + 1}', data=data, headers=headers)
+
+    def lookup_tasks(client, rng, headers):
+        thread_ids = [thread_id(rng.randrange(tasks)) for _ in range(100)]
+        return client.post('/api/tasks/lookup', json={'thread_ids': thread_ids}, headers=headers)
+
+    def due_reminders(client, rng, headers):
+        return client.get('/api/tasks/due-reminders', params={'now': '2023-08-01T00:00:00'}, headers=headers)
+
+    return [
+        ('POST /token', 1, login),
+        ('GET /api/tasks/', 20, list_tasks),
+        ('GET /api/tasks/?limit=1000', 2, list_large_page),
+        ('GET /api/tasks/?status&criticality', 10, filter_tasks),
+        ('GET /api/tasks/?subject_contains', 5, search_tasks),
+        ('GET /api/tasks/?assigner_name', 5, tasks_by_assigner),
+        ('GET /api/tasks/{task_id}', 30, get_task),
+        ('POST /api/tasks/', 5, create_task),
+        ('PUT /api/tasks/{task_id}', 5, update_task),
+        ('POST /api/tasks/lookup', 10, lookup_tasks),
+        ('GET /api/tasks/due-reminders', 2, due_reminders),
+    ]
+
+def run(database: str, requests: int, seed: int) -> Dict[str, dict]:
+    """Runs the workload against the app on the given database. Returns the results per endpoint."""
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{os.path.abspath(database)}',
+        'FTP_SERVER': 'http://ftp.invalid',
+        'ALLOW_ORIGIN': 'http://localhost:3000',
+    })
+    import logging
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    import main
+    from routes import tasks as task_routes
+    from utils import dependencies
+    logging.getLogger().setLevel(logging.WARNING)  # the app logs every request to the console
+
+    task_routes.upload_to_ftp = lambda html_file: f'/files/{html_file.filename}'
+
+    statements = [0]
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements[0] += 1
+    for engine in (dependencies.engine, dependencies.read_engine):
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+    with dependencies.engine.connect() as connection:
+        task_count = connection.exec_driver_sql('SELECT MAX(id) FROM tasks').scalar() or 1
+        user_count = connection.exec_driver_sql('SELECT COUNT(*) FROM users').scalar() or 1
+
+    rng = random.Random(seed)
+    workload = build_workload(task_count, user_count)
+    names, weights, senders = zip(*workload)
+    script = rng.choices(range(len(workload)), weights, k=requests)
+
+    client = TestClient(main.app)
+    token = client.post('/token', data={'username': username(0), 'password': BENCH_PASSWORD}).json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    latencies = defaultdict(list)
+    sql_counts = defaultdict(list)
+    errors = defaultdict(int)
+    start = time.perf_counter()
+    for index in script:
+        statements_before = statements[0]
+        request_start = time.perf_counter()
+        response = senders[index](client, rng, headers)
+        latencies[names[index]].append(time.perf_counter() - request_start)
+        sql_counts[names[index]].append(statements[0] - statements_before)
+        if response.status_code >= 400 and response.status_code != 404:
+            errors[names[index]] += 1
+    elapsed = time.perf_counter() - start
+
+    results = {}
+    for name in names:
+        durations = latencies[name]
+        if not durations:
+            continue
+        results[name] = {
+            'requests': len(durations),
+            'errors': errors[name],
+            'rps': len(durations) / sum(durations),
+            'p50_ms': percentile(durations, 0.5) * 1000,
+            'p95_ms': percentile(durations, 0.95) * 1000,
+            'p99_ms': percentile(durations, 0.99) * 1000,
+            'sql_per_request': sum(sql_counts[name]) / len(durations),
+        }
+    durations = [duration for name in names for duration in latencies[name]]
+    results['total'] = {
+        'requests': requests,
+        'errors': sum(errors.values()),
+        'rps': requests / elapsed,
+        'p50_ms': percentile(durations, 0.5) * 1000,
+        'p95_ms': percentile(durations, 0.95) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+        'sql_per_request': sum(sum(counts) for counts in sql_counts.values()) / requests,
+    }
+    return results
+
+def print_results(results: Dict[str, dict], baseline: Dict[str, dict] = None) -> None:
+    header = f"{'endpoint':<38}{'reqs':>6}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'sql/req':>9}"
+    if baseline:
+        header += f"{'p50 vs base':>13}{'p99 vs base':>13}"
+    print(header)
+    for name, result in results.items():
+        line = (f"{name:<38}{result['requests']:>6}{result['errors']:>5}{result['rps']:>9.1f}"
+                f"{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['sql_per_request']:>9.1f}")
+        base = (baseline or {}).get(name)
+        if base:
+            line += f"{(result['p50_ms'] / base['p50_ms'] - 1) * 100:>+12.1f}%{(result['p99_ms'] / base['p99_ms'] - 1) * 100:>+12.1f}%"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database', help='The seeded SQLite database, seeded with the volumes below if it does not exist.')
+    parser.add_argument('--users', type=int, default=5_000, help='Users to seed a missing database with.')
+    parser.add_argument('--tasks', type=int, default=100_000, help='Tasks to seed a missing database with.')
+    parser.add_argument('--taskprops', type=int, default=500_000, help='Task properties to seed a missing database with.')
+    parser.add_argument('--requests', type=int, default=2_000, help='Requests in the workload.')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the data and the workload.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='A JSON file of an earlier run to compare the results with.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        seed_database(args.database, args.users, args.tasks, args.taskprops, args.seed)
+    # The workload writes to the database, run it on a copy so every run starts from the same data
+    work_database = f'{args.database}.run'
+    with open(args.database, 'rb') as source, open(work_database, 'wb') as target:
+        while chunk := source.read(1 << 20):
+            target.write(chunk)
+
+    try:
+        results = run(work_database, args.requests, args.seed)
+    finally:
+        os.remove(work_database)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline_run = json.load(f)
+        print(f"Compared with {args.compare} (commit {baseline_run['commit']})")
+        baseline = baseline_run['results']
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'time': datetime.now().isoformat(), 'database': os.path.basename(args.database),
+                       'requests': args.requests, 'seed': args.seed, 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
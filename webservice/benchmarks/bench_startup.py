@@ -0,0 +1,102 @@
+"""
+Measures the cold start of the webservice: the time to import `main`, and the time from launching a server to its
+first answered request, with the CPU time its processes used by then. Servers measured are a single uvicorn process,
+uvicorn with workers importing the app each, and `serve.py` importing the app once before forking its workers.
+
+Usage (from the webservice directory):
+    python benchmarks/seed.py bench.db --tasks 100000
+    python benchmarks/bench_startup.py bench.db [--runs 5] [--workers 4]
+
+The first launch on a database may upgrade its schema, it is run once before the measured runs.
+"""
+import argparse
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+base_dir = os.path.dirname(benchmarks_dir)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def server_env(db_path: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.abspath(db_path)}",
+        "FTP_SERVER": env.get("FTP_SERVER", "http://127.0.0.1:1"),
+        "ALLOW_ORIGIN": env.get("ALLOW_ORIGIN", "http://localhost"),
+    })
+    return env
+
+def import_time(db_path: str) -> float:
+    """Seconds to import `main` in a fresh interpreter."""
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=base_dir, env=server_env(db_path),
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def children_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def time_to_first_request(command: list, db_path: str, port: int, timeout: float = 60) -> tuple:
+    """Seconds from launching a server to its first answered request, and CPU seconds of the server until it stopped."""
+    url = f"http://127.0.0.1:{port}/api/"
+    cpu_start = children_cpu_time()
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=base_dir, env=server_env(db_path),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        elapsed = time.perf_counter() - start
+                        break
+            except OSError:
+                time.sleep(0.005)
+        else:
+            raise TimeoutError(f"{' '.join(command)} did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+    return elapsed, children_cpu_time() - cpu_start
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_path", help="SQLite database the servers are started on")
+    parser.add_argument("--runs", type=int, default=5, help="Launches measured per server")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes of serve.py")
+    args = parser.parse_args()
+
+    servers = {
+        "uvicorn main:app": lambda port: [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        f"uvicorn --workers {args.workers}": lambda port: [
+            sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(args.workers)
+        ],
+        f"serve.py --workers {args.workers}": lambda port: [
+            sys.executable, "serve.py", "--workers", str(args.workers), "--port", str(port)
+        ],
+    }
+    if not os.path.exists(os.path.join(base_dir, "serve.py")):
+        servers.popitem()
+
+    import_time(args.db_path)  # upgrades the schema of the database if needed
+    imports = [import_time(args.db_path) for _ in range(args.runs)]
+    print(f"{'import main':<28} median {statistics.median(imports) * 1000:7.0f} ms   min {min(imports) * 1000:7.0f} ms")
+    for name, command in servers.items():
+        runs = [time_to_first_request(command(port), args.db_path, port) for port in [free_port() for _ in range(args.runs)]]
+        timings, cpu = [elapsed for elapsed, _ in runs], [cpu for _, cpu in runs]
+        print(f"{name:<28} median {statistics.median(timings) * 1000:7.0f} ms   min {min(timings) * 1000:7.0f} ms"
+              f"   to first request, CPU {statistics.median(cpu) * 1000:7.0f} ms")
+
+if __name__ == "__main__":
+    main()
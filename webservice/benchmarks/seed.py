@@ -0,0 +1,142 @@
+"""
+Seeds a SQLite database with a large, deterministic dataset for the webservice benchmarks.
+
+Rows are bulk inserted with `executemany` in chunks, in a single transaction and with syncing turned off,
+so a million tasks take seconds rather than hours. Every user has the password `BENCH_PASSWORD`, hashed once.
+
+Usage (from the webservice directory):
+    python benchmarks/seed.py bench.db [--users 50000] [--tasks 1000000] [--taskprops 5000000] [--seed 42]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterable, Iterator
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(base_dir)
+
+from sqlalchemy import create_engine
+from passlib.context import CryptContext
+import schemas
+from utils import reminders, schema
+
+BENCH_PASSWORD = 'bench'
+CHUNK_SIZE = 10_000
+
+WORDS = ("build release deploy failing test check update review regression server client customer report "
+         "screenshot logs error crash timeout fixed verify staging production database login payment").split()
+STATUSES = [(schemas.TaskStatus.OPEN.value, 0.3), (schemas.TaskStatus.FIXED.value, 0.2), (schemas.TaskStatus.CLOSED.value, 0.5)]
+CRITICALITIES = [(schemas.TaskCriticality.LOW.value, 0.3), (schemas.TaskCriticality.MEDIUM.value, 0.4),
+                 (schemas.TaskCriticality.HIGH.value, 0.2), (schemas.TaskCriticality.CRITICAL.value, 0.1)]
+PROP_NAMES = ["component", "customer", "environment", "release", "owner_team", "ticket", "browser", "os"]
+
+# Store datetimes the way SQLAlchemy does
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(sep=" "))
+
+def username(index: int) -> str:
+    return f"user{index:06d}@gmail.com"
+
+def thread_id(index: int) -> str:
+    return f"thread{index:08d}"
+
+def _chunks(rows: Iterable[tuple]) -> Iterator[list]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, CHUNK_SIZE)):
+        yield chunk
+
+def _users(count: int, hashed_password: str, now: datetime) -> Iterator[tuple]:
+    for index in range(count):
+        # The first user is the superuser the benchmarks log in with
+        yield (index + 1, username(index), hashed_password, True, index == 0, "admin" if index == 0 else "user", now)
+
+def _tasks(rng: random.Random, count: int, users: int, now: datetime) -> Iterator[tuple]:
+    status_names, status_weights = zip(*STATUSES)
+    criticality_names, criticality_weights = zip(*CRITICALITIES)
+    for index in range(count):
+        created_time = now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        last_reminder_sent_time = created_time + timedelta(hours=rng.randrange(48)) if rng.random() < 0.5 else None
+        criticality = rng.choices(criticality_names, criticality_weights)[0]
+        yield (
+            index + 1,
+            rng.randrange(users) + 1,
+            rng.randrange(users) + 1,
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))).capitalize(),
+            criticality,
+            rng.choices(status_names, status_weights)[0],
+            thread_id(index),
+            f"/files/{thread_id(index)}.html",
+            created_time,
+            last_reminder_sent_time,
+            reminders.get_next_reminder_at(criticality, last_reminder_sent_time or created_time),
+        )
+
+def _taskprops(rng: random.Random, count: int, tasks: int, now: datetime) -> Iterator[tuple]:
+    for index in range(count):
+        name = rng.choice(PROP_NAMES)
+        yield (index + 1, rng.randrange(tasks) + 1, name, f"{name}-{rng.randrange(500)}", now)
+
+def _insert(connection: sqlite3.Connection, sql: str, rows: Iterable[tuple], label: str) -> None:
+    start = time.perf_counter()
+    inserted = 0
+    for chunk in _chunks(rows):
+        connection.executemany(sql, chunk)
+        inserted += len(chunk)
+    print(f"{label}: {inserted} rows in {time.perf_counter() - start:.1f}s")
+
+def seed_database(path: str, users: int, tasks: int, taskprops: int, seed: int = 42) -> None:
+    """
+    Creates the schema in a new SQLite database and fills it with generated rows.
+
+    Args:
+        path (str): The path of the database file, it must not exist yet.
+        users (int): The number of users.
+        tasks (int): The number of tasks, spread over the users.
+        taskprops (int): The number of task properties, spread over the tasks.
+        seed (int): The seed of the generated data.
+    """
+    if os.path.exists(path):
+        raise ValueError(f"{path} already exists, seed a new database file.")
+    rng = random.Random(seed)
+    now = datetime(2024, 7, 1)  # fixed, so the same seed always gives the same database
+    hashed_password = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(BENCH_PASSWORD)
+
+    def load(db) -> None:
+        connection = sqlite3.connect(path)
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("PRAGMA journal_mode = MEMORY")
+        with connection:
+            _insert(connection, "INSERT INTO users (id, username, hashed_password, is_active, is_superuser, role, created_time) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?)", _users(users, hashed_password, now), "users")
+            _insert(connection, "INSERT INTO tasks (id, creator_id, assigner_id, subject, criticality, status, thread_id, html_file, "
+                                "created_time, last_reminder_sent_time, next_reminder_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    _tasks(rng, tasks, users, now), "tasks")
+            _insert(connection, "INSERT INTO taskprops (id, task_id, attrname, attrval, modified_time) VALUES (?, ?, ?, ?, ?)",
+                    _taskprops(rng, taskprops, tasks, now), "taskprops")
+        connection.execute("ANALYZE")
+        connection.close()
+        # The statistics are kept by the task writes of the app, the raw inserts above are counted once
+        crud.rebuild_task_stats(db)
+
+    # crud reads DATABASE_URL on import, the statistics are counted with the session of the seeded database either way
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.abspath(path)}")
+    from utils import crud
+    # The data is loaded as the backfill, so the schema version is recorded only once the database is complete
+    schema.upgrade_schema(create_engine(f"sqlite:///{path}"), backfill=load)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database', help='Path of the SQLite database file to create.')
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--tasks', type=int, default=1_000_000)
+    parser.add_argument('--taskprops', type=int, default=5_000_000)
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the generated data.')
+    args = parser.parse_args()
+    seed_database(args.database, args.users, args.tasks, args.taskprops, args.seed)
+
+if __name__ == '__main__':
+    main()
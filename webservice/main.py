@@ -13,6 +13,21 @@ Required Environment Variables:
 - DATABASE_URL: The URL of the SQLite database.
 - FTP_SERVER: The Base URL of the FTP server where the files will be uploaded.
 - ALLOW_ORIGIN: The list of allowed origins for CORS.
+
+Optional Environment Variables:
+- WORKER_SHARDS: The number of shards email threads are split into across emailservice workers. (Default: 16)
+- REMINDER_INTERVAL_FOR_CRITICAL: The interval in hours to send reminders for critical tasks. (Default: 5)
+- REMINDER_INTERVAL_FOR_HIGH: The interval in hours to send reminders for high priority tasks. (Default: 10)
+- REMINDER_INTERVAL_FOR_MEDIUM: The interval in hours to send reminders for medium priority tasks. (Default: 24)
+- REMINDER_INTERVAL_FOR_LOW: The interval in hours to send reminders for low priority tasks. (Default: 48)
+- ARCHIVE_CLOSED_AFTER_DAYS: The days a task is CLOSED before `python manage.py archive-tasks` moves it to the archive tables. (Default: 90)
+- REMINDER_HISTORY_RETENTION_DAYS: The days reminder sends are kept one by one, before `python manage.py compact-reminders` counts them per day. (Default: 30)
+- SLOW_QUERY_THRESHOLD_MS: Statements slower than this are logged to LogFiles/slow_queries.log with their query plan. (Default: 100)
+- N_PLUS_ONE_THRESHOLD: A statement repeated this many times in one request is logged as a likely N+1. (Default: 5)
+- DEBUG: Add the SQL statement count, DB time and N+1 suspects of every request as X-DB-* response headers. (Default: false)
+- READ_POOL_SIZE: The number of read-only database connections kept for GET routes, as many more are opened under load. (Default: 10)
+- TASK_EVENT_BUFFER_SIZE: The number of task events kept for clients of /api/tasks/stream resuming with Last-Event-ID. (Default: 1000)
+- TRACE_DIR: The directory the spans of every request, its SQL statements and its FTP upload are written to. Tracing is off if not set.
 """
 
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -32,10 +47,10 @@ allowed_origin = ALLOW_ORIGIN.split(",")
 
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routes import tasks, home, users
-from utils import auth, crud, dependencies, middlewares
+from routes import tasks, home, users, workers
+from utils import auth, crud, dependencies, metrics, middlewares, schema, sql_profiler, tracing
 import models, schemas
 from sqlalchemy.orm import Session
 import datetime
@@ -43,8 +58,10 @@ import datetime
 # Configure Logger
 from utils import log_config
     
-# Create the database tables if they do not exist
-models.Base.metadata.create_all(bind=dependencies.engine)
+# Create the database tables if they do not exist, and add columns / indexes missing from older databases.
+# A database already at the schema version of the models is only checked with one query.
+# The backfills run before the version is recorded, a start that fails in them runs them again.
+schema.upgrade_schema(dependencies.engine, backfill=crud.backfill_upgraded_database)
 
 app = FastAPI(
     title="Issue Tracker APIs",
@@ -62,6 +79,10 @@ app = FastAPI(
             "name": "users",
             "description": "Operations related to users.",
         },
+        {
+            "name": "workers",
+            "description": "Shard leases of the emailservice workers.",
+        },
     ],
     swagger_ui_init_oauth={
         "clientId": "your-client-id",
@@ -78,11 +99,19 @@ app.add_middleware(
 )
 
 # configure middlewares
+app.add_middleware(sql_profiler.SQLProfilingMiddleware)
 app.add_middleware(middlewares.LoggingMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)  # outermost, so the latency covers the other middlewares too
+for engine, pool in ((dependencies.engine, "write"), (dependencies.read_engine, "read")):
+    metrics.instrument_engine(engine, pool)
+    sql_profiler.instrument_engine(engine)
+    tracing.instrument_engine(engine)
 
 app.include_router(home.router, prefix="/api", tags=["home"])
 app.include_router(tasks.router, prefix="/api", tags=["tasks"])
 app.include_router(users.router, prefix="/api/users", tags=["users"])
+app.include_router(workers.router, prefix="/api/workers", tags=["workers"])
 
 
 @app.post("/token", response_model=schemas.Token)
@@ -106,4 +135,9 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         "user": schemas.User(**crud.get_user(db, user.id).__dict__).model_dump()
     })
     response.set_cookie(key="access_token", value=access_token, httponly=True, samesite='Strict')
-    return response
\ No newline at end of file
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics() -> PlainTextResponse:
+    """Request, database and upload metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,81 @@
+"""
+Maintenance commands of the webservice database.
+
+Usage (from the webservice directory, with DATABASE_URL set):
+    python manage.py repair-stats [--check]
+    python manage.py compact-reminders [--retention-days DAYS]
+    python manage.py archive-tasks [--closed-days DAYS]
+"""
+import argparse
+import os
+import sys
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(base_dir)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+def repair_stats(args) -> int:
+    """Recount the task statistics from the tasks, and report the counts that had drifted."""
+    from utils import crud, dependencies, schema
+    schema.upgrade_schema(dependencies.engine, backfill=crud.backfill_upgraded_database)
+    with dependencies.SessionLocal() as db:
+        drift = crud.rebuild_task_stats(db, repair=not args.check)
+
+    for assigner_id, status, criticality, stored, actual in drift:
+        assignee = "all assignees" if assigner_id == crud.ALL_ASSIGNEES else f"assignee {assigner_id}"
+        print(f"{assignee:<20} {status:<8} {criticality:<9} stored {stored:>8}  actual {actual:>8}")
+    if not drift:
+        print("Task statistics are consistent.")
+    elif args.check:
+        print(f"{len(drift)} task statistics have drifted. Run without --check to repair them.")
+    else:
+        print(f"{len(drift)} task statistics repaired.")
+    return 1 if drift and args.check else 0
+
+def compact_reminders(args) -> int:
+    """Roll the reminder history older than the retention into daily counts. Meant to run daily, e.g. from cron."""
+    from utils import crud, dependencies, schema
+    schema.upgrade_schema(dependencies.engine, backfill=crud.backfill_upgraded_database)
+    with dependencies.SessionLocal() as db:
+        removed = crud.compact_reminder_history(db, retention_days=args.retention_days)
+    print(f"{removed} reminder history rows compacted.")
+    return 0
+
+def archive_tasks(args) -> int:
+    """Move the tasks closed for long enough to the archive tables. Meant to run daily, e.g. from cron."""
+    from utils import crud, dependencies, schema
+    schema.upgrade_schema(dependencies.engine, backfill=crud.backfill_upgraded_database)
+    with dependencies.SessionLocal() as db:
+        archived = crud.archive_closed_tasks(db, closed_days=args.closed_days)
+    print(f"{archived} closed tasks archived.")
+    return 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("repair-stats", help="Recount the task statistics served by /api/tasks/stats.")
+    command.add_argument("--check", action="store_true", help="Only report the drifted counts, exit with 1 if any.")
+    command.set_defaults(handler=repair_stats)
+
+    command = commands.add_parser("compact-reminders", help="Roll old reminder history rows into per task daily counts.")
+    command.add_argument(
+        "--retention-days", type=int, default=int(os.getenv("REMINDER_HISTORY_RETENTION_DAYS", 30)),
+        help="Days the individual reminders are kept. (Default: REMINDER_HISTORY_RETENTION_DAYS or 30)",
+    )
+    command.set_defaults(handler=compact_reminders)
+
+    command = commands.add_parser("archive-tasks", help="Move long closed tasks, with their props and reminders, to the archive tables.")
+    command.add_argument(
+        "--closed-days", type=int, default=int(os.getenv("ARCHIVE_CLOSED_AFTER_DAYS", 90)),
+        help="Days a task is closed before it is archived. (Default: ARCHIVE_CLOSED_AFTER_DAYS or 90)",
+    )
+    command.set_defaults(handler=archive_tasks)
+
+    args = parser.parse_args()
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
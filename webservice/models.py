@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, func
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, Text, Index, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -24,12 +24,24 @@ class Task(Base):
     status = Column(String)
     thread_id = Column(String)
     html_file = Column(Text)
-    created_time = Column(DateTime, server_default=func.now())
-    last_reminder_sent_time = Column(DateTime, default=None) # Assume reminder sent time is set when task is created
+    created_time = Column(DateTime, server_default=func.now(), index=True)
+    last_reminder_sent_time = Column(DateTime, default=None, index=True) # Assume reminder sent time is set when task is created
+    next_reminder_at = Column(DateTime, default=None) # Precomputed from criticality and last reminder (or creation) time
+    version = Column(Integer, nullable=False, default=1, server_default="1") # Bumped by every write, the ETag of the task
+    closed_time = Column(DateTime, default=None) # Set when the status becomes CLOSED, the age the task is archived at
 
     creator = relationship("User", foreign_keys=[creator_id])
     assigner = relationship("User", foreign_keys=[assigner_id])
 
+    __table_args__ = (
+        Index("ix_tasks_status_next_reminder_at", "status", "next_reminder_at"),
+        Index("uq_tasks_thread_id", "thread_id", unique=True), # one task per email thread
+        Index("ix_tasks_assigner_id_created_time", "assigner_id", "created_time"), # the tasks of a user, newest first
+        Index("ix_tasks_creator_id_created_time", "creator_id", "created_time"),
+        # IDs of archived tasks are never reused, they stay the IDs of the archived tasks
+        {"sqlite_autoincrement": True},
+    )
+
 class TaskProp(Base):
     __tablename__ = "taskprops"
     id = Column(Integer, primary_key=True, index=True)
@@ -40,7 +52,14 @@ class TaskProp(Base):
 
     task = relationship("Task", back_populates="props")
 
+    __table_args__ = (
+        Index("ix_taskprops_task_id_attrname", "task_id", "attrname"), # the props of a task
+        Index("ix_taskprops_attrname_attrval", "attrname", "attrval", "task_id"), # the tasks with a prop value, one seek per EXISTS
+        {"sqlite_autoincrement": True},
+    )
+
 class TaskReminderHistory(Base):
+    """Append-only log of the reminders sent, rows older than the retention are rolled into TaskReminderDailyCount."""
     __tablename__ = "TaskReminderHistory"
     id = Column(Integer, primary_key=True, index=True)
     task_id = Column(Integer, ForeignKey('tasks.id'), nullable=False)
@@ -48,5 +67,101 @@ class TaskReminderHistory(Base):
 
     task = relationship("Task", back_populates="reminderhistory")
 
+    __table_args__ = (
+        Index("ix_TaskReminderHistory_task_id_time", "task_id", "reminder_sent_time"), # the reminders of a task
+        Index("ix_TaskReminderHistory_time", "reminder_sent_time"), # the rows to compact
+        {"sqlite_autoincrement": True},
+    )
+
+class TaskReminderDailyCount(Base):
+    """Number of reminders sent for a task per day, for the days compacted out of TaskReminderHistory."""
+    __tablename__ = "task_reminder_daily_counts"
+    task_id = Column(Integer, ForeignKey('tasks.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class TaskStat(Base):
+    """Number of tasks per assignee, status and criticality, kept up to date by every task write. Assignee 0 counts all tasks."""
+    __tablename__ = "task_stats"
+    assigner_id = Column(Integer, primary_key=True)
+    status = Column(String, primary_key=True)
+    criticality = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class SchemaMeta(Base):
+    """Facts about the database itself, like the version of the schema it was last upgraded to."""
+    __tablename__ = "schema_meta"
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+
+class Worker(Base):
+    """Heartbeat of an emailservice worker, a worker is live until its heartbeat expires."""
+    __tablename__ = "workers"
+    worker_id = Column(String, primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class WorkerLease(Base):
+    """Lease of a shard of email threads by an emailservice worker."""
+    __tablename__ = "worker_leases"
+    shard = Column(Integer, primary_key=True)
+    worker_id = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+
+# Closed tasks are moved with their rows to archive tables of the same columns, so the tables above stay sized to open work.
+
+class ArchivedTask(Base):
+    __tablename__ = "tasks_archive"
+    id = Column(Integer, primary_key=True)
+    creator_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    assigner_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    subject = Column(String)
+    criticality = Column(String)
+    status = Column(String)
+    thread_id = Column(String, index=True)
+    html_file = Column(Text)
+    created_time = Column(DateTime)
+    last_reminder_sent_time = Column(DateTime)
+    next_reminder_at = Column(DateTime)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    closed_time = Column(DateTime)
+    archived_time = Column(DateTime, server_default=func.now())
+
+class ArchivedTaskProp(Base):
+    __tablename__ = "taskprops_archive"
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey('tasks_archive.id'), nullable=False)
+    attrname = Column(String, nullable=False)
+    attrval = Column(String, nullable=False)
+    modified_time = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_taskprops_archive_task_id_attrname", "task_id", "attrname"),
+        Index("ix_taskprops_archive_attrname_attrval", "attrname", "attrval", "task_id"),
+    )
+
+class ArchivedTaskReminderHistory(Base):
+    __tablename__ = "TaskReminderHistory_archive"
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey('tasks_archive.id'), nullable=False)
+    reminder_sent_time = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_TaskReminderHistory_archive_task_id_time", "task_id", "reminder_sent_time"),
+    )
+
+class ArchivedTaskReminderDailyCount(Base):
+    __tablename__ = "task_reminder_daily_counts_archive"
+    task_id = Column(Integer, ForeignKey('tasks_archive.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+# The archive table of every table holding rows of a task, parents first
+ARCHIVE_TABLES = {
+    Task: ArchivedTask,
+    TaskProp: ArchivedTaskProp,
+    TaskReminderHistory: ArchivedTaskReminderHistory,
+    TaskReminderDailyCount: ArchivedTaskReminderDailyCount,
+}
+
 Task.reminderhistory = relationship("TaskReminderHistory", order_by=TaskReminderHistory.id, back_populates="task")
 Task.props = relationship("TaskProp", order_by=TaskProp.id, back_populates="task")
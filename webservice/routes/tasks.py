@@ -1,18 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from utils import auth, crud, dependencies
+from utils import auth, crud, dependencies, etags, metrics, task_events, task_filters, tracing
 import schemas
 import os
 import logging
-import requests
+import asyncio
+from datetime import datetime
 
 logger = logging.getLogger('app')
 router = APIRouter()
 
-from dotenv import load_dotenv
-load_dotenv()
+# The environment is loaded by main
 FTP_SERVER = os.getenv('FTP_SERVER')
-print(f"FTP_SERVER: {FTP_SERVER}")
 
 if not FTP_SERVER:
     raise ValueError('FTP_SERVER environment variable is not set.')
@@ -20,35 +20,156 @@ if not FTP_SERVER:
 FTP_UPLOAD_URL = f"{FTP_SERVER}/upload/"
 logger.info(f"FTP_UPLOAD_URL set to => {FTP_UPLOAD_URL}")
 
+def task_list_response(tasks: list[schemas.Task], headers: dict = None, include_props: bool = False, partial: bool = False) -> Response:
+    """Serialize tasks validated by crud straight to JSON, instead of FastAPI validating them again against the response model."""
+    if partial:
+        adapter = schemas.TaskFieldsList
+    else:
+        adapter = schemas.TaskWithPropsList if include_props else schemas.TaskList
+    return Response(content=adapter.dump_json(tasks), media_type="application/json", headers=headers)
+
+# Query parameters filtering tasks by a prop, e.g. ?prop.customer=ACME
+PROP_FILTER_PREFIX = "prop."
+
+def task_list_filters(
+    request: Request,
+    creator_name: list[str] = Query(None),
+    assigner_name: list[str] = Query(None),
+    subject_contains: str = None,
+    criticality: list[str] = Query(None),
+    status: list[str] = Query(None),
+    thread_id: list[str] = Query(None),
+    created_after: datetime = None,
+    created_before: datetime = None,
+    reminded_after: datetime = None,
+    reminded_before: datetime = None,
+) -> dict:
+    """
+    The task filters of the query, compiled by `task_filters`. Repeated parameters match any of their values,
+    ranges include their `after` bound and exclude their `before` bound, `prop.<name>=<value>` filters by a prop.
+    """
+    def given(values: list) -> list:
+        # The UI sends `status=` and the like for "All", an empty value does not filter
+        return [value for value in values or [] if value]
+
+    filters = {key: value for key, value in {
+        "creator_name__in": given(creator_name),
+        "assigner_name__in": given(assigner_name),
+        "subject__contains": subject_contains,
+        "criticality__in": given(criticality),
+        "status__in": given(status),
+        "thread_id__in": given(thread_id),
+        "created_time__gte": created_after,
+        "created_time__lt": created_before,
+        "last_reminder_sent_time__gte": reminded_after,
+        "last_reminder_sent_time__lt": reminded_before,
+    }.items() if value}
+    props = {
+        key[len(PROP_FILTER_PREFIX):]: value
+        for key, value in request.query_params.items() if key.startswith(PROP_FILTER_PREFIX)
+    }
+    if props:
+        filters["props"] = props
+    return filters
+
 @router.get("/tasks/", dependencies=[Depends(auth.get_current_active_user)], response_model=list[schemas.Task])
 def read_tasks(
     skip: int = 0,
     limit: int = 100,
-    creator_name: str = None,
-    assigner_name: str = None,
-    subject_contains: str = None,
-    criticality: str = None,
-    status: str = None,
-    thread_id: str = None,
-    db: Session = Depends(dependencies.get_db)
+    filters: dict = Depends(task_list_filters),
+    sort: str = None,
+    fields: str = None,
+    include_props: bool = False,
+    include_archived: bool = False,
+    if_none_match: str = Header(None),
+    db: Session = Depends(dependencies.get_read_db)
 ):
-    """Retrieve tasks with optional filtering."""
-    filters = {}
-    if creator_name:
-        filters["creator_id"] = crud.get_user_by_username(db, creator_name).id
-    if assigner_name:
-        filters["assigner_id"] = crud.get_user_by_username(db, assigner_name).id
-    if subject_contains:
-        filters["subject__contains"] = subject_contains  # Adjust filter key
-    if criticality:
-        filters["criticality"] = criticality
-    if status:
-        filters["status"] = status
-    if thread_id:
-        filters["thread_id"] = thread_id
-
-    tasks = crud.get_tasks(db, skip=skip, limit=limit, filters=filters)
-    return tasks
+    """
+    Retrieve tasks with optional filtering, see `task_list_filters`.
+    `sort` lists the fields to sort by, like `-created_time,subject`. `fields` lists the fields to return,
+    the ID and version are always returned. Archived tasks are only included with `include_archived`.
+    Answers 304 if the tasks still match the ETag of the client.
+    """
+    order = task_filters.parse_sort(sort)
+    selected = task_filters.parse_fields(fields)
+
+    if if_none_match:
+        # Unchanged tasks are confirmed from their versions alone, without joining the users
+        etag = etags.task_list_etag(crud.get_task_versions(
+            db, skip=skip, limit=limit, filters=filters, sort=order, include_archived=include_archived
+        ))
+        if etags.matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    tasks = crud.get_tasks(
+        db, skip=skip, limit=limit, filters=filters, sort=order, fields=selected,
+        include_props=include_props, include_archived=include_archived
+    )
+    if selected is not None:
+        etag = etags.task_list_etag((task["id"], task["version"]) for task in tasks)
+    else:
+        etag = etags.task_list_etag((task.id, task.version) for task in tasks)
+    return task_list_response(tasks, headers={"ETag": etag}, include_props=include_props, partial=selected is not None)
+
+# A comment line is sent when no event was for this long, so proxies keep the stream open
+STREAM_KEEPALIVE_SECONDS = 15
+
+@router.get("/tasks/stream", dependencies=[Depends(auth.get_current_active_user)])
+async def stream_tasks(
+    filters: dict = Depends(task_list_filters),
+    last_event_id: str = Header(None),
+    db: Session = Depends(dependencies.get_read_db)
+):
+    """
+    Stream the created, updated, deleted and reminded tasks as Server-Sent Events, with the filters of `read_tasks`.
+    A client reconnecting with Last-Event-ID gets the events it missed, or a `reset` event if they are no longer
+    buffered, after which it should reload its tasks.
+    """
+    # The stream outlives the request, don't hold the connection the authentication used
+    db.close()
+    if "props" in filters:
+        # Events carry the tasks without their props
+        raise HTTPException(status_code=400, detail="The task stream cannot filter by props")
+    try:
+        resume_from = int(last_event_id) if last_event_id else None
+    except ValueError:
+        resume_from = -1  # unknown ID, reset the client
+
+    subscription, missed = task_events.hub.subscribe(resume_from)
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            if missed is None:
+                yield "event: reset\ndata: {}\n\n"
+            for event in missed or []:
+                if task_events.matches(event, filters):
+                    yield task_events.format_event(event)
+            # Starlette cancels the stream once the client disconnects
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    yield "event: reset\ndata: {}\n\n"  # the client fell behind, it reconnects and reloads
+                    return
+                if task_events.matches(event, filters):
+                    yield task_events.format_event(event)
+        finally:
+            task_events.hub.unsubscribe(subscription)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/tasks/stats", dependencies=[Depends(auth.get_current_active_user)], response_model=schemas.TaskStats, response_model_exclude_none=True)
+def read_task_stats(by_assignee: bool = False, db: Session = Depends(dependencies.get_read_db)):
+    """Count the tasks by status and criticality, and per assignee if `by_assignee` is set. Served from precomputed counts."""
+    return crud.get_task_stats(db, by_assignee=by_assignee)
+
+@router.get("/tasks/due-reminders", dependencies=[Depends(auth.get_current_active_user)], response_model=list[schemas.Task])
+def read_due_reminders(now: datetime = None, db: Session = Depends(dependencies.get_read_db)):
+    """Retrieve the open tasks whose next reminder is due at `now` (defaults to the current time)."""
+    return task_list_response(crud.get_due_reminder_tasks(db, now or datetime.now()))
 
 @router.post("/tasks/", dependencies=[Depends(auth.get_current_active_user)], response_model=schemas.Task)
 async def create_task(
@@ -65,15 +186,7 @@ async def create_task(
 
     logger.info(f"Creating task with creator_name={creator_name}, assigner_name={assigner_name}, subject={subject}, criticality={criticality}, status={status}, thread_id={thread_id}, html_file={html_file.filename}")
     # Store the uploaded html file in FTP server
-    file_location = html_file.filename
-    with open(file_location, "wb+") as file_object:
-        file_object.write(html_file.file.read())
-        
-    with open(file_location, "rb") as file:
-        response = requests.post(FTP_UPLOAD_URL, files={"file": file})
-        uploaded_path = response.json()['file_url']
-        
-    os.remove(file_location) # Remove the temp file from local storage
+    uploaded_path = upload_to_ftp(html_file)
 
     # Validate the submitted data by mapping it to the schema
     task_data = schemas.TaskCreate(
@@ -101,16 +214,51 @@ async def create_task(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+def upload_to_ftp(html_file: UploadFile) -> str:
+    """Forward an uploaded file to the FTP server and return its path there."""
+    import requests  # imported on the first upload, it takes a noticeable part of the startup otherwise
+    # The spooled upload is passed through as is, no copy is written to the local disk
+    with tracing.start_span("ftp upload", file=html_file.filename):
+        response = requests.post(FTP_UPLOAD_URL, files={"file": (html_file.filename, html_file.file)}, headers=tracing.inject())
+    metrics.ftp_upload_bytes.inc(html_file.size or 0)
+    return response.json()['file_url']
+
 def create_dummy_user(db: Session, username: str):
     user = schemas.UserCreate(username=username, password="dummy")
     crud.create_user(db=db, user=user)
 
+@router.post("/tasks/lookup", dependencies=[Depends(auth.get_current_active_user)], response_model=dict[str, int])
+def lookup_tasks(lookup: schemas.TaskLookup, db: Session = Depends(dependencies.get_db)):
+    """Map thread IDs to task IDs. Thread IDs without a task are left out of the result."""
+    return crud.get_task_ids_by_thread_ids(db, lookup.thread_ids)
+
+@router.put("/tasks/props", dependencies=[Depends(auth.get_current_active_user)], response_model=dict[int, dict[str, str]])
+def update_props_of_tasks(update: schemas.TasksPropsUpdate, db: Session = Depends(dependencies.get_db)):
+    """Set props of many tasks at once, a null value deletes the prop. Returns all props of the tasks."""
+    return crud.set_task_props(db, update.tasks)
+
+@router.get("/tasks/{task_id}/props", dependencies=[Depends(auth.get_current_active_user)], response_model=dict[str, str])
+def read_task_props(task_id: int, db: Session = Depends(dependencies.get_read_db)):
+    """Retrieve the props of a task."""
+    return crud.get_task_props(db, task_id)
+
+@router.put("/tasks/{task_id}/props", dependencies=[Depends(auth.get_current_active_user)], response_model=dict[str, str])
+def update_task_props(task_id: int, update: schemas.TaskPropsUpdate, db: Session = Depends(dependencies.get_db)):
+    """Set props of a task, a null value deletes the prop. Returns all props of the task."""
+    return crud.set_task_props(db, {task_id: update.props})[task_id]
+
 @router.get("/tasks/{task_id}", dependencies=[Depends(auth.get_current_active_user)], response_model=schemas.Task)
-def read_task(task_id: int, db: Session = Depends(dependencies.get_db)):
-    """Retrieve a single task."""
+def read_task(task_id: int, response: Response, if_none_match: str = Header(None), db: Session = Depends(dependencies.get_read_db)):
+    """Retrieve a single task. Answers 304 if the task still matches the ETag of the client."""
+    if if_none_match:
+        version = crud.get_task_version(db, task_id)
+        if version is not None and etags.matches(if_none_match, etags.task_etag(task_id, version)):
+            return Response(status_code=304, headers={"ETag": etags.task_etag(task_id, version)})
+
     task = crud.get_task(db=db, task_id=task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
+    response.headers["ETag"] = etags.task_etag(task.id, task.version)
     return task
 
 @router.put("/tasks/{task_id}", dependencies=[Depends(auth.get_current_active_user)], response_model=schemas.Task)
@@ -126,17 +274,9 @@ async def update_task(
     db: Session = Depends(dependencies.get_db)
 ):
     """Update a task."""
-    # Save the uploaded file to the desired location
+    # Store the uploaded html file in FTP server
     if html_file:
-        temp_file = html_file.filename
-        with open(temp_file, "wb+") as file_object:
-            file_object.write(html_file.file.read())
-            
-        with open(temp_file, "rb") as file:
-            response = requests.post(FTP_UPLOAD_URL, files={"file": file})
-            uploaded_path = response.json()['file_url']
-            
-        os.remove(temp_file) # Remove the temp file from local storage
+        uploaded_path = upload_to_ftp(html_file)
 
     if creator_name and not crud.check_user_exists(db, creator_name):
         create_dummy_user(db, creator_name)
@@ -182,6 +322,11 @@ def delete_task(task_id: int, db: Session = Depends(dependencies.get_db)):
 #     file_name = os.path.basename(task.html_file)
 #     return FileResponse(task.html_file, media_type='application/octet-stream', filename=file_name)
 
+@router.get("/tasks/{task_id}/reminders", dependencies=[Depends(auth.get_current_active_user)], response_model=schemas.ReminderHistory)
+def read_reminder_history(task_id: int, db: Session = Depends(dependencies.get_read_db)):
+    """Retrieve the reminders sent for a task. Reminders older than the retention are counted per day."""
+    return crud.get_reminder_history(db, task_id)
+
 # set last reminder sent time for a task
 @router.post("/tasks/{task_id}/remindersent", dependencies=[Depends(auth.get_current_active_user)], response_model=schemas.Task)
 def remind_task(task_id: int, db: Session = Depends(dependencies.get_db)):
@@ -190,3 +335,8 @@ def remind_task(task_id: int, db: Session = Depends(dependencies.get_db)):
     if not result:
         raise HTTPException(status_code=404, detail="Task not found")
     return crud.get_task(db=db, task_id=task_id)
+
+@router.post("/tasks/remindersent", dependencies=[Depends(auth.get_current_active_user)], response_model=list[schemas.Task])
+def remind_tasks(reminded: schemas.TaskIds, db: Session = Depends(dependencies.get_db)):
+    """Set the last reminder sent time for many tasks at once. Unknown task IDs are ignored."""
+    return task_list_response(crud.set_last_reminder_sent_times(db=db, task_ids=reminded.task_ids))
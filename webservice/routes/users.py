@@ -19,12 +19,12 @@ async def read_users_me(current_user: schemas.User = Depends(auth.get_current_ac
     return current_user
 
 @router.get('/', response_model=list[schemas.User], dependencies=[Depends(auth.get_current_active_user)])
-def get_users(skip: int = 0, limit: int = 100, db: Session = Depends(dependencies.get_db)) -> list[schemas.User]:
+def get_users(skip: int = 0, limit: int = 100, db: Session = Depends(dependencies.get_read_db)) -> list[schemas.User]:
     """Get a list of users from the database."""
     return crud.get_users(db, skip=skip, limit=limit)
 
 @router.get('/{user_id}', response_model=schemas.User, dependencies=[Depends(auth.get_current_active_user)])
-def get_user(user_id: int, db: Session = Depends(dependencies.get_db)) -> schemas.User:
+def get_user(user_id: int, db: Session = Depends(dependencies.get_read_db)) -> schemas.User:
     """Get a user by their ID."""
     db_user = crud.get_user(db, user_id)
     if db_user is None:
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from utils import auth, crud, dependencies
+from datetime import datetime, timedelta
+import schemas
+
+router = APIRouter()
+
+@router.post("/leases", dependencies=[Depends(auth.get_current_active_user)], response_model=schemas.LeaseGrant)
+def acquire_leases(lease: schemas.LeaseRequest, db: Session = Depends(dependencies.get_db)):
+    """
+    Renew the shard leases of an emailservice worker, and claim its share of the free shards.
+    Workers must call this again before the leases expire, the shards of a worker that stops calling are reassigned.
+    """
+    shards = crud.acquire_leases(db, worker_id=lease.worker_id, ttl_seconds=lease.ttl_seconds)
+    return schemas.LeaseGrant(
+        worker_id=lease.worker_id,
+        shard_count=crud.WORKER_SHARDS,
+        shards=shards,
+        expires_at=datetime.now() + timedelta(seconds=lease.ttl_seconds),
+    )
+
+@router.delete("/{worker_id}/leases", dependencies=[Depends(auth.get_current_active_user)])
+def release_leases(worker_id: str, db: Session = Depends(dependencies.get_db)):
+    """Release all the shards of a worker."""
+    released = crud.release_leases(db, worker_id=worker_id)
+    return {"detail": f"Released {released} shards"}
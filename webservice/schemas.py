@@ -1,7 +1,7 @@
 from enum import Enum
-from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, TypeAdapter
+from datetime import date, datetime
+from typing import Any, Optional, List, Dict
 
 class UserCreate(BaseModel):
     username: str
@@ -66,6 +66,61 @@ class Task(TaskCreate):
     id: int
     created_time: datetime
     last_reminder_sent_time: datetime | None
+    next_reminder_at: datetime | None = None
+    version: int = 1
+    closed_time: datetime | None = None
+    archived: bool = False
 
     class Config:
         orm_mode = True
+
+class TaskWithProps(Task):
+    props: Dict[str, str] = {}
+
+# Validate task rows in one pass, and serialize the tasks straight to JSON bytes
+TaskList = TypeAdapter(List[Task])
+TaskWithPropsList = TypeAdapter(List[TaskWithProps])
+# Tasks of only some fields, as selected
+TaskFieldsList = TypeAdapter(List[Dict[str, Any]])
+
+class AssigneeTaskStats(BaseModel):
+    assigner_name: str
+    total: int
+    by_status: Dict[str, int]
+    by_criticality: Dict[str, int]
+
+class TaskStats(BaseModel):
+    total: int
+    by_status: Dict[str, int]
+    by_criticality: Dict[str, int]
+    by_assignee: Optional[List[AssigneeTaskStats]] = None
+
+class ReminderDayCount(BaseModel):
+    day: date
+    count: int
+
+class ReminderHistory(BaseModel):
+    sent_times: List[datetime]
+    daily_counts: List[ReminderDayCount]
+
+class TaskLookup(BaseModel):
+    thread_ids: List[str]
+
+class TaskPropsUpdate(BaseModel):
+    props: Dict[str, Optional[str]]
+
+class TasksPropsUpdate(BaseModel):
+    tasks: Dict[int, Dict[str, Optional[str]]]
+
+class TaskIds(BaseModel):
+    task_ids: List[int]
+
+class LeaseRequest(BaseModel):
+    worker_id: str
+    ttl_seconds: int = 600
+
+class LeaseGrant(BaseModel):
+    worker_id: str
+    shard_count: int
+    shards: List[int]
+    expires_at: datetime
@@ -0,0 +1,119 @@
+"""
+Serves the webservice with several worker processes. The app is imported, and the schema checked, once in this
+process before the workers are forked, so the workers answer at once and share the memory of the imported modules.
+
+Usage (from the webservice directory, with the environment of main.py):
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers N] [--max-crashes N]
+
+Each worker has its own database pools, metrics and task event hub. Clients of /api/tasks/stream only get the
+changes committed by the worker they are connected to, run a single worker if all clients need every change.
+"""
+import argparse
+import collections
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(base_dir)
+
+logger = logging.getLogger('app')
+
+# A crashed worker is started again after a delay that doubles with every crash in the last CRASH_WINDOW seconds
+RESPAWN_DELAY = 0.5
+MAX_RESPAWN_DELAY = 10
+CRASH_WINDOW = 60
+
+def run_worker(config, sock: socket.socket) -> None:
+    """Serve the preloaded app on the shared socket, until the worker is told to stop."""
+    import uvicorn
+    uvicorn.Server(config).run(sockets=[sock])
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        help="Worker processes. (Default: WEB_CONCURRENCY or the number of CPUs)",
+    )
+    parser.add_argument(
+        "--max-crashes", type=int, default=5,
+        help=f"Worker crashes within {CRASH_WINDOW} seconds after which the server stops with exit status 1. (Default: 5)",
+    )
+    args = parser.parse_args()
+
+    import uvicorn
+    from main import app
+    from utils import dependencies
+    # Loading the config imports the HTTP protocol and event loop modules uvicorn picked, before the fork too.
+    # log_config=None keeps the logging configured by main, uvicorn would replace it otherwise
+    config = uvicorn.Config(app, log_config=None)
+    config.load()
+    # The workers open their own connections, a connection must never be used by two processes
+    for engine in (dependencies.engine, dependencies.read_engine):
+        engine.dispose()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    workers = set()
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            run_worker(config, sock)
+            sys.exit(0)
+        workers.add(pid)
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    for _ in range(args.workers):
+        spawn()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info(f"Serving on {args.host}:{args.port} with {args.workers} workers: {sorted(workers)}")
+
+    crashes = collections.deque()
+    exit_code = 0
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if stopping:
+            continue
+
+        now = time.monotonic()
+        crashes.append(now)
+        while crashes[0] < now - CRASH_WINDOW:
+            crashes.popleft()
+        if len(crashes) > args.max_crashes:
+            # Workers that crash again at once, e.g. on a broken database, are not forked forever
+            logger.error(f"Worker {pid} exited with status {status}, {len(crashes)} crashes in {CRASH_WINDOW}s, stopping")
+            exit_code = 1
+            stop(signal.SIGTERM, None)
+            continue
+        delay = min(RESPAWN_DELAY * 2 ** (len(crashes) - 1), MAX_RESPAWN_DELAY)
+        logger.warning(f"Worker {pid} exited with status {status}, starting a new one in {delay:g}s")
+        time.sleep(delay)
+        if not stopping:
+            spawn()
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main reads its environment and configures its log files on import, so both point to a scratch directory
+_scratch_dir = tempfile.mkdtemp(prefix="webservice-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_scratch_dir}/test.db"
+os.environ.setdefault("FTP_SERVER", "http://ftp.invalid")
+os.environ.setdefault("ALLOW_ORIGIN", "http://localhost")
+os.chdir(_scratch_dir)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+import main
+import models
+import schemas
+from utils import crud, dependencies
+
+@pytest.fixture(autouse=True)
+def clean_database():
+    """Every test starts with no tasks and no users."""
+    yield
+    with dependencies.SessionLocal() as db:
+        for model in [*models.ARCHIVE_TABLES.values(), *reversed(list(models.ARCHIVE_TABLES)), models.TaskStat, models.User]:
+            db.query(model).delete()
+        db.commit()
+
+@pytest.fixture
+def db():
+    with dependencies.SessionLocal() as session:
+        yield session
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+@pytest.fixture
+def auth_headers(client):
+    client.post("/api/users/signup", json={"username": "tester", "password": "secret"})
+    token = client.post("/token", data={"username": "tester", "password": "secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def make_task(db):
+    """Create a task without uploading its html file, the users are created as needed."""
+    def make(thread_id: str, creator: str = "creator@example.com", assigner: str = "assigner@example.com", **fields):
+        for username in (creator, assigner):
+            if crud.get_user_by_username(db, username) is None:
+                crud.create_user(db, schemas.UserCreate(username=username, password="dummy"))
+        task = schemas.TaskCreate(**{
+            "creator_name": creator, "assigner_name": assigner, "subject": f"Subject of {thread_id}",
+            "criticality": "MEDIUM", "status": "OPEN", "html_file": f"/files/{thread_id}.html", "thread_id": thread_id,
+            **fields,
+        })
+        return crud.create_task(db, task)
+    return make
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, inspect, text
+
+import models
+from utils import crud, schema
+
+def test_ids_of_archived_tasks_are_not_given_out_again(db, make_task):
+    make_task("thread-1")
+    closed_id = make_task("thread-2", status="CLOSED").id
+    db.query(models.Task).filter(models.Task.id == closed_id).update({"closed_time": datetime.now() - timedelta(days=100)})
+    db.commit()
+    assert crud.archive_closed_tasks(db, closed_days=90) == 1
+
+    new_id = make_task("thread-3", status="CLOSED").id
+    db.query(models.Task).filter(models.Task.id == new_id).update({"closed_time": datetime.now() - timedelta(days=100)})
+    db.commit()
+
+    assert new_id > closed_id
+    assert crud.archive_closed_tasks(db, closed_days=90) == 1
+    assert crud.get_task(db, closed_id).thread_id == "thread-2"
+
+def test_upgrade_rebuilds_tables_without_autoincrement(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with engine.begin() as conn:
+        # The tasks table as created before its IDs were AUTOINCREMENT, with a task archived already
+        conn.execute(text("CREATE TABLE tasks (id INTEGER NOT NULL PRIMARY KEY, subject VARCHAR, creator_id INTEGER NOT NULL, assigner_id INTEGER NOT NULL)"))
+        conn.execute(text("INSERT INTO tasks (id, subject, creator_id, assigner_id) VALUES (1, 'open', 1, 1)"))
+    models.ArchivedTask.__table__.create(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO tasks_archive (id, subject, creator_id, assigner_id) VALUES (7, 'archived', 1, 1)"))
+
+    assert schema.upgrade_schema(engine)
+
+    with engine.begin() as conn:
+        assert "AUTOINCREMENT" in conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'tasks'")).scalar()
+        assert conn.execute(text("SELECT subject FROM tasks WHERE id = 1")).scalar() == "open"
+        conn.execute(text("INSERT INTO tasks (subject, creator_id, assigner_id, version) VALUES ('new', 1, 1, 1)"))
+        assert conn.execute(text("SELECT id FROM tasks WHERE subject = 'new'")).scalar() == 8
+    assert "ix_tasks_status_next_reminder_at" in {index["name"] for index in inspect(engine).get_indexes("tasks")}
+    assert not schema.upgrade_schema(engine)
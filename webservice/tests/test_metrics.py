@@ -0,0 +1,13 @@
+from sqlalchemy import create_engine, text
+
+from utils import metrics
+
+def test_checkout_wait_is_recorded_after_the_pool_is_disposed(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/metrics.db")
+    metrics.instrument_engine(engine, "disposed")
+    engine.dispose()
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    assert "db_pool_checkout_wait_seconds_count{pool=\"disposed\"} 1" in metrics.db_pool_checkout_wait.render()
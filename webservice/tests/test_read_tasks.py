@@ -0,0 +1,20 @@
+def test_empty_filters_of_the_ui_match_all_tasks(client, auth_headers, make_task):
+    make_task("thread-1")
+    make_task("thread-2", criticality="HIGH")
+
+    # The query string IssueList sends with every filter set to "All"
+    response = client.get(
+        "/api/tasks/?creator_name=&assigner_name=&criticality=&status=&thread_id=", headers=auth_headers
+    )
+
+    assert response.status_code == 200
+    assert [task["thread_id"] for task in response.json()] == ["thread-1", "thread-2"]
+
+def test_repeated_filters_match_any_value(client, auth_headers, make_task):
+    make_task("thread-1", criticality="LOW")
+    make_task("thread-2", criticality="HIGH")
+    make_task("thread-3", criticality="CRITICAL")
+
+    response = client.get("/api/tasks/?criticality=LOW&criticality=CRITICAL&criticality=", headers=auth_headers)
+
+    assert [task["thread_id"] for task in response.json()] == ["thread-1", "thread-3"]
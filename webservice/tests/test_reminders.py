@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+import models
+import schemas
+from utils import crud, reminders
+
+def test_backfill_uses_the_default_interval_without_a_criticality(db, make_task):
+    task_id = make_task("thread-1").id
+    db.query(models.Task).filter(models.Task.id == task_id).update({"criticality": None, "next_reminder_at": None})
+    db.commit()
+
+    assert crud.backfill_next_reminder_at(db) == 1
+
+    db_task = db.get(models.Task, task_id)
+    assert db_task.next_reminder_at == db_task.created_time + timedelta(hours=reminders.DEFAULT_REMINDER_INTERVAL)
+
+def test_reminder_sent_without_a_criticality(db, make_task):
+    task_id = make_task("thread-1").id
+    db.query(models.Task).filter(models.Task.id == task_id).update({"criticality": "UNKNOWN"})
+    db.commit()
+
+    # Recorded the way the reminder routes record them, without the tasks being read back
+    crud._record_reminders(db, [task_id], datetime.now())
+    db.commit()
+
+    db_task = db.get(models.Task, task_id)
+    db.refresh(db_task)
+    assert db_task.next_reminder_at == db_task.last_reminder_sent_time + timedelta(hours=reminders.DEFAULT_REMINDER_INTERVAL)
+
+def test_reopened_task_is_not_reminded_at_once(db, make_task):
+    task_id = make_task("thread-1").id
+    db.query(models.Task).filter(models.Task.id == task_id).update({"next_reminder_at": datetime.now() - timedelta(days=30)})
+    db.commit()
+
+    def set_status(status):
+        fields = {name: None for name in schemas.TaskUpdate.model_fields}
+        crud.update_task(db, task_id, schemas.TaskUpdate(**{**fields, "status": status}))
+
+    set_status(schemas.TaskStatus.CLOSED)
+    set_status(schemas.TaskStatus.OPEN)
+
+    db_task = db.get(models.Task, task_id)
+    assert db_task.next_reminder_at > datetime.now()
@@ -0,0 +1,20 @@
+import pytest
+from sqlalchemy import create_engine
+
+from utils import schema
+
+def test_version_is_recorded_only_after_the_backfill(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/upgrade.db")
+
+    def failing_backfill(db):
+        raise RuntimeError("killed during the backfill")
+
+    with pytest.raises(RuntimeError):
+        schema.upgrade_schema(engine, backfill=failing_backfill)
+    assert schema._stored_schema_version(engine) is None
+
+    backfilled = []
+    assert schema.upgrade_schema(engine, backfill=backfilled.append)
+    assert len(backfilled) == 1
+    assert not schema.upgrade_schema(engine, backfill=backfilled.append)
+    assert len(backfilled) == 1
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime
+
+from utils import task_events
+
+def event(task: dict, previous: dict = None) -> dict:
+    return {"id": 1, "type": "updated", "task": task, "previous": previous}
+
+TASK = {"id": 1, "subject": "Build failing", "status": "OPEN", "criticality": "HIGH",
+        "created_time": "2024-07-01T10:00:00", "last_reminder_sent_time": None}
+
+def test_repeated_values_match_any_of_them():
+    assert task_events.matches(event(TASK), {"status__in": ["CLOSED", "OPEN"]})
+    assert not task_events.matches(event(TASK), {"status__in": ["CLOSED", "FIXED"]})
+
+def test_previous_task_matches_when_it_left_the_filter():
+    closed = {**TASK, "status": "CLOSED"}
+    assert task_events.matches(event(closed, previous=TASK), {"status__in": ["OPEN"]})
+
+def test_ranges_and_contains():
+    assert task_events.matches(event(TASK), {
+        "created_time__gte": datetime(2024, 7, 1), "created_time__lt": datetime(2024, 7, 2), "subject__contains": "FAIL",
+    })
+    assert not task_events.matches(event(TASK), {"created_time__lt": datetime(2024, 7, 1, 10)})
+    assert not task_events.matches(event(TASK), {"last_reminder_sent_time__gte": datetime(2024, 1, 1)})
+
+def test_stream_rejects_props_filters(client, auth_headers):
+    response = client.get("/api/tasks/stream?prop.customer=ACME", headers=auth_headers)
+
+    assert response.status_code == 400
+
+def publish(hub, count: int) -> list:
+    for number in range(count):
+        hub.publish(task_events.TaskEventType.UPDATED, {"id": number})
+    return [event["id"] for event in hub.buffer]
+
+def test_resume_inside_the_buffer_gets_the_missed_events():
+    hub = task_events.TaskEventHub(buffer_size=5)
+    ids = publish(hub, 4)
+
+    async def resume():
+        subscription, missed = hub.subscribe(last_event_id=ids[1])
+        hub.unsubscribe(subscription)
+        return missed
+
+    assert [event["id"] for event in asyncio.run(resume())] == ids[2:]
+
+def test_resume_at_the_last_event_gets_nothing():
+    hub = task_events.TaskEventHub(buffer_size=5)
+    ids = publish(hub, 2)
+
+    async def resume():
+        return hub.subscribe(last_event_id=ids[-1])[1]
+
+    assert asyncio.run(resume()) == []
+
+def test_resume_before_the_buffer_resets_the_client():
+    hub = task_events.TaskEventHub(buffer_size=2)
+    first_id = hub.next_id
+    publish(hub, 5)
+
+    async def resume(last_event_id):
+        return hub.subscribe(last_event_id=last_event_id)[1]
+
+    assert asyncio.run(resume(first_id)) is None
+
+def test_resume_with_an_empty_buffer_resets_the_client():
+    hub = task_events.TaskEventHub()
+
+    async def resume():
+        return hub.subscribe(last_event_id=hub.next_id - 100)[1]
+
+    assert asyncio.run(resume()) is None
+
+def test_stuck_client_is_told_to_reset_once_its_queue_overflows(monkeypatch):
+    monkeypatch.setattr(task_events, "SUBSCRIBER_QUEUE_SIZE", 2)
+    hub = task_events.TaskEventHub()
+
+    async def overflow():
+        subscription, _ = hub.subscribe()
+        publish(hub, 4)
+        await asyncio.sleep(0)  # the events are delivered on the loop
+        queued = []
+        while not subscription.queue.empty():
+            queued.append(subscription.queue.get_nowait())
+        return subscription, queued
+
+    subscription, queued = asyncio.run(overflow())
+
+    assert subscription.overflowed
+    # The newest event that fitted, then the reset marker, later events are dropped
+    assert [event and event["task"]["id"] for event in queued] == [1, None]
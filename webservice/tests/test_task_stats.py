@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+import models
+import schemas
+from utils import crud
+
+def task_update(**fields) -> schemas.TaskUpdate:
+    return schemas.TaskUpdate(**{name: fields.get(name) for name in schemas.TaskUpdate.model_fields})
+
+def assert_no_drift(db):
+    assert crud.rebuild_task_stats(db, repair=False) == []
+
+def test_create_keeps_the_stats(db, make_task):
+    make_task("thread-1")
+    make_task("thread-2", criticality="HIGH", status="CLOSED")
+
+    assert_no_drift(db)
+    assert crud.get_task_stats(db).total == 2
+
+def test_update_of_status_criticality_and_assignee_keeps_the_stats(db, make_task):
+    task_id = make_task("thread-1").id
+    make_task("thread-2", assigner="other@example.com")
+    other_id = crud.get_user_by_username(db, "other@example.com").id
+
+    crud.update_task(db, task_id, task_update(status="FIXED"))
+    assert_no_drift(db)
+    crud.update_task(db, task_id, task_update(criticality="CRITICAL"))
+    assert_no_drift(db)
+    crud.update_task(db, task_id, task_update(assigner_id=other_id))
+    assert_no_drift(db)
+    crud.update_task(db, task_id, task_update(status="CLOSED", criticality="LOW"))
+    assert_no_drift(db)
+    crud.update_task(db, task_id, task_update(subject="Renamed"))
+    assert_no_drift(db)
+
+def test_delete_keeps_the_stats(db, make_task):
+    task_id = make_task("thread-1").id
+    make_task("thread-2")
+
+    assert crud.delete_task(db, task_id)
+
+    assert_no_drift(db)
+    assert crud.get_task_stats(db).total == 1
+
+def test_archive_keeps_the_stats(db, make_task):
+    make_task("thread-1")
+    closed_id = make_task("thread-2", status="CLOSED").id
+    db.query(models.Task).filter(models.Task.id == closed_id).update({"closed_time": datetime.now() - timedelta(days=100)})
+    db.commit()
+
+    assert crud.archive_closed_tasks(db, closed_days=90) == 1
+
+    assert_no_drift(db)
+    assert crud.get_task_stats(db).total == 1
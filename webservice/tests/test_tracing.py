@@ -0,0 +1,21 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from utils import tracing
+
+def test_failed_statement_ends_its_span_with_the_error(tmp_path, monkeypatch):
+    exported = []
+    monkeypatch.setattr(tracing, "TRACE_DIR", str(tmp_path))
+    monkeypatch.setattr(tracing, "_export", exported.append)
+    engine = create_engine(f"sqlite:///{tmp_path}/tracing.db")
+    tracing.instrument_engine(engine)
+
+    with pytest.raises(OperationalError), tracing.start_span("GET /api/tasks/"):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT * FROM missing_table"))
+
+    statement_span, request_span = exported
+    assert statement_span["name"] == "sqlite SELECT"
+    assert "missing_table" in statement_span["error"]
+    assert statement_span["parent_id"] == request_span["span_id"]
@@ -0,0 +1,8 @@
+def test_thread_id_of_another_task_is_a_conflict(client, auth_headers, make_task):
+    make_task("thread-1")
+    task_id = make_task("thread-2").id
+
+    response = client.put(f"/api/tasks/{task_id}", data={"thread_id": "thread-1"}, headers=auth_headers)
+
+    assert response.status_code == 409
+    assert client.get(f"/api/tasks/{task_id}", headers=auth_headers).json()["thread_id"] == "thread-2"
@@ -42,7 +42,7 @@ def authenticate_user(db: Session, username: str, password: str) -> models.User:
         return False
     return user
 
-def get_current_user(db: Session = Depends(dependencies.get_db), token: str = Depends(oauth2_scheme)) -> models.User:
+def get_current_user(db: Session = Depends(dependencies.get_read_db), token: str = Depends(oauth2_scheme)) -> models.User:
     """Get the current user from the database using the token provided."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,66 +1,153 @@
-from sqlalchemy.orm import Session, aliased
-from utils import dependencies
+from sqlalchemy import Select, exists, func, literal, or_, select, tuple_, update
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from utils import dependencies, reminders, task_events, task_filters
 import models, schemas
 from fastapi import HTTPException
-from typing import List
-from datetime import datetime
+from typing import List, Dict, Optional
+from datetime import datetime, timedelta
+import logging
+import math
+import os
+
+logger = logging.getLogger('app')
+
+LOOKUP_CHUNK_SIZE = 500
+
+# Number of shards the email threads are split into, for leasing them to emailservice workers
+WORKER_SHARDS = int(os.getenv('WORKER_SHARDS', 16))
+
+# Days after which CLOSED tasks are moved to the archive tables
+ARCHIVE_CLOSED_AFTER_DAYS = int(os.getenv('ARCHIVE_CLOSED_AFTER_DAYS', 90))
+
+# Days the individual reminder sends are kept, older ones are only counted per task and day
+REMINDER_HISTORY_RETENTION_DAYS = int(os.getenv('REMINDER_HISTORY_RETENTION_DAYS', 30))
+
+def _task_query(db: Session, archived: bool = False):
+    """Build the query joining a task with its creator and assigner names, of the archive table if `archived` is set."""
+    task_model = models.ArchivedTask if archived else models.Task
+    return (
+        db.query(*(column.label(name) for name, column in task_filters.task_columns(archived).items()))
+        .select_from(task_model)
+        .join(task_filters.creator, task_model.creator_id == task_filters.creator.id)
+        .join(task_filters.assigner, task_model.assigner_id == task_filters.assigner.id)
+    )
+
+def _to_task_schema(task_data) -> schemas.Task:
+    """Map a row of `_task_query` to the task schema."""
+    return schemas.Task(
+        id=task_data.id,
+        creator_name=task_data.creator_name,
+        assigner_name=task_data.assigner_name,
+        subject=task_data.subject,
+        criticality=task_data.criticality,
+        status=task_data.status,
+        html_file=task_data.html_file,
+        thread_id=task_data.thread_id,
+        created_time=task_data.created_time,
+        last_reminder_sent_time=task_data.last_reminder_sent_time,
+        next_reminder_at=task_data.next_reminder_at,
+        version=task_data.version,
+        closed_time=task_data.closed_time,
+        archived=task_data.archived
+    )
+
+def _to_task_schemas(task_data_list, props: Dict[int, Dict[str, str]] = None) -> List[schemas.Task]:
+    """Map rows of `_task_query` to task schemas, validated in a single pass. Tasks with props if `props` is given."""
+    tasks = [task_data._asdict() for task_data in task_data_list]
+    if props is None:
+        return schemas.TaskList.validate_python(tasks)
+    for task in tasks:
+        task["props"] = props.get(task["id"], {})
+    return schemas.TaskWithPropsList.validate_python(tasks)
+
+def _publish_task_event(db: Session, event_type: task_events.TaskEventType, task_id: int, previous: dict = None) -> None:
+    """Broadcast a committed change of a task to the clients of the task stream."""
+    task_events.hub.publish(event_type, get_task(db, task_id).model_dump(mode="json"), previous)
+
+def _bump_version(db_task: models.Task) -> None:
+    """Mark a task as changed, so the ETags clients hold for it no longer match."""
+    db_task.version = models.Task.version + 1
 
 def get_tasks(
     db: Session,
     skip: int = 0,
     limit: int = 100,
-    filters: dict = None
-) -> List[models.Task]:
-    """Get a list of tasks from the database."""
-    creator_alias = aliased(models.User, name="creator")
-    assigner_alias = aliased(models.User, name="assigner")
-    
-    query = (
-        db.query(
-            models.Task.id,
-            models.Task.subject,
-            models.Task.criticality,
-            models.Task.status,
-            models.Task.html_file,
-            models.Task.thread_id,
-            models.Task.created_time,
-            models.Task.last_reminder_sent_time,
-            creator_alias.username.label("creator_name"),
-            assigner_alias.username.label("assigner_name")
-        )
-        .join(creator_alias, models.Task.creator_id == creator_alias.id)
-        .join(assigner_alias, models.Task.assigner_id == assigner_alias.id)
+    filters: dict = None,
+    sort: List[tuple] = None,
+    fields: List[str] = None,
+    include_props: bool = False,
+    include_archived: bool = False
+) -> list:
+    """
+    Get a page of tasks in one query, see `task_filters.compile_task_page` for the filters and the sort.
+    Tasks are dicts of the given `fields` if any, with their props if `include_props` is set.
+    """
+    task_data_list = db.execute(task_filters.compile_task_page(
+        filters, sort=sort, fields=fields, skip=skip, limit=limit, include_archived=include_archived
+    )).all()
+    props = None
+    if include_props:
+        props = get_props_of_tasks(db, [task_data.id for task_data in task_data_list], include_archived=include_archived)
+    if fields is None:
+        return _to_task_schemas(task_data_list, props)
+    tasks = [task_data._asdict() for task_data in task_data_list]
+    for task in tasks if props is not None else []:
+        task["props"] = props[task["id"]]
+    return tasks
+
+def get_task_versions(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    filters: dict = None,
+    sort: List[tuple] = None,
+    include_archived: bool = False
+) -> List[tuple]:
+    """Get the (id, version) of the tasks `get_tasks` would return, without joining the users the filters don't need."""
+    statement = task_filters.compile_task_page(
+        filters, sort=sort, fields=task_filters.REQUIRED_FIELDS, skip=skip, limit=limit, include_archived=include_archived
     )
-    
-    if filters:
-        for key, value in filters.items():
-            if "__contains" in key:
-                field_name = key.split("__")[0]
-                query = query.filter(getattr(models.Task, field_name).ilike(f"%{value}%"))
-            else:
-                query = query.filter(getattr(models.Task, key) == value)
-    
-    query = query.offset(skip).limit(limit)
-    task_data_list = query.all()
-
-    tasks = [
-        schemas.Task(
-            id=task_data.id,
-            creator_name=task_data.creator_name,
-            assigner_name=task_data.assigner_name,
-            subject=task_data.subject,
-            criticality=task_data.criticality,
-            status=task_data.status,
-            html_file=task_data.html_file,
-            thread_id=task_data.thread_id,
-            created_time=task_data.created_time,
-            last_reminder_sent_time=task_data.last_reminder_sent_time
+    return [tuple(row) for row in db.execute(statement)]
+
+def get_due_reminder_tasks(db: Session, now: datetime) -> List[schemas.Task]:
+    """Get the open tasks whose next reminder is due at the given time."""
+    task_data_list = (
+        _task_query(db)
+        .filter(models.Task.status == schemas.TaskStatus.OPEN.value)
+        .filter(models.Task.next_reminder_at <= now)
+        .order_by(models.Task.next_reminder_at)
+        .all()
+    )
+    return _to_task_schemas(task_data_list)
+
+def backfill_next_reminder_at(db: Session) -> int:
+    """Compute the next reminder time for tasks created before the column existed. Returns the number of updated tasks."""
+    db_tasks = db.query(models.Task).filter(models.Task.next_reminder_at.is_(None)).all()
+    for db_task in db_tasks:
+        db_task.next_reminder_at = reminders.get_next_reminder_at(
+            db_task.criticality, db_task.last_reminder_sent_time or db_task.created_time
         )
-        for task_data in task_data_list
-    ]
-    
-    return tasks
+        _bump_version(db_task)
+    db.commit()
+    return len(db_tasks)
 
+def get_task_ids_by_thread_ids(db: Session, thread_ids: List[str]) -> Dict[str, int]:
+    """Map thread IDs to task IDs. Thread IDs without a task are left out of the result."""
+    task_ids = {}
+    # Query in chunks to stay below SQLite's bound parameter limit
+    for start in range(0, len(thread_ids), LOOKUP_CHUNK_SIZE):
+        chunk = thread_ids[start:start + LOOKUP_CHUNK_SIZE]
+        rows = (
+            db.query(models.Task.thread_id, models.Task.id)
+            .filter(models.Task.thread_id.in_(chunk))
+            .order_by(models.Task.id)
+            .all()
+        )
+        for thread_id, task_id in rows:
+            task_ids.setdefault(thread_id, task_id)
+    return task_ids
 
 def check_user_exists(db: Session, username: str) -> bool:
     """Check if a user exists in the database."""
@@ -83,85 +170,484 @@ def create_task(db: Session, task: schemas.TaskCreate) -> models.Task:
     input_task["assigner_id"] = assigner.id
     input_task.pop("creator_name")
     input_task.pop("assigner_name")
+    # One task per thread, a new email in a known thread only replaces the html file
+    db_task = db.query(models.Task).filter(models.Task.thread_id == task.thread_id).first()
+    if db_task:
+        return _replace_html_file(db, db_task, task.html_file)
+    
     db_task = models.Task(**input_task)  # Use the modified input_task dictionary
     db.add(db_task)
+    try:
+        db.flush()
+    except IntegrityError:
+        # Another worker created the task of this thread in the meantime
+        db.rollback()
+        db_task = db.query(models.Task).filter(models.Task.thread_id == task.thread_id).first()
+        if db_task is None:
+            raise
+        return _replace_html_file(db, db_task, task.html_file)
+    _apply_task_stats_delta(db, _task_stats_key(db_task), 1)
+    db.refresh(db_task)  # load the server generated created_time
+    db_task.next_reminder_at = reminders.get_next_reminder_at(db_task.criticality, db_task.created_time)
+    if _task_stats_key(db_task)[1] == schemas.TaskStatus.CLOSED.value:
+        db_task.closed_time = db_task.created_time
     db.commit()
     db.refresh(db_task)
+    _publish_task_event(db, task_events.TaskEventType.CREATED, db_task.id)
+    return db_task
+
+def _replace_html_file(db: Session, db_task: models.Task, html_file: str) -> models.Task:
+    """Point an existing task to a new html file."""
+    db_task.html_file = html_file
+    _bump_version(db_task)
+    db.commit()
+    db.refresh(db_task)
+    _publish_task_event(db, task_events.TaskEventType.UPDATED, db_task.id)
     return db_task
 
 def get_task(db: Session, task_id: int) -> schemas.Task:
     """Get a task from the database."""
     # join task with user to get creator and assigner names
-    creator_alias = aliased(models.User, name="creator")
-    assigner_alias = aliased(models.User, name="assigner")
-    
-    task_data = (
-        db.query(
-            models.Task.id,
-            models.Task.subject,
-            models.Task.criticality,
-            models.Task.status,
-            models.Task.html_file,
-            models.Task.thread_id,
-            models.Task.created_time,
-            models.Task.last_reminder_sent_time,
-            creator_alias.username.label("creator_name"),
-            assigner_alias.username.label("assigner_name")
-        )
-        .join(creator_alias, models.Task.creator_id == creator_alias.id)
-        .join(assigner_alias, models.Task.assigner_id == assigner_alias.id)
-        .filter(models.Task.id == task_id)
-        .first()
-    )
-    
+    task_data = _task_query(db).filter(models.Task.id == task_id).first()
+    if not task_data:
+        # Archived tasks stay readable by ID
+        task_data = _task_query(db, archived=True).filter(models.ArchivedTask.id == task_id).first()
+
     if not task_data:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    task = {
-        "id": task_data.id,
-        "creator_name": task_data.creator_name,
-        "assigner_name": task_data.assigner_name,
-        "subject": task_data.subject,
-        "criticality": task_data.criticality,
-        "status": task_data.status,
-        "html_file": task_data.html_file,
-        "thread_id": task_data.thread_id,
-        "created_time": task_data.created_time,
-        "last_reminder_sent_time": task_data.last_reminder_sent_time
-    }
-
-    return schemas.Task(**task)
+    return _to_task_schema(task_data)
+
+def get_task_version(db: Session, task_id: int) -> Optional[int]:
+    """Get the version of a task, archived or not, with primary key lookups. None if the task does not exist."""
+    for task_model in (models.Task, models.ArchivedTask):
+        version = db.query(task_model.version).filter(task_model.id == task_id).scalar()
+        if version is not None:
+            return version
+    return None
+
+def _is_archived(db: Session, task_id: int) -> bool:
+    """Check if a task is archived, raise a 404 if it exists in neither table."""
+    if db.query(models.Task.id).filter(models.Task.id == task_id).scalar() is not None:
+        return False
+    if db.query(models.ArchivedTask.id).filter(models.ArchivedTask.id == task_id).scalar() is not None:
+        return True
+    raise HTTPException(status_code=404, detail="Task not found")
 
 def update_task(db: Session, task_id: int, task: schemas.TaskUpdate) -> models.Task:
     """Update a task in the database."""
     db_task = db.query(models.Task).filter(models.Task.id == task_id).first()
     if db_task is None:
         return None
+    # Clients filtering on the old values learn that the task left their filter
+    previous = get_task(db, task_id).model_dump(mode="json")
+    previous_stats_key = _task_stats_key(db_task)
     for key, value in task.model_dump().items():
         if value is not None:
             setattr(db_task, key, value)
-    db.commit()
+    if _task_stats_key(db_task) != previous_stats_key:
+        _apply_task_stats_delta(db, previous_stats_key, -1)
+        _apply_task_stats_delta(db, _task_stats_key(db_task), 1)
+    closed = _task_stats_key(db_task)[1] == schemas.TaskStatus.CLOSED.value
+    if closed != (previous_stats_key[1] == schemas.TaskStatus.CLOSED.value):
+        db_task.closed_time = datetime.now() if closed else None
+    # A reopened task counts its reminder interval from now, its old due time has long passed
+    open_status = schemas.TaskStatus.OPEN.value
+    reopened = _task_stats_key(db_task)[1] == open_status and previous_stats_key[1] != open_status
+    if reopened or task.criticality is not None:
+        db_task.next_reminder_at = reminders.get_next_reminder_at(
+            db_task.criticality,
+            datetime.now() if reopened else db_task.last_reminder_sent_time or db_task.created_time,
+        )
+    _bump_version(db_task)
+    try:
+        db.commit()
+    except IntegrityError:
+        # The only unique column a client can set is the thread ID
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"Another task has thread ID {task.thread_id}")
     db.refresh(db_task)
+    _publish_task_event(db, task_events.TaskEventType.UPDATED, task_id, previous)
     return db_task
 
 def delete_task(db: Session, task_id: int) -> bool:
     """Delete a task from the database."""
     db_task = db.query(models.Task).filter(models.Task.id == task_id).first()
     if db_task:
+        task = get_task(db, task_id).model_dump(mode="json")
+        _apply_task_stats_delta(db, _task_stats_key(db_task), -1)
+        # Rows referencing the task go first, the relationships would set their task_id to NULL instead
+        for model in (models.TaskProp, models.TaskReminderHistory, models.TaskReminderDailyCount):
+            db.query(model).filter(model.task_id == task_id).delete(synchronize_session=False)
         db.delete(db_task)
         db.commit()
+        task_events.hub.publish(task_events.TaskEventType.DELETED, task)
         return True
     return False
 
+def _record_reminders(db: Session, task_ids: List[int], now: datetime) -> List[int]:
+    """
+    Set the last reminder sent time of tasks with one UPDATE per chunk, and log the sends with one batched INSERT.
+    Returns the IDs of the tasks found. The caller commits.
+    """
+    updated_ids = []
+    for start in range(0, len(task_ids), LOOKUP_CHUNK_SIZE):
+        statement = (
+            update(models.Task)
+            .where(models.Task.id.in_(task_ids[start:start + LOOKUP_CHUNK_SIZE]))
+            .values(
+                last_reminder_sent_time=now,
+                next_reminder_at=reminders.next_reminder_at_clause(models.Task.criticality, now),
+                version=models.Task.version + 1,
+            )
+            .returning(models.Task.id)
+        )
+        updated_ids.extend(db.execute(statement, execution_options={"synchronize_session": False}).scalars())
+    if updated_ids:
+        db.execute(
+            models.TaskReminderHistory.__table__.insert(),
+            [{"task_id": task_id, "reminder_sent_time": now} for task_id in updated_ids],
+        )
+    return updated_ids
+
 def set_last_reminder_sent_time(db: Session, task_id: int) -> bool:
-    """Set the last reminder sent time for a task."""
-    db_task = db.query(models.Task).filter(models.Task.id == task_id).first()
-    if db_task:
-        db_task.last_reminder_sent_time = datetime.now()
+    """Set the last reminder sent time for a task, and log the reminder."""
+    if _record_reminders(db, [task_id], datetime.now()):
         db.commit()
+        _publish_task_event(db, task_events.TaskEventType.REMINDER_SENT, task_id)
         return True
     return False
 
+def set_last_reminder_sent_times(db: Session, task_ids: List[int]) -> List[schemas.Task]:
+    """Set the last reminder sent time for many tasks in one transaction, and log the reminders. Returns the updated tasks."""
+    _record_reminders(db, task_ids, datetime.now())
+    db.commit()
+    tasks = _to_task_schemas(_task_query(db).filter(models.Task.id.in_(task_ids)).all())
+    for task in tasks:
+        task_events.hub.publish(task_events.TaskEventType.REMINDER_SENT, task.model_dump(mode="json"))
+    return tasks
+
+def get_reminder_history(db: Session, task_id: int) -> schemas.ReminderHistory:
+    """Get the reminders sent for a task, as sent times within the retention and daily counts before it."""
+    history, daily_count = models.TaskReminderHistory, models.TaskReminderDailyCount
+    if _is_archived(db, task_id):
+        history, daily_count = models.ARCHIVE_TABLES[history], models.ARCHIVE_TABLES[daily_count]
+    sent_times = (
+        db.query(history.reminder_sent_time)
+        .filter(history.task_id == task_id)
+        .order_by(history.reminder_sent_time)
+        .all()
+    )
+    daily_counts = (
+        db.query(daily_count.day, daily_count.count)
+        .filter(daily_count.task_id == task_id)
+        .order_by(daily_count.day)
+        .all()
+    )
+    return schemas.ReminderHistory(
+        sent_times=[sent_time for (sent_time,) in sent_times],
+        daily_counts=[schemas.ReminderDayCount(day=day, count=count) for day, count in daily_counts],
+    )
+
+def compact_reminder_history(db: Session, retention_days: int = REMINDER_HISTORY_RETENTION_DAYS) -> int:
+    """
+    Roll the reminder sends of the days before the retention into per task daily counts, in one transaction.
+    Returns the number of history rows removed.
+    """
+    # Whole days only, so a day is never split between the history and its count
+    cutoff = datetime.combine(datetime.now().date() - timedelta(days=retention_days), datetime.min.time())
+    history = models.TaskReminderHistory
+    day = func.date(history.reminder_sent_time)
+    rolled = (
+        select(history.task_id, day, func.count())
+        .where(history.reminder_sent_time < cutoff)
+        .group_by(history.task_id, day)
+    )
+    counts = sqlite_insert(models.TaskReminderDailyCount).from_select(["task_id", "day", "count"], rolled)
+    # The same day is compacted twice if sends were recorded with an old timestamp after its compaction
+    counts = counts.on_conflict_do_update(
+        index_elements=["task_id", "day"],
+        set_={"count": models.TaskReminderDailyCount.count + counts.excluded.count},
+    )
+    db.execute(counts)
+    removed = db.query(history).filter(history.reminder_sent_time < cutoff).delete(synchronize_session=False)
+    db.commit()
+    return removed
+
+def archive_closed_tasks(db: Session, closed_days: int = ARCHIVE_CLOSED_AFTER_DAYS, batch_size: int = LOOKUP_CHUNK_SIZE) -> int:
+    """
+    Move the tasks CLOSED for more than `closed_days`, with their props and reminder history, to the archive tables.
+    Each batch is one transaction, so task writes wait for one batch at most. Returns the number of tasks archived.
+    """
+    cutoff = datetime.now() - timedelta(days=closed_days)
+    task = models.Task
+    # Tasks closed before the close time was recorded are aged from their last reminder, which only open tasks get
+    closed_time = func.coalesce(task.closed_time, task.last_reminder_sent_time, task.created_time)
+    # IDs given out again before the IDs were AUTOINCREMENT may already be in the archive, those tasks are left
+    # where they are rather than failing every batch after them
+    clashes = or_(*(
+        exists().where(
+            archive_model.id == hot_model.id,
+            (hot_model.id if hot_model is task else hot_model.task_id) == task.id,
+        )
+        for hot_model, archive_model in models.ARCHIVE_TABLES.items() if "id" in hot_model.__table__.c
+    ))
+    eligible = (task.status == schemas.TaskStatus.CLOSED.value, closed_time < cutoff)
+    clashing_ids = [task_id for (task_id,) in db.query(task.id).filter(*eligible, clashes)]
+    if clashing_ids:
+        logger.warning(f"Tasks {clashing_ids} are not archived, the archive has rows with the same IDs")
+    archived = 0
+    while True:
+        task_ids = [task_id for (task_id,) in (
+            db.query(task.id)
+            .filter(*eligible, ~clashes)
+            .order_by(task.id)
+            .limit(batch_size)
+        )]
+        if not task_ids:
+            return archived
+
+        # Archived tasks are no longer counted in the task statistics
+        for assigner_id, status, criticality, count in db.execute(
+            _count_tasks_by(task.assigner_id).where(task.id.in_(task_ids))
+        ):
+            _apply_task_stats_delta(db, (assigner_id, status, criticality), -count)
+        for hot_model, archive_model in models.ARCHIVE_TABLES.items():
+            hot_table = hot_model.__table__
+            task_id = hot_table.c.id if hot_model is task else hot_table.c.task_id
+            db.execute(archive_model.__table__.insert().from_select(
+                [column.name for column in hot_table.columns], select(hot_table).where(task_id.in_(task_ids))
+            ))
+        for hot_model in reversed(list(models.ARCHIVE_TABLES)):
+            hot_table = hot_model.__table__
+            task_id = hot_table.c.id if hot_model is task else hot_table.c.task_id
+            db.execute(hot_table.delete().where(task_id.in_(task_ids)))
+        db.commit()
+        archived += len(task_ids)
+
+#### Task Property CRUDs ####
+
+def get_props_of_tasks(db: Session, task_ids: List[int], include_archived: bool = False) -> Dict[int, Dict[str, str]]:
+    """Get the props of many tasks with one query per chunk of tasks, never one query per task."""
+    props = {task_id: {} for task_id in task_ids}
+    prop_models = (models.TaskProp, models.ArchivedTaskProp) if include_archived else (models.TaskProp,)
+    for prop_model in prop_models:
+        for start in range(0, len(task_ids), LOOKUP_CHUNK_SIZE):
+            rows = (
+                db.query(prop_model.task_id, prop_model.attrname, prop_model.attrval)
+                .filter(prop_model.task_id.in_(task_ids[start:start + LOOKUP_CHUNK_SIZE]))
+                .order_by(prop_model.id)  # the latest value wins if an old database has duplicates
+            )
+            for task_id, name, value in rows:
+                props[task_id][name] = value
+    return props
+
+def get_task_props(db: Session, task_id: int) -> Dict[str, str]:
+    """Get the props of a task, archived or not."""
+    return get_props_of_tasks(db, [task_id], include_archived=_is_archived(db, task_id))[task_id]
+
+def set_task_props(db: Session, props_by_task: Dict[int, Dict[str, Optional[str]]]) -> Dict[int, Dict[str, str]]:
+    """
+    Set props of many tasks in one transaction, a None value deletes the prop. Props that are not given are kept.
+    Returns all props of the given tasks.
+    """
+    task_ids = list(props_by_task)
+    found = {task_id for (task_id,) in db.query(models.Task.id).filter(models.Task.id.in_(task_ids))}
+    if len(found) < len(task_ids):
+        raise HTTPException(status_code=404, detail=f"Tasks not found: {sorted(set(task_ids) - found)}")
+
+    props = models.TaskProp.__table__
+    replaced = [(task_id, name) for task_id, task_props in props_by_task.items() for name in task_props]
+    for start in range(0, len(replaced), LOOKUP_CHUNK_SIZE):
+        db.execute(props.delete().where(
+            tuple_(props.c.task_id, props.c.attrname).in_(replaced[start:start + LOOKUP_CHUNK_SIZE])
+        ))
+    rows = [
+        {"task_id": task_id, "attrname": name, "attrval": value}
+        for task_id, task_props in props_by_task.items() for name, value in task_props.items() if value is not None
+    ]
+    if rows:
+        db.execute(props.insert(), rows)
+    # Lists including the props are cached by the versions of their tasks
+    db.query(models.Task).filter(models.Task.id.in_(task_ids)).update(
+        {models.Task.version: models.Task.version + 1}, synchronize_session=False
+    )
+    db.commit()
+    return get_props_of_tasks(db, task_ids)
+
+#### Task Statistics CRUDs ####
+
+# assigner_id of the task_stats rows counting the tasks of all assignees
+ALL_ASSIGNEES = 0
+# Stored in place of the status or criticality of tasks that have none, e.g. tasks of old databases
+UNSET = "UNSET"
+
+def _task_stats_key(db_task: models.Task) -> tuple:
+    """The (assigner_id, status, criticality) a task is counted under."""
+    status = getattr(db_task.status, "value", db_task.status)
+    criticality = getattr(db_task.criticality, "value", db_task.criticality)
+    return db_task.assigner_id, status or UNSET, criticality or UNSET
+
+def _apply_task_stats_delta(db: Session, key: tuple, delta: int) -> None:
+    """Add `delta` to the task count of an assignee and of all assignees, in the transaction of the task write."""
+    assigner_id, status, criticality = key
+    stats = models.TaskStat.__table__
+    statement = sqlite_insert(stats)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[stats.c.assigner_id, stats.c.status, stats.c.criticality],
+            set_={"count": stats.c.count + statement.excluded.count},
+        ),
+        [{"assigner_id": assigner, "status": status, "criticality": criticality, "count": delta}
+         for assigner in (assigner_id, ALL_ASSIGNEES)]
+    )
+
+def _summarize_task_stats(rows) -> dict:
+    """Sum (status, criticality, count) rows into the total and the counts by status and by criticality."""
+    summary = {"total": 0, "by_status": {}, "by_criticality": {}}
+    for status, criticality, count in rows:
+        summary["total"] += count
+        summary["by_status"][status] = summary["by_status"].get(status, 0) + count
+        summary["by_criticality"][criticality] = summary["by_criticality"].get(criticality, 0) + count
+    return summary
+
+def get_task_stats(db: Session, by_assignee: bool = False) -> schemas.TaskStats:
+    """Get the task counts by status and criticality, from the precomputed task_stats rows."""
+    stats = schemas.TaskStats(**_summarize_task_stats(
+        db.query(models.TaskStat.status, models.TaskStat.criticality, models.TaskStat.count)
+        .filter(models.TaskStat.assigner_id == ALL_ASSIGNEES, models.TaskStat.count > 0)
+        .all()
+    ))
+    if by_assignee:
+        rows_by_assignee = {}
+        for assigner_name, status, criticality, count in (
+            db.query(models.User.username, models.TaskStat.status, models.TaskStat.criticality, models.TaskStat.count)
+            .join(models.User, models.User.id == models.TaskStat.assigner_id)
+            .filter(models.TaskStat.assigner_id != ALL_ASSIGNEES, models.TaskStat.count > 0)
+            .order_by(models.User.username)
+        ):
+            rows_by_assignee.setdefault(assigner_name, []).append((status, criticality, count))
+        stats.by_assignee = [
+            schemas.AssigneeTaskStats(assigner_name=assigner_name, **_summarize_task_stats(rows))
+            for assigner_name, rows in rows_by_assignee.items()
+        ]
+    return stats
+
+def _count_tasks_by(assigner_id) -> Select:
+    """Count the tasks of the tasks table per (assigner_id, status, criticality), as task_stats rows."""
+    status = func.coalesce(models.Task.status, UNSET)
+    criticality = func.coalesce(models.Task.criticality, UNSET)
+    return select(assigner_id, status, criticality, func.count()).group_by(assigner_id, status, criticality)
+
+def rebuild_task_stats(db: Session, repair: bool = True) -> List[tuple]:
+    """
+    Recount the task statistics from the tasks table. Returns the rows that had drifted, as
+    (assigner_id, status, criticality, stored count, actual count). Only reports them if `repair` is False.
+    """
+    stats = models.TaskStat.__table__
+    columns = [stats.c.assigner_id, stats.c.status, stats.c.criticality, stats.c.count]
+    stored = {tuple(row[:3]): row[3] for row in db.execute(select(*columns)) if row[3]}
+    if repair:
+        # The delete takes the write lock first, so no task write can land between the recount and the swap
+        db.execute(stats.delete())
+        db.execute(stats.insert().from_select(columns, _count_tasks_by(models.Task.assigner_id)))
+        db.execute(stats.insert().from_select(columns, _count_tasks_by(literal(ALL_ASSIGNEES))))
+        actual = {tuple(row[:3]): row[3] for row in db.execute(select(*columns))}
+        db.commit()
+    else:
+        actual = {tuple(row[:3]): row[3] for query in (_count_tasks_by(models.Task.assigner_id), _count_tasks_by(literal(ALL_ASSIGNEES)))
+                  for row in db.execute(query)}
+    return [(*key, stored.get(key, 0), actual.get(key, 0)) for key in sorted(stored.keys() | actual.keys())
+            if stored.get(key, 0) != actual.get(key, 0)]
+
+def ensure_task_stats(db: Session) -> None:
+    """Count the tasks of a database created before the task statistics were kept."""
+    if db.query(models.TaskStat).first() is None and db.query(models.Task.id).first() is not None:
+        rebuild_task_stats(db)
+
+def backfill_upgraded_database(db: Session) -> None:
+    """Precompute the next reminder time and the statistics of tasks created before they were tracked."""
+    backfill_next_reminder_at(db)
+    ensure_task_stats(db)
+
+#### Worker Lease CRUDs ####
+
+def acquire_leases(db: Session, worker_id: str, ttl_seconds: int) -> List[int]:
+    """
+    Record the heartbeat of a worker, renew its leases and rebalance the shards across the live workers.
+
+    Each live worker is granted up to ceil(shards / live workers) shards. A worker holding more releases the extra
+    shards, which the other workers claim on their next call. Leases of dead workers expire and are claimed the same way.
+    Every claim is a conditional update, so two workers can never hold the same shard. Returns the owned shards.
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    leases = models.WorkerLease.__table__
+    
+    existing_shards = {shard for (shard,) in db.query(models.WorkerLease.shard).all()}
+    missing_shards = [{"shard": shard} for shard in range(WORKER_SHARDS) if shard not in existing_shards]
+    if missing_shards:
+        db.execute(sqlite_insert(leases).on_conflict_do_nothing(), missing_shards)
+    
+    # Record the heartbeat, then renew the shards this worker still owns
+    workers = models.Worker.__table__
+    db.execute(
+        sqlite_insert(workers)
+        .values(worker_id=worker_id, expires_at=expires_at)
+        .on_conflict_do_update(index_elements=[workers.c.worker_id], set_={"expires_at": expires_at})
+    )
+    db.execute(
+        leases.update()
+        .where(leases.c.worker_id == worker_id)
+        .values(expires_at=expires_at)
+    )
+    
+    live_workers = db.query(models.Worker).filter(models.Worker.expires_at >= now).count()
+    target = math.ceil(WORKER_SHARDS / live_workers)
+    
+    owned = sorted(
+        shard for (shard,) in db.query(models.WorkerLease.shard)
+        .filter(models.WorkerLease.worker_id == worker_id)
+        .filter(models.WorkerLease.shard < WORKER_SHARDS)
+    )
+    if len(owned) > target:
+        db.execute(
+            leases.update()
+            .where(leases.c.shard.in_(owned[target:]))
+            .values(worker_id=None, expires_at=None)
+        )
+        owned = owned[:target]
+    elif len(owned) < target:
+        free_shards = [
+            shard for (shard,) in db.query(models.WorkerLease.shard)
+            .filter((models.WorkerLease.worker_id.is_(None)) | (models.WorkerLease.expires_at < now))
+            .filter(models.WorkerLease.shard < WORKER_SHARDS)
+            .order_by(models.WorkerLease.shard)
+        ]
+        for shard in free_shards[:target - len(owned)]:
+            claimed = db.execute(
+                leases.update()
+                .where(leases.c.shard == shard)
+                .where((leases.c.worker_id.is_(None)) | (leases.c.expires_at < now))
+                .values(worker_id=worker_id, expires_at=expires_at)
+            )
+            if claimed.rowcount:
+                owned.append(shard)
+    db.commit()
+    return sorted(owned)
+
+def release_leases(db: Session, worker_id: str) -> int:
+    """Release all the shards of a worker, e.g. when it shuts down. Returns the number of released shards."""
+    leases = models.WorkerLease.__table__
+    result = db.execute(
+        leases.update()
+        .where(leases.c.worker_id == worker_id)
+        .values(worker_id=None, expires_at=None)
+    )
+    db.query(models.Worker).filter(models.Worker.worker_id == worker_id).delete()
+    db.commit()
+    return result.rowcount
+
 #### User CRUDs ####
 
 def get_users(db: Session, skip: int = 0, limit: int = 100) -> List[models.User]:
@@ -188,6 +674,12 @@ def get_user_by_username(db: Session, username: str) -> models.User:
 def update_user(db: Session, user_id: int, user: schemas.UpdateUser) -> models.User:
     """Update a user in the database."""
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    if user.username is not None and user.username != db_user.username:
+        # The tasks of the user show the old name
+        for task_model in (models.Task, models.ArchivedTask):
+            (db.query(task_model)
+               .filter(or_(task_model.creator_id == user_id, task_model.assigner_id == user_id))
+               .update({task_model.version: task_model.version + 1}, synchronize_session=False))
     for key, value in user.model_dump().items():
         if value is not None:
             setattr(db_user, key, value)
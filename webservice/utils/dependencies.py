@@ -1,20 +1,38 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from passlib.context import CryptContext
 import os
 
 # SQLite URL format: "sqlite:///./test.db"
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
-print(f"SQLALCHEMY_DATABASE_URL: {SQLALCHEMY_DATABASE_URL}")
 
 if not SQLALCHEMY_DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
+# Connections of the read-only pool used by GET routes, on top of the connections of the write pool
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", 10))
+
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+# Reads get their own pool, so list and detail calls never wait for a connection held by a write
+read_engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False},
+    pool_size=READ_POOL_SIZE, max_overflow=READ_POOL_SIZE,
+)
+
+@event.listens_for(engine, "connect")
+def enable_wal(dbapi_connection, connection_record):
+    # In WAL mode readers see the last commit while the single writer goes on, instead of waiting for it
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+@event.listens_for(read_engine, "connect")
+def make_read_only(dbapi_connection, connection_record):
+    dbapi_connection.execute("PRAGMA query_only=ON")
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 def get_db():
     """Create a new session for each request, and close it when the request ends."""
@@ -24,6 +42,14 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    """Create a new read-only session for each request, and close it when the request ends. Writes through it fail."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
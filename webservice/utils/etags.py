@@ -0,0 +1,19 @@
+import hashlib
+from typing import Iterable, Optional, Tuple
+
+def task_etag(task_id: int, version: int) -> str:
+    """Strong ETag of a task, it changes with every write to the task."""
+    return f'"t{task_id}.{version}"'
+
+def task_list_etag(versions: Iterable[Tuple[int, int]]) -> str:
+    """Strong ETag of a list of tasks, from the (id, version) of its tasks in order."""
+    digest = hashlib.sha1(",".join(f"{task_id}.{version}" for task_id, version in versions).encode()).hexdigest()
+    return f'"l{digest[:32]}"'
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check if an If-None-Match header matches an ETag, with the weak comparison RFC 9110 requires for it."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
@@ -1,6 +1,9 @@
 import os
+import atexit
+import queue
 import logging
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
 
 if not os.path.exists("LogFiles"):
     os.makedirs("LogFiles")
@@ -8,6 +11,7 @@ if not os.path.exists("LogFiles"):
 APP_LOG_FILE = "LogFiles/app.log"
 SQLALCHEMY_LOG_FILE = "LogFiles/sqlalchemy.log"
 UVICORN_LOG_FILE = "LogFiles/uvicorn.log"
+SLOW_QUERY_LOG_FILE = "LogFiles/slow_queries.log"
 
 # debug levels
 UVICORN_DEBUG_LEVEL = os.getenv("UVICORN_DEBUG_LEVEL", "INFO")
@@ -55,6 +59,12 @@ logging_config = {
             "formatter": "advanced",
             "filename": SQLALCHEMY_LOG_FILE,
         },
+        "slow_queries": {
+            "level": "INFO",
+            "class": "logging.FileHandler",
+            "formatter": "default",
+            "filename": SLOW_QUERY_LOG_FILE,
+        },
     },
     "loggers": {
         "uvicorn": {
@@ -77,6 +87,11 @@ logging_config = {
             "level": APP_DEBUG_LEVEL,
             "propagate": False,
         },
+        "sql.profiler": {
+            "handlers": ["slow_queries"],
+            "level": "INFO",
+            "propagate": False,
+        },
         "sqlalchemy.engine": {
             "handlers": ["sqlalchemy"],
             "level": SQLALCHEMY_DEBUG_LEVEL,
@@ -89,8 +104,57 @@ logging_config = {
     },
 }
 
+class _RoutingQueueHandler(QueueHandler):
+    """Puts the records of a logger on the log queue, tagged with the handlers the logger was configured with."""
+
+    def __init__(self, log_queue: queue.SimpleQueue, targets: list) -> None:
+        super().__init__(log_queue)
+        self.targets = targets
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.target_handlers = self.targets
+        return record
+
+class _RoutingQueueListener(QueueListener):
+    """Writes every queued record with the handlers it was tagged with, on the listener thread."""
+
+    def handle(self, record: logging.LogRecord) -> None:
+        for handler in record.target_handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+_queue_handlers = []
+
+def _start_listener(log_queue: queue.SimpleQueue) -> None:
+    listener = _RoutingQueueListener(log_queue)
+    listener.start()
+    atexit.register(listener.stop)  # flush the queued records on shutdown
+
+def _write_logs_off_thread() -> None:
+    """
+    Swap the handlers of the configured loggers for queue handlers, and write the records from a single
+    background thread, so requests never wait on the disk or the console.
+    """
+    log_queue = queue.SimpleQueue()
+    for logger in [logging.getLogger()] + [logging.getLogger(name) for name in logging_config["loggers"]]:
+        if logger.handlers:
+            logger.handlers = [_RoutingQueueHandler(log_queue, logger.handlers)]
+            _queue_handlers.extend(logger.handlers)
+    _start_listener(log_queue)
+
+def _write_logs_off_thread_in_child() -> None:
+    """The listener thread does not survive a fork, a forked worker writes its records from a thread and queue of its own."""
+    log_queue = queue.SimpleQueue()
+    for handler in _queue_handlers:
+        handler.queue = log_queue
+    _start_listener(log_queue)
+
+os.register_at_fork(after_in_child=_write_logs_off_thread_in_child)
+
 try:
     dictConfig(logging_config)
+    _write_logs_off_thread()
 except Exception as e:
     print(f"Error configuring logger: {e}")  # This should print in case of an exception
 
@@ -0,0 +1,199 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Latency buckets in seconds, from a fast primary key lookup to a slow upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry: Dict[str, "Metric"] = {}
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    """A metric with optional labels, rendered in the Prometheus text format. Thread safe."""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], object] = {}
+        registry[name] = self
+
+    def labels(self, *values: str) -> "_Child":
+        """Returns the child metric for the given label values, in the order of the label names."""
+        return _Child(self, tuple(str(value) for value in values))
+
+    def _initial(self):
+        return 0.0
+
+    def _update(self, key: Tuple[str, ...], function) -> None:
+        with self.lock:
+            self.values[key] = function(self.values.get(key, self._initial()))
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Returns the (suffix, labels, value) samples of the metric."""
+        with self.lock:
+            return [("", _format_labels(self.labelnames, key), value) for key, value in self.values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{suffix}{labels} {value}" for suffix, labels, value in self.samples()]
+        return "\n".join(lines)
+
+class _Child:
+    """A metric bound to label values, see `Metric.labels`."""
+
+    def __init__(self, metric: Metric, key: Tuple[str, ...]) -> None:
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount: float = 1) -> None:
+        self.metric.inc(amount, key=self.key)
+
+    def dec(self, amount: float = 1) -> None:
+        self.metric.dec(amount, key=self.key)
+
+    def observe(self, amount: float) -> None:
+        self.metric.observe(amount, key=self.key)
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of requests."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, key: Tuple[str, ...] = ()) -> None:
+        self._update(key, lambda value: value + amount)
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. the number of requests in progress."""
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, key: Tuple[str, ...] = ()) -> None:
+        self._update(key, lambda value: value + amount)
+
+    def dec(self, amount: float = 1, key: Tuple[str, ...] = ()) -> None:
+        self._update(key, lambda value: value - amount)
+
+class Histogram(Metric):
+    """Counts observations, e.g. request durations, in cumulative buckets."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _initial(self):
+        return ([0] * (len(self.buckets) + 1), 0.0)  # per bucket counts (the last one is +Inf), sum
+
+    def observe(self, amount: float, key: Tuple[str, ...] = ()) -> None:
+        def add(value):
+            counts, total = value
+            counts[bisect_left(self.buckets, amount)] += 1
+            return counts, total + amount
+        self._update(key, add)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+                cumulative += count
+                samples.append(("_bucket", _format_labels((*self.labelnames, "le"), (*key, bound)), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+def render() -> str:
+    """Renders all registered metrics in the Prometheus text format."""
+    return "\n".join(metric.render() for metric in registry.values()) + "\n"
+
+## Webservice metrics ##
+
+http_requests = Counter("http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status"))
+http_request_duration = Histogram("http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route"))
+http_requests_in_progress = Gauge("http_requests_in_progress", "HTTP requests being handled.")
+db_pool_checkout_wait = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a database connection, by pool.", ("pool",))
+db_pool_connections_in_use = Gauge("db_pool_connections_in_use", "Database connections checked out, by pool.", ("pool",))
+db_statements = Counter("db_statements_total", "SQL statements executed, by pool and operation.", ("pool", "operation"))
+db_statement_duration = Histogram("db_statement_duration_seconds", "SQL statement latency, by pool and operation.", ("pool", "operation"))
+ftp_upload_bytes = Counter("ftp_upload_bytes_total", "Bytes of task HTML files forwarded to the FTP server.")
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording the count, latency and status of every HTTP request, per route template."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+        async def send_with_status(message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        http_requests_in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope, raw paths would give a series per task ID
+            route = scope.get("route")
+            route = getattr(route, "path", "<unmatched>")
+            http_request_duration.labels(scope["method"], route).observe(time.perf_counter() - start)
+            http_requests.labels(scope["method"], route, status[0]).inc()
+            http_requests_in_progress.dec()
+
+def _time_pool_checkout(engine: Engine, pool: str) -> None:
+    """Record the checkout wait of the current pool of an engine. Pools have no event before a checkout."""
+    pool_connect = engine.pool.connect
+    def timed_pool_connect():
+        start = time.perf_counter()
+        try:
+            return pool_connect()
+        finally:
+            db_pool_checkout_wait.labels(pool).observe(time.perf_counter() - start)
+    engine.pool.connect = timed_pool_connect
+
+def instrument_engine(engine: Engine, pool: str) -> None:
+    """Records the pool checkout wait and usage, and the count and latency of every SQL statement of an engine."""
+    _time_pool_checkout(engine, pool)
+
+    # `engine.dispose()`, e.g. before forking workers, replaces the pool. Its event listeners are carried over
+    @event.listens_for(engine, "engine_disposed")
+    def time_new_pool_checkout(engine):
+        _time_pool_checkout(engine, pool)
+
+    @event.listens_for(engine, "checkout")
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        db_pool_connections_in_use.labels(pool).inc()
+
+    @event.listens_for(engine, "checkin")
+    def count_checkin(dbapi_connection, connection_record):
+        db_pool_connections_in_use.labels(pool).dec()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        context.metrics_start_time = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        operation = statement.split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        db_statements.labels(pool, operation).inc()
+        db_statement_duration.labels(pool, operation).observe(time.perf_counter() - context.metrics_start_time)
@@ -1,13 +1,32 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import Request
 import logging
+import time
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        logger = logging.getLogger("app")
-        body = await request.body()
-        logger.info(f"Request URL: {request.url}")
-        logger.info(f"Request method: {request.method}")
-        # logger.info(f"Request body: {body.decode('utf-8')}")
-        response = await call_next(request)
-        return response
\ No newline at end of file
+logger = logging.getLogger("app")
+
+class LoggingMiddleware:
+    """
+    Pure ASGI access log middleware. The request body is never read, so uploads stream straight through
+    to the route, and one line is logged per request once its response has started.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+        async def send_with_status(message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            query = f"?{scope['query_string'].decode('latin-1')}" if scope.get("query_string") else ""
+            client = scope["client"][0] if scope.get("client") else "-"
+            logger.info(f'{client} "{scope["method"]} {scope["path"]}{query}" {status[0]} {(time.perf_counter() - start) * 1000:.1f}ms')
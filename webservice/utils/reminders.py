@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+from sqlalchemy import case, literal
+import schemas
+import os
+
+# Reminder intervals in hours
+REMINDER_INTERVALS = {
+    schemas.TaskCriticality.LOW.value: float(os.getenv('REMINDER_INTERVAL_FOR_LOW', 48)),
+    schemas.TaskCriticality.MEDIUM.value: float(os.getenv('REMINDER_INTERVAL_FOR_MEDIUM', 24)),
+    schemas.TaskCriticality.HIGH.value: float(os.getenv('REMINDER_INTERVAL_FOR_HIGH', 10)),
+    schemas.TaskCriticality.CRITICAL.value: float(os.getenv('REMINDER_INTERVAL_FOR_CRITICAL', 5)),
+}
+
+# Interval of tasks without a known criticality, e.g. rows written before the column was validated
+DEFAULT_REMINDER_INTERVAL = REMINDER_INTERVALS[schemas.TaskCriticality.MEDIUM.value]
+
+def get_next_reminder_at(criticality: str, last_reminder_time: datetime) -> datetime:
+    """Get the time the next reminder is due, given the task criticality and the time of the last reminder (or creation)."""
+    if isinstance(criticality, schemas.TaskCriticality):
+        criticality = criticality.value
+    interval = REMINDER_INTERVALS.get(criticality, DEFAULT_REMINDER_INTERVAL)
+    return last_reminder_time + timedelta(hours=interval)
+
+def next_reminder_at_clause(criticality_column, last_reminder_time: datetime):
+    """SQL expression of `get_next_reminder_at` for a criticality column, so that many tasks are updated in one statement."""
+    return case(
+        {criticality: literal(last_reminder_time + timedelta(hours=interval)) for criticality, interval in REMINDER_INTERVALS.items()},
+        value=criticality_column,
+        else_=literal(last_reminder_time + timedelta(hours=DEFAULT_REMINDER_INTERVAL)),
+    )
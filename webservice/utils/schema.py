@@ -0,0 +1,124 @@
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+import models
+from sqlalchemy.exc import IntegrityError, OperationalError
+import hashlib
+import logging
+from typing import Callable, Optional
+
+logger = logging.getLogger('app')
+
+SCHEMA_VERSION_KEY = "schema_version"
+
+def schema_version() -> str:
+    """Fingerprint of the tables, columns and indexes of the models, it changes with any change to the schema."""
+    parts = []
+    for table in models.Base.metadata.sorted_tables:
+        parts.append(f"table {table.name} {sorted(table.kwargs.items())}")
+        for column in table.columns:
+            default = column.server_default.arg if column.server_default is not None else None
+            parts.append(f"column {column.name} {column.type!r} {column.nullable} {column.primary_key} {default!s}")
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            parts.append(f"index {index.name} {[column.name for column in index.columns]} {index.unique}")
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+def _stored_schema_version(engine: Engine):
+    """The schema version the database was last upgraded to, None if it never was."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                select(models.SchemaMeta.value).where(models.SchemaMeta.key == SCHEMA_VERSION_KEY)
+            ).scalar()
+    except OperationalError:
+        return None  # no schema_meta table yet
+
+def _rebuild_with_autoincrement(engine: Engine, table) -> None:
+    """
+    SQLite only makes a table AUTOINCREMENT when creating it, so the rows are copied to a new table. The sequence
+    starts above the IDs of the archive too, the IDs of the rows archived before are never given out again.
+    """
+    preparer = engine.dialect.identifier_preparer
+    rebuilt = preparer.quote(f"{table.name}_rebuild")
+    create = str(CreateTable(table).compile(dialect=engine.dialect)).strip()
+    create = create.replace(f"CREATE TABLE {preparer.format_table(table)}", f"CREATE TABLE {rebuilt}", 1)
+    archive = {hot.__table__: archived.__table__ for hot, archived in models.ARCHIVE_TABLES.items()}.get(table)
+
+    logger.info(f"Rebuilding table {table.name} with AUTOINCREMENT IDs")
+    with engine.begin() as conn:
+        existing_columns = {column["name"] for column in inspect(conn).get_columns(table.name)}
+        columns = ", ".join(preparer.quote(column.name) for column in table.columns if column.name in existing_columns)
+        conn.execute(text(f"DROP TABLE IF EXISTS {rebuilt}"))
+        conn.execute(text(create))
+        conn.execute(text(f"INSERT INTO {rebuilt} ({columns}) SELECT {columns} FROM {preparer.format_table(table)}"))
+        # The indexes go with the old table, they are created again by `upgrade_schema`
+        conn.execute(text(f"DROP TABLE {preparer.format_table(table)}"))
+        conn.execute(text(f"ALTER TABLE {rebuilt} RENAME TO {preparer.format_table(table)}"))
+
+        highest_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+        if archive is not None:
+            highest_id = max(highest_id, conn.execute(select(func.max(archive.c.id))).scalar() or 0)
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": table.name})
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {"name": table.name, "seq": highest_id})
+
+def upgrade_schema(engine: Engine, backfill: Optional[Callable[[Session], None]] = None) -> bool:
+    """
+    Create missing tables, then add any columns and indexes that were introduced
+    after an existing database was created. `create_all` alone only creates new tables.
+    Skipped with a single query if the database is at the schema version of the models.
+    `backfill` fills the new columns and tables, the version is only recorded once it has committed.
+    Returns whether the schema was upgraded.
+    """
+    version = schema_version()
+    if _stored_schema_version(engine) == version:
+        return False
+
+    models.Base.metadata.create_all(bind=engine)
+
+    for table in models.Base.metadata.sorted_tables:
+        if table.kwargs.get("sqlite_autoincrement"):
+            with engine.connect() as conn:
+                sql = conn.execute(
+                    text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+                ).scalar()
+            if "AUTOINCREMENT" not in sql.upper():
+                _rebuild_with_autoincrement(engine, table)
+
+    inspector = inspect(engine)
+    complete = True
+    with engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = ""
+                if column.server_default is not None and isinstance(column.server_default.arg, str):
+                    default = f" DEFAULT '{column.server_default.arg}'"
+                logger.info(f"Adding column {table.name}.{column.name}")
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}{default}'))
+
+            for index in table.indexes:
+                try:
+                    with conn.begin_nested():
+                        index.create(bind=conn, checkfirst=True)
+                except IntegrityError:
+                    # e.g. duplicate thread IDs created before the unique index existed
+                    logger.exception(f"Could not create unique index {index.name}. Remove the duplicate rows and restart.")
+                    complete = False
+
+    if not complete:
+        return True  # the version is not recorded, so the next start tries again
+
+    if backfill is not None:
+        with Session(engine) as db:
+            backfill(db)
+
+    with engine.begin() as conn:
+        meta = models.SchemaMeta.__table__
+        statement = sqlite_insert(meta).values(key=SCHEMA_VERSION_KEY, value=version)
+        conn.execute(statement.on_conflict_do_update(index_elements=[meta.c.key], set_={"value": version}))
+    return True
@@ -0,0 +1,112 @@
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from typing import Optional
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger('app')
+slow_query_logger = logging.getLogger('sql.profiler')
+
+# Statements slower than this are written to LogFiles/slow_queries.log with their query plan
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 100))
+# A statement shape repeated this many times within one request is reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 5))
+# In debug mode every response carries the statement count, the DB time and the N+1 suspects of its request
+DEBUG = os.getenv('DEBUG', 'false').lower() in ('1', 'true', 'yes')
+
+# Placeholder lists, e.g. expanded IN lists with one placeholder per value, are collapsed so all sizes share a shape
+_PLACEHOLDER_LIST_PATTERN = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def statement_shape(statement: str) -> str:
+    """Normalize a statement so that executions differing only in their parameters have the same shape."""
+    return _PLACEHOLDER_LIST_PATTERN.sub('(?...)', _WHITESPACE_PATTERN.sub(' ', statement).strip())
+
+class RequestProfile:
+    """The statements executed while handling one request."""
+
+    def __init__(self) -> None:
+        self.statement_count = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+
+    def add(self, statement: str, duration: float) -> None:
+        self.statement_count += 1
+        self.db_time += duration
+        self.shapes[statement_shape(statement)] += 1
+
+    def n_plus_one_suspects(self) -> dict:
+        """Shapes repeated at least `N_PLUS_ONE_THRESHOLD` times, with their count."""
+        return {shape: count for shape, count in self.shapes.items() if count >= N_PLUS_ONE_THRESHOLD}
+
+# Sync routes run in a worker thread with a copy of the context, so the profile object itself is shared
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar('sql_profile', default=None)
+
+def _explain(cursor, statement: str, parameters) -> str:
+    """Return the SQLite query plan of a statement, on the raw DBAPI connection so it is not profiled itself."""
+    try:
+        plan_cursor = cursor.connection.cursor()
+        try:
+            rows = plan_cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ()).fetchall()
+        finally:
+            plan_cursor.close()
+        return "\n".join(f"  {row[-1]}" for row in rows)
+    except Exception as e:
+        return f"  (no query plan: {e})"
+
+def instrument_engine(engine: Engine) -> None:
+    """Time every statement of an engine, add it to the profile of the current request and log slow statements."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        context.profiler_start_time = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context.profiler_start_time
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.add(statement, duration)
+
+        if duration * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+            # executemany runs one plan per parameter set, the first one is representative
+            plan_parameters = parameters[0] if executemany and parameters else parameters
+            slow_query_logger.info(
+                f"{duration * 1000:.1f}ms: {_WHITESPACE_PATTERN.sub(' ', statement).strip()}\n"
+                f"  parameters: {plan_parameters}\n{_explain(cursor, statement, plan_parameters)}"
+            )
+
+class SQLProfilingMiddleware:
+    """Pure ASGI middleware profiling the SQL of every request, and reporting likely N+1 queries."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+
+        async def send_with_profile(message) -> None:
+            if DEBUG and message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-db-statements", str(profile.statement_count).encode()),
+                    (b"x-db-time-ms", f"{profile.db_time * 1000:.2f}".encode()),
+                    (b"x-db-n-plus-one", str(len(profile.n_plus_one_suspects())).encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _current_profile.reset(token)
+            for shape, count in profile.n_plus_one_suspects().items():
+                logger.warning(f"Likely N+1 in {scope['method']} {scope['path']}: statement run {count} times: {shape}")
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import List, Optional
+
+from utils import task_filters
+
+# Events kept for clients resuming with Last-Event-ID, older events are only replaced by a reset event
+TASK_EVENT_BUFFER_SIZE = int(os.getenv('TASK_EVENT_BUFFER_SIZE', 1000))
+# Events queued for one client before it is considered stuck and told to reset
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+class TaskEventType(str, Enum):
+    """The type of a task change."""
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+    REMINDER_SENT = "reminder_sent"
+
+class Subscription:
+    """The queue of events of one connected client. Filled from any thread, consumed on the event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def deliver(self, event: dict) -> None:
+        """Queue an event, on the event loop of the subscription."""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)  # wakes the consumer, which ends the stream with a reset event
+
+class TaskEventHub:
+    """
+    In-process broadcast of task changes to the connected clients.
+
+    The crud write functions publish every change once committed, from the worker threads of the routes. Recent
+    events are kept in a ring buffer so that a client reconnecting with Last-Event-ID gets the events it missed.
+    Event IDs start at the boot time in microseconds, so IDs of an earlier process are always older than the buffer.
+    """
+
+    def __init__(self, buffer_size: int = TASK_EVENT_BUFFER_SIZE) -> None:
+        self.lock = threading.Lock()
+        self.buffer = deque(maxlen=buffer_size)
+        self.next_id = time.time_ns() // 1000
+        self.subscriptions: List[Subscription] = []
+
+    def publish(self, event_type: str, task: dict, previous: Optional[dict] = None) -> None:
+        """Broadcast a change of a task. `previous` is the task before the change, if the change may move it out of a filter."""
+        with self.lock:
+            event = {"id": self.next_id, "type": TaskEventType(event_type).value, "task": task, "previous": previous}
+            self.next_id += 1
+            self.buffer.append(event)
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> tuple:
+        """
+        Register a client of the running event loop. Returns its subscription and the buffered events after
+        `last_event_id`, or None if events were missed since then and the client has to reload its tasks.
+        """
+        subscription = Subscription(asyncio.get_running_loop())
+        with self.lock:
+            self.subscriptions.append(subscription)
+            if last_event_id is None:
+                return subscription, []
+            if self.buffer and self.buffer[0]["id"] > last_event_id + 1:
+                return subscription, None
+            if not self.buffer and last_event_id < self.next_id - 1:
+                return subscription, None
+            return subscription, [event for event in self.buffer if event["id"] > last_event_id]
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.subscriptions.remove(subscription)
+
+hub = TaskEventHub()
+
+def matches(event: dict, filters: dict) -> bool:
+    """Check if the task of an event, before or after the change, matches the filters of `read_tasks`."""
+    return any(task is not None and task_filters.matches_task(task, filters) for task in (event["task"], event["previous"]))
+
+def format_event(event: dict) -> str:
+    """Format an event as a Server-Sent Event."""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['task'], default=str)}\n\n"
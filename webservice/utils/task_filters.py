@@ -0,0 +1,169 @@
+from sqlalchemy import Select, exists, literal, select, union_all
+from sqlalchemy.orm import aliased
+from fastapi import HTTPException
+from datetime import datetime
+from typing import List, Optional, Tuple
+import models
+
+# The users a task is joined with for its creator and assigner names
+creator = aliased(models.User, name="creator")
+assigner = aliased(models.User, name="assigner")
+
+# Operators of a `<field>__<operator>` filter key, a plain `<field>` key filters on equality
+OPERATORS = {
+    "in": lambda column, value: column.in_(value),
+    "contains": lambda column, value: column.ilike(f"%{value}%"),
+    "gte": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+}
+
+def _comparable(value):
+    """A task value as compared by SQLite, datetimes of JSON tasks are parsed and their time zone ignored."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value.replace(tzinfo=None) if isinstance(value, datetime) else value
+
+# `OPERATORS` for a task dict, like the tasks of task events. A NULL value never matches, like in SQL
+TASK_OPERATORS = {
+    "in": lambda task_value, value: task_value in value,
+    "contains": lambda task_value, value: task_value is not None and value.lower() in task_value.lower(),
+    "gte": lambda task_value, value: task_value is not None and _comparable(task_value) >= _comparable(value),
+    "lt": lambda task_value, value: task_value is not None and _comparable(task_value) < _comparable(value),
+}
+
+def matches_task(task: dict, filters: dict) -> bool:
+    """Check a task dict against a filter spec of `compile_task_page`. Props are not part of task dicts."""
+    for key, value in filters.items():
+        if key == "props":
+            raise ValueError("Props filters are only compiled to SQL")
+        field, _, operator = key.partition("__")
+        task_value = task.get(field)
+        if not (TASK_OPERATORS[operator](task_value, value) if operator else task_value == value):
+            return False
+    return True
+
+# Fields tasks can be sorted by. Each leads an index of the tasks table, so that sorts walk the index
+SORT_FIELDS = {"id", "subject", "created_time", "last_reminder_sent_time"}
+
+# Fields of a task that are always returned, they identify the task and its version for the ETag
+REQUIRED_FIELDS = ["id", "version"]
+
+def task_columns(archived: bool = False) -> dict:
+    """The columns of a task by field name, of the archive table if `archived` is set."""
+    task_model = models.ArchivedTask if archived else models.Task
+    return {
+        "id": task_model.id,
+        "subject": task_model.subject,
+        "criticality": task_model.criticality,
+        "status": task_model.status,
+        "html_file": task_model.html_file,
+        "thread_id": task_model.thread_id,
+        "created_time": task_model.created_time,
+        "last_reminder_sent_time": task_model.last_reminder_sent_time,
+        "next_reminder_at": task_model.next_reminder_at,
+        "version": task_model.version,
+        "closed_time": task_model.closed_time,
+        "archived": literal(archived),
+        "creator_name": creator.username,
+        "assigner_name": assigner.username,
+    }
+
+FIELDS = list(task_columns())
+
+def parse_sort(sort: Optional[str]) -> List[Tuple[str, bool]]:
+    """
+    Parse a sort spec like `-created_time,subject` to (field, descending) pairs. The ID breaks ties, in the
+    direction of the last field, so that pages are stable and an index on the last field still gives the order.
+    """
+    order = []
+    for name in (sort or "").split(","):
+        name = name.strip()
+        if not name:
+            continue
+        descending = name.startswith("-")
+        field = name.lstrip("-")
+        if field not in SORT_FIELDS:
+            raise HTTPException(status_code=400, detail=f"Cannot sort by {field}. Sortable fields: {sorted(SORT_FIELDS)}")
+        order.append((field, descending))
+    if not any(field == "id" for field, _ in order):
+        order.append(("id", order[-1][1] if order else False))
+    return order
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Parse a field list like `subject,status` to the fields to select, None for all fields."""
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = set(names) - set(FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {sorted(unknown)}. Fields: {FIELDS}")
+    return REQUIRED_FIELDS + [name for name in names if name not in REQUIRED_FIELDS]
+
+def _where(filters: dict, columns: dict, archived: bool) -> list:
+    """Compile a filter spec to WHERE clauses."""
+    task_model = models.ArchivedTask if archived else models.Task
+    prop_model = models.ARCHIVE_TABLES[models.TaskProp] if archived else models.TaskProp
+    clauses = []
+    for key, value in filters.items():
+        if key == "props":
+            # One correlated EXISTS per prop, answered from the (attrname, attrval, task_id) index
+            for name, prop_value in value.items():
+                clauses.append(exists().where(
+                    prop_model.task_id == task_model.id,
+                    prop_model.attrname == name,
+                    prop_model.attrval == prop_value,
+                ))
+            continue
+        field, _, operator = key.partition("__")
+        if field not in columns or (operator and operator not in OPERATORS):
+            raise HTTPException(status_code=400, detail=f"Unknown filter {key}")
+        column = columns[field]
+        clauses.append(OPERATORS[operator](column, value) if operator else column == value)
+    return clauses
+
+def _select(fields: List[str], filters: dict, joined: set, archived: bool) -> Select:
+    """Select the fields of the tasks matching the filters, joining only the users that are used."""
+    task_model = models.ArchivedTask if archived else models.Task
+    columns = task_columns(archived)
+    statement = select(*(columns[name].label(name) for name in fields)).select_from(task_model)
+    if "creator_name" in joined:
+        statement = statement.join(creator, task_model.creator_id == creator.id)
+    if "assigner_name" in joined:
+        statement = statement.join(assigner, task_model.assigner_id == assigner.id)
+    return statement.where(*_where(filters, columns, archived))
+
+def compile_task_page(
+    filters: dict = None,
+    sort: List[Tuple[str, bool]] = None,
+    fields: List[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    include_archived: bool = False,
+) -> Select:
+    """
+    Compile a page of tasks to one statement. `filters` maps `<field>[__<operator>]` to a value, and `props` to
+    the props the tasks must have. The archive is merged in with UNION ALL if `include_archived` is set.
+    """
+    filters = filters or {}
+    order = sort or parse_sort(None)
+    fields = fields or FIELDS
+    # Users are only joined when a field or a filter needs their names
+    joined = (set(fields) | {key.partition("__")[0] for key in filters}) & {"creator_name", "assigner_name"}
+
+    if not include_archived:
+        columns = task_columns()
+        statement = _select(fields, filters, joined, archived=False)
+    else:
+        # The sort fields are selected too, the union can only be sorted by its own columns
+        selected = fields + [field for field, _ in order if field not in fields]
+        merged = union_all(
+            _select(selected, filters, joined, archived=False),
+            _select(selected, filters, joined, archived=True),
+        ).subquery()
+        columns = merged.c
+        statement = select(*(merged.c[name] for name in fields))
+    statement = statement.order_by(*(columns[field].desc() if descending else columns[field] for field, descending in order))
+    return statement.offset(skip).limit(limit)
@@ -0,0 +1,149 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SERVICE_NAME = "webservice"
+# Finished spans are appended to <TRACE_DIR>/<service>-<pid>.jsonl, spans are only propagated if not set
+TRACE_DIR = os.getenv('TRACE_DIR')
+
+# W3C trace context header: version-trace_id-parent_span_id-flags
+_TRACEPARENT_PATTERN = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+class Span:
+    """A timed operation of a trace. Spans of other services join the trace through the traceparent header."""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None, **attributes) -> None:
+        self.name = name
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self) -> None:
+        _export({
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "service": SERVICE_NAME, "name": self.name, "start": self.start, "duration": time.time() - self.start,
+            "attributes": self.attributes, "error": self.error,
+        })
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('trace_span', default=None)
+
+_export_lock = threading.Lock()
+_export_file = None
+
+def _export(record: dict) -> None:
+    global _export_file
+    if not TRACE_DIR:
+        return
+    line = json.dumps(record, default=str) + "\n"
+    with _export_lock:
+        if _export_file is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            # One file per process, so forked workers never interleave their lines
+            _export_file = open(os.path.join(TRACE_DIR, f"{SERVICE_NAME}-{os.getpid()}.jsonl"), "a", buffering=1)
+        _export_file.write(line)
+
+def parse_traceparent(header: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Returns the trace ID and parent span ID of a traceparent header, (None, None) if missing or invalid."""
+    match = _TRACEPARENT_PATTERN.match(header or "")
+    return match.groups() if match else (None, None)
+
+@contextmanager
+def start_span(name: str, traceparent: Optional[str] = None, **attributes) -> Iterator[Span]:
+    """Runs the block in a new span, a child of the current span or of the given traceparent header."""
+    parent = _current_span.get()
+    if traceparent:
+        trace_id, parent_id = parse_traceparent(traceparent)
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = None, None
+
+    span = Span(name, trace_id, parent_id, **attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+def inject(headers: Optional[dict] = None) -> dict:
+    """Returns a copy of the given request headers with the traceparent of the current span, if any."""
+    headers = dict(headers or {})
+    span = _current_span.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    return headers
+
+class TracingMiddleware:
+    """Pure ASGI middleware running every request in a span, continuing the trace of the caller if it sent one."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = dict(scope["headers"]).get(b"traceparent", b"").decode("latin-1")
+        async def send_with_status(message) -> None:
+            if message["type"] == "http.response.start":
+                span.attributes["status"] = message["status"]
+            await send(message)
+
+        with start_span(f"{scope['method']} {scope['path']}", traceparent) as span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Name the span after the route template, so the spans of one endpoint can be grouped
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.name = f"{scope['method']} {route}"
+                    span.attributes["path"] = scope["path"]
+
+def instrument_engine(engine: Engine) -> None:
+    """Records every SQL statement of an engine as a child span of the current request."""
+    if not TRACE_DIR:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_statement_span(conn, cursor, statement, parameters, context, executemany):
+        parent = _current_span.get()
+        if parent is None:
+            context.trace_span = None  # startup and background statements are not part of a trace
+            return
+        operation = statement.split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        context.trace_span = Span(f"sqlite {operation}", parent.trace_id, parent.span_id, statement=" ".join(statement.split())[:200])
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_statement_span(conn, cursor, statement, parameters, context, executemany):
+        if context.trace_span is not None:
+            context.trace_span.end()
+
+    # A failed statement never reaches after_cursor_execute
+    @event.listens_for(engine, "handle_error")
+    def end_failed_statement_span(exception_context):
+        context = exception_context.execution_context
+        span = getattr(context, "trace_span", None)
+        if span is not None:
+            span.error = repr(exception_context.original_exception)
+            span.end()
+            context.trace_span = None